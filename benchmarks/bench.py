@@ -0,0 +1,260 @@
+# Copyright (C) 2021
+# Author: Kacper Sokol <ks1591@my.bristol.ac.uk>
+# License: new BSD
+"""
+Benchmarks the Sphinx build pipeline of the `sphinx_term` extensions on
+synthetic corpora (see `corpus.py`).
+
+Each scenario generates a corpus and builds it with the HTML builder in
+a fresh process, measuring:
+
+* the time spent in the read, resolve and write phases (in seconds);
+* the peak resident set size of the build (in MiB); and
+* the size of the pickled Sphinx environment and doctrees (in KiB).
+
+The benchmarks are executed with::
+
+   python benchmarks/bench.py [-s SCENARIO] [-r REPEAT] [-j JOBS]
+                              [--baseline FILE] [--save-baseline FILE]
+                              [--threshold FRACTION]
+
+When a baseline file (created with `--save-baseline`) is given, every metric
+is compared against it and the exit code is `1` if any of them exceeds its
+baseline value by more than the threshold fraction.
+Since timings and memory usage depend on the machine, baselines should be
+recorded on the machine used for the comparison.
+"""
+
+import argparse
+import collections
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import corpus  # noqa: E402
+
+# scenario name -> `(documents, boxes, lines)`
+SCENARIOS = collections.OrderedDict([
+    ('small', (50, 4, 20)),
+    ('wide', (400, 4, 20)),
+    ('deep', (50, 8, 500)),
+    ('large', (200, 10, 200))
+])
+DEFAULT_SCENARIOS = ['small', 'wide', 'deep']
+
+# metrics where lower is better, compared against the baselines
+METRICS = ['read', 'resolve', 'write', 'total', 'peak_rss_mib',
+           'environment_kib', 'doctrees_kib']
+THRESHOLD = 0.25
+REPOSITORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# timings shorter than this (in seconds) are too noisy to be compared
+TIME_RESOLUTION = 0.05
+
+
+#### Build measurements #######################################################
+
+
+def measure_build(srcdir, jobs):
+    """
+    Builds a Sphinx project with the HTML builder and measures the build.
+    (This function is executed in a fresh process by `run_build`.)
+    """
+    from sphinx.application import Sphinx
+    from sphinx.environment import BuildEnvironment
+
+    timings = collections.defaultdict(float)
+    marks = {}
+
+    # the resolve phase is interleaved with the write phase, hence it is
+    # measured by timing the resolution of each doctree
+    get_and_resolve_doctree = BuildEnvironment.get_and_resolve_doctree
+
+    def timed_get_and_resolve_doctree(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return get_and_resolve_doctree(self, *args, **kwargs)
+        finally:
+            timings['resolve'] += time.perf_counter() - start
+
+    BuildEnvironment.get_and_resolve_doctree = timed_get_and_resolve_doctree
+
+    def mark(name):
+        def handler(*args):
+            marks[name] = time.perf_counter()
+        return handler
+
+    outdir = os.path.join(srcdir, '_build', 'html')
+    doctreedir = os.path.join(srcdir, '_build', 'doctrees')
+    start = time.perf_counter()
+    with open(os.devnull, 'w') as devnull:
+        app = Sphinx(srcdir, srcdir, outdir, doctreedir, 'html',
+                     status=devnull, warning=sys.stderr, freshenv=True,
+                     parallel=jobs)
+        app.connect('env-before-read-docs', mark('read_start'))
+        app.connect('env-updated', mark('read_end'))
+        app.build()
+    end = time.perf_counter()
+
+    read = marks['read_end'] - marks['read_start']
+    write = end - marks['read_end'] - timings['resolve']
+    peak_rss = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                   resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+
+    doctrees = 0
+    for root, _, filenames in os.walk(doctreedir):
+        doctrees += sum(os.path.getsize(os.path.join(root, i))
+                        for i in filenames if i.endswith('.doctree'))
+
+    return {
+        'read': read,
+        'resolve': timings['resolve'],
+        'write': write,
+        'total': end - start,
+        'peak_rss_mib': peak_rss / 1024,  # ru_maxrss is given in KiB
+        'environment_kib': os.path.getsize(
+            os.path.join(doctreedir, 'environment.pickle')) / 1024,
+        'doctrees_kib': doctrees / 1024
+    }
+
+
+def run_build(srcdir, jobs):
+    """Measures a Sphinx build of the project in a fresh process."""
+    # benchmark the working copy of the extension rather than the installed
+    # one (if any)
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [REPOSITORY] + [i for i in [env.get('PYTHONPATH')] if i])
+    output = subprocess.check_output(
+        [sys.executable, os.path.abspath(__file__),
+         '--measure', srcdir, '--jobs', str(jobs)], env=env)
+    return json.loads(output.decode('utf-8'))
+
+
+def run_scenario(name, repeat, jobs):
+    """
+    Generates the corpus of a scenario and builds it `repeat` times.
+
+    Returns the corpus description and the best (minimum) value of each
+    metric.
+    """
+    documents, boxes, lines = SCENARIOS[name]
+    workdir = tempfile.mkdtemp(prefix='sphinx-term-bench-')
+    try:
+        description = corpus.generate_corpus(
+            workdir, documents=documents, boxes=boxes, lines=lines)
+        results = []
+        for _ in range(repeat):
+            shutil.rmtree(os.path.join(workdir, '_build'),
+                          ignore_errors=True)
+            results.append(run_build(workdir, jobs))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return description, {
+        metric: min(result[metric] for result in results)
+        for metric in METRICS}
+
+
+#### Baselines ################################################################
+
+
+def compare(name, metrics, baseline, threshold):
+    """
+    Compares the metrics of a scenario against their baseline values.
+
+    Returns a list of regression messages.
+    """
+    regressions = []
+    for metric in METRICS:
+        if metric not in baseline:
+            continue
+        value, reference = metrics[metric], baseline[metric]
+        if metric in ('read', 'resolve', 'write', 'total'):
+            reference = max(reference, TIME_RESOLUTION)
+        if value > reference * (1 + threshold):
+            regressions.append(
+                '{}: {} regressed by {:.0%} ({:.3f} > {:.3f})'.format(
+                    name, metric, value / reference - 1, value, reference))
+    return regressions
+
+
+def format_table(results):
+    """Formats the benchmark results as a text table."""
+    header = ['scenario', 'docs', 'boxes', 'lines'] + METRICS
+    rows = [header]
+    for name, (description, metrics) in results.items():
+        rows.append(
+            [name, str(description['documents']), str(description['boxes']),
+             str(description['lines'])]
+            + ['{:.3f}'.format(metrics[i]) for i in METRICS])
+    widths = [max(len(row[i]) for row in rows) for i in range(len(header))]
+    return '\n'.join(
+        '  '.join(cell.rjust(width) for cell, width in zip(row, widths))
+        for row in rows)
+
+
+def main(argv=None):
+    """Runs the benchmarks from the command line."""
+    parser = argparse.ArgumentParser(
+        description='Benchmarks the Sphinx build pipeline of sphinx-term.')
+    parser.add_argument(
+        '-s', '--scenario', action='append', choices=list(SCENARIOS),
+        help='the scenario to run (can be repeated; default: {})'.format(
+            ', '.join(DEFAULT_SCENARIOS)))
+    parser.add_argument(
+        '-r', '--repeat', type=int, default=3,
+        help='the number of builds per scenario (default: 3)')
+    parser.add_argument(
+        '-j', '--jobs', type=int, default=1,
+        help='the number of Sphinx build processes (default: 1)')
+    parser.add_argument(
+        '--baseline', metavar='FILE',
+        help='compare the results against a baseline file')
+    parser.add_argument(
+        '--save-baseline', metavar='FILE',
+        help='save the results as a baseline file')
+    parser.add_argument(
+        '--threshold', type=float, default=THRESHOLD,
+        help='the tolerated fraction by which a metric may exceed its '
+             'baseline (default: {})'.format(THRESHOLD))
+    parser.add_argument('--measure', metavar='SRCDIR', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.measure:
+        print(json.dumps(measure_build(args.measure, args.jobs)))
+        return 0
+
+    results = collections.OrderedDict()
+    for name in args.scenario or DEFAULT_SCENARIOS:
+        results[name] = run_scenario(name, max(args.repeat, 1), args.jobs)
+    print(format_table(results))
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump({name: metrics
+                       for name, (_, metrics) in results.items()},
+                      f, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baselines = json.load(f)
+        regressions = []
+        for name, (_, metrics) in results.items():
+            if name in baselines:
+                regressions += compare(
+                    name, metrics, baselines[name], args.threshold)
+        for regression in regressions:
+            print(regression, file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
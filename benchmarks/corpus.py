@@ -0,0 +1,128 @@
+# Copyright (C) 2021
+# Author: Kacper Sokol <ks1591@my.bristol.ac.uk>
+# License: new BSD
+"""
+Generates synthetic Sphinx projects for benchmarking the `sphinx_term`
+extensions.
+
+A corpus holds `documents` pages, each with `boxes` terminal boxes of
+`lines` lines.
+The boxes alternate between `cssterm` and `termynal`, and a `file_ratio`
+fraction of them load their content from transcript files (the rest hold
+their content inline).
+Since the id of a file-backed box is derived from the name of its transcript
+file, each transcript file is used by exactly one box.
+The corpus is fully determined by its parameters and the random `seed`.
+"""
+
+import os
+import random
+
+CONF = """\
+extensions = ['sphinx_term']
+sphinx_term_cssterm_dir = 'transcripts'
+sphinx_term_termynal_dir = 'transcripts'
+# the global navigation sidebar scales quadratically with the number of pages
+# and would dominate the write phase of large corpora
+html_sidebars = {'**': []}
+"""
+
+INDEX = """\
+Benchmark corpus
+================
+
+.. toctree::
+   :maxdepth: 1
+
+{}
+"""
+
+WORDS = ['build', 'test', 'deploy', 'install', 'configure', 'make', 'run',
+         'check', 'fetch', 'clean', 'lint', 'package', 'release', 'sync']
+
+
+#### Transcripts ##############################################################
+
+
+def cssterm_lines(rng, count):
+    """Generates `count` lines of a cssterm transcript."""
+    lines = []
+    for i in range(count):
+        if i % 5 == 0:
+            lines.append('$ {} --{} {}'.format(
+                rng.choice(WORDS), rng.choice(WORDS), i))
+        else:
+            lines.append('{} {} ... ok [{}ms]'.format(
+                rng.choice(WORDS), rng.choice(WORDS), rng.randint(1, 999)))
+    return lines
+
+
+def termynal_lines(rng, count):
+    """Generates `count` lines of a (yml-formatted) termynal transcript."""
+    lines = []
+    for i in range(count):
+        if i % 5 == 0:
+            lines.append('- value: {} --{} {}'.format(
+                rng.choice(WORDS), rng.choice(WORDS), i))
+            lines.append('  type: input')
+        elif i % 17 == 0:
+            lines.append('- type: progress')
+        elif i % 11 == 0:
+            lines.append('-')
+        else:
+            lines.append('- "{} {} ... ok [{}ms]"'.format(
+                rng.choice(WORDS), rng.choice(WORDS), rng.randint(1, 999)))
+    return lines
+
+
+#### Corpus ###################################################################
+
+
+def generate_corpus(path, documents=50, boxes=4, lines=20, file_ratio=0.5,
+                    seed=0):
+    """
+    Generates a synthetic Sphinx project in the `path` directory.
+
+    Returns a dictionary describing the corpus.
+    """
+    rng = random.Random(seed)
+    transcript_dir = os.path.join(path, 'transcripts')
+    os.makedirs(transcript_dir, exist_ok=True)
+
+    with open(os.path.join(path, 'conf.py'), 'w') as f:
+        f.write(CONF)
+
+    docnames = []
+    file_boxes = 0
+    for d in range(documents):
+        docname = 'doc{}'.format(d)
+        docnames.append(docname)
+        page = ['Document {}'.format(d), '=' * 79, '']
+        for b in range(boxes):
+            box_type, extension, generate = (
+                ('cssterm', 'log', cssterm_lines) if b % 2 == 0
+                else ('termynal', 'yml', termynal_lines))
+            box_id = 'doc{}-box{}'.format(d, b)
+            page.append('.. {}:: {}:{}'.format(box_type, box_type, box_id))
+            page.append('')
+            transcript = generate(rng, lines)
+            if rng.random() < file_ratio:
+                file_boxes += 1
+                transcript_path = os.path.join(
+                    transcript_dir, '{}.{}'.format(box_id, extension))
+                with open(transcript_path, 'w') as f:
+                    f.write('\n'.join(transcript))
+            else:
+                page += ['   {}'.format(i) for i in transcript]
+                page.append('')
+        with open(os.path.join(path, '{}.rst'.format(docname)), 'w') as f:
+            f.write('\n'.join(page))
+
+    with open(os.path.join(path, 'index.rst'), 'w') as f:
+        f.write(INDEX.format(
+            '\n'.join('   {}'.format(i) for i in docnames)))
+
+    return {'documents': documents,
+            'boxes': documents * boxes,
+            'file_boxes': file_boxes,
+            'lines': lines}
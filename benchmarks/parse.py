@@ -0,0 +1,168 @@
+# Copyright (C) 2021
+# Author: Kacper Sokol <ks1591@my.bristol.ac.uk>
+# License: new BSD
+"""
+Benchmarks the parsing of (large) termynal transcripts.
+
+A synthetic termynal transcript of `lines` lines (see
+`corpus.termynal_lines`) is parsed into the packed text and line records of
+a termynal box (see `sphinx_term.termynal.parse_termynal_lines`) by:
+
+* `stream` -- the streaming parser used by the `termynal` directive, which
+  packs every termynal line as soon as it is parsed; and
+* `load` -- loading the entire YAML document before processing its lines
+  (the approach used before the parser was streamed), for reference.
+
+Both are run with the libyaml-based `CSafeLoader` (when PyYAML was built
+with libyaml) and the pure-Python `SafeLoader`, measuring:
+
+* the parse time (the best of `repeat` runs, in seconds); and
+* the peak memory allocated by Python while parsing (in MiB) -- measured
+  with `tracemalloc` in a separate run, hence the memory allocated by
+  libyaml itself is not included.
+
+The benchmark is executed with::
+
+   python benchmarks/parse.py [-l LINES] [-r REPEAT]
+"""
+
+import argparse
+import gc
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+REPOSITORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+# benchmark the working copy of the extension rather than the installed one
+# (if any)
+sys.path.insert(0, REPOSITORY)
+import corpus  # noqa: E402
+import sphinx_term.termynal as termynal  # noqa: E402
+
+LINES = 50000
+
+
+#### Parsers ##################################################################
+
+
+def parse_stream(contents):
+    """Parses a termynal transcript with the streaming parser."""
+    return termynal.parse_termynal_lines(contents)
+
+
+def parse_load(contents):
+    """Parses a termynal transcript by loading the entire YAML document."""
+    import yaml
+    lines = yaml.load(contents, Loader=termynal.get_yaml_loader())
+    return termynal.pack_termynal_lines(
+        [termynal.process_termynal_line(line) for line in lines])
+
+
+PARSERS = [('stream', parse_stream), ('load', parse_load)]
+
+
+def get_loaders():
+    """Returns the available YAML loaders."""
+    import yaml
+    loaders = []
+    if hasattr(yaml, 'CSafeLoader'):
+        loaders.append(('CSafeLoader', yaml.CSafeLoader))
+    loaders.append(('SafeLoader', yaml.SafeLoader))
+    return loaders
+
+
+#### Measurements #############################################################
+
+
+def measure_time(parse, contents, repeat):
+    """Returns the best time (in seconds) of parsing a transcript."""
+    best = float('inf')
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        parse(contents)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def measure_memory(parse, contents):
+    """
+    Returns the peak memory (in MiB) allocated by Python while parsing
+    a transcript.
+    """
+    gc.collect()
+    tracemalloc.start()
+    try:
+        parse(contents)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak / 1024 / 1024
+
+
+def run(lines, repeat):
+    """
+    Parses a synthetic transcript of `lines` lines with every parser and
+    loader.
+
+    Returns the size of the transcript (in bytes) and a list of
+    `(parser, loader, seconds, peak_mib)` tuples.
+    """
+    contents = '\n'.join(corpus.termynal_lines(random.Random(0), lines))
+    get_yaml_loader = termynal.get_yaml_loader
+    results = []
+    try:
+        for loader_name, loader in get_loaders():
+            termynal.get_yaml_loader = lambda: loader
+            reference = None
+            for parser_name, parse in PARSERS:
+                parsed = parse(contents)
+                if reference is None:
+                    reference = parsed
+                assert parsed == reference, (
+                    'The parsers disagree on the transcript.')
+                results.append(
+                    (parser_name, loader_name,
+                     measure_time(parse, contents, repeat),
+                     measure_memory(parse, contents)))
+    finally:
+        termynal.get_yaml_loader = get_yaml_loader
+    return len(contents.encode('utf-8')), results
+
+
+def format_table(results):
+    """Formats the benchmark results as a text table."""
+    header = ['parser', 'loader', 'seconds', 'peak_mib']
+    rows = [header] + [
+        [parser, loader, '{:.3f}'.format(seconds), '{:.1f}'.format(peak)]
+        for parser, loader, seconds, peak in results]
+    widths = [max(len(row[i]) for row in rows) for i in range(len(header))]
+    return '\n'.join(
+        '  '.join(cell.rjust(width) for cell, width in zip(row, widths))
+        for row in rows)
+
+
+def main(argv=None):
+    """Runs the benchmark from the command line."""
+    parser = argparse.ArgumentParser(
+        description='Benchmarks the parsing of termynal transcripts.')
+    parser.add_argument(
+        '-l', '--lines', type=int, default=LINES,
+        help='the number of transcript lines (default: {})'.format(LINES))
+    parser.add_argument(
+        '-r', '--repeat', type=int, default=3,
+        help='the number of timed runs per parser (default: 3)')
+    args = parser.parse_args(argv)
+
+    size, results = run(args.lines, max(args.repeat, 1))
+    print('transcript: {} lines, {:.1f} MiB'.format(
+        args.lines, size / 1024 / 1024))
+    print(format_table(results))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,168 @@
+# Copyright (C) 2021
+# Author: Kacper Sokol <ks1591@my.bristol.ac.uk>
+# License: new BSD
+"""
+Benchmarks the startup cost of the `sphinx_term` extensions.
+
+Each measurement is taken in a fresh process, in which a Sphinx application
+(with the HTML builder) of an empty project without extensions is created
+first, and consists of:
+
+* the time spent importing the extension modules (in milliseconds); and
+* the time spent setting up the extensions (in milliseconds) -- running
+  their `setup` functions and their `builder-inited` event handlers, e.g.,
+  building the asset bundles.
+
+(When `sphinx_term` is loaded, the `sphinx_term.cssterm` and
+`sphinx_term.termynal` modules are imported during its setup.)
+
+All the measurements share the project (and its build directory), hence --
+after an untimed warm-up run -- they correspond to the startup of
+incremental builds.
+
+The benchmark is executed with::
+
+   python benchmarks/startup.py [-e EXTENSION] [-r REPEAT] [--budget MS]
+
+and its exit code is `1` if the startup time -- the sum of the (median)
+import and setup times -- exceeds the budget.
+"""
+
+import argparse
+import collections
+import importlib
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+REPOSITORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_EXTENSIONS = ['sphinx_term']
+# the tolerated startup time (in milliseconds)
+BUDGET = 10.0
+
+INDEX = """\
+Startup benchmark
+=================
+"""
+
+
+#### Startup measurements #####################################################
+
+
+def create_project():
+    """Creates an empty Sphinx project without extensions."""
+    srcdir = tempfile.mkdtemp(prefix='sphinx-term-startup-')
+    with open(os.path.join(srcdir, 'conf.py'), 'w') as f:
+        f.write('extensions = []\n')
+    with open(os.path.join(srcdir, 'index.rst'), 'w') as f:
+        f.write(INDEX)
+    return srcdir
+
+
+def measure_startup(extensions, srcdir):
+    """
+    Measures the time spent importing and setting up the extensions.
+    (This function is executed in a fresh process by `run_startup`.)
+    """
+    from sphinx.application import Sphinx
+
+    with open(os.devnull, 'w') as devnull:
+        app = Sphinx(srcdir, srcdir, os.path.join(srcdir, '_build', 'html'),
+                     os.path.join(srcdir, '_build', 'doctrees'), 'html',
+                     status=devnull, warning=sys.stderr)
+
+    start = time.perf_counter()
+    for extension in extensions:
+        importlib.import_module(extension)
+    imported = time.perf_counter()
+
+    # the builder is already initialised, hence the `builder-inited` handlers
+    # registered by the extensions are called explicitly
+    listeners = list(app.events.listeners['builder-inited'])
+    for extension in extensions:
+        app.setup_extension(extension)
+    for listener in app.events.listeners['builder-inited']:
+        if listener not in listeners:
+            listener.handler(app)
+    set_up = time.perf_counter()
+
+    return {'import': (imported - start) * 1000,
+            'setup': (set_up - imported) * 1000}
+
+
+def run_startup(extensions, srcdir):
+    """Measures the startup of the extensions in a fresh process."""
+    # benchmark the working copy of the extension rather than the installed
+    # one (if any)
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [REPOSITORY] + [i for i in [env.get('PYTHONPATH')] if i])
+    output = subprocess.check_output(
+        [sys.executable, os.path.abspath(__file__),
+         '--measure', json.dumps([extensions, srcdir])], env=env)
+    return json.loads(output.decode('utf-8'))
+
+
+def benchmark_startup(extensions, repeat):
+    """
+    Measures the startup of the extensions `repeat` times (following
+    a warm-up run).
+
+    Returns the median import and setup times, and their sum.
+    """
+    srcdir = create_project()
+    try:
+        run_startup(extensions, srcdir)
+        results = [run_startup(extensions, srcdir) for _ in range(repeat)]
+    finally:
+        shutil.rmtree(srcdir, ignore_errors=True)
+    medians = collections.OrderedDict(
+        (metric, statistics.median(result[metric] for result in results))
+        for metric in ('import', 'setup'))
+    medians['startup'] = sum(medians.values())
+    return medians
+
+
+def main(argv=None):
+    """Runs the benchmark from the command line."""
+    parser = argparse.ArgumentParser(
+        description='Benchmarks the startup cost of sphinx-term.')
+    parser.add_argument(
+        '-e', '--extension', action='append',
+        help='the extension to load (can be repeated; default: {})'.format(
+            ', '.join(DEFAULT_EXTENSIONS)))
+    parser.add_argument(
+        '-r', '--repeat', type=int, default=9,
+        help='the number of measurements (default: 9)')
+    parser.add_argument(
+        '--budget', type=float, default=BUDGET,
+        help='the tolerated startup time in milliseconds '
+             '(default: {})'.format(BUDGET))
+    parser.add_argument('--measure', metavar='[EXTENSIONS, SRCDIR]',
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.measure:
+        print(json.dumps(measure_startup(*json.loads(args.measure))))
+        return 0
+
+    extensions = args.extension or DEFAULT_EXTENSIONS
+    results = benchmark_startup(extensions, max(args.repeat, 1))
+    print('extensions: {}'.format(', '.join(extensions)))
+    for metric, value in results.items():
+        print('{:>7}: {:.1f} ms'.format(metric, value))
+
+    if results['startup'] > args.budget:
+        print('startup time exceeds the budget ({:.1f} ms > {:.1f} '
+              'ms)'.format(results['startup'], args.budget), file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
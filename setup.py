@@ -21,6 +21,7 @@ URL = 'https://github.com/So-Cool/{}'.format(DISTNAME)
 DOWNLOAD_URL = 'https://pypi.org/project/{}/#files'.format(DISTNAME)
 PYTHON_REQUIRES = '~=3.5'  # Python 3.5 and up but not yet Python 4
 INSTALL_REQUIRES = ['docutils', 'sphinx>=3', 'pyyaml']
+EXTRAS_REQUIRE = {'brotli': ['Brotli']}  # brotli precompression
 PACKAGES = find_packages(exclude=['*.tests', '*.tests.*', 'tests.*', 'tests'])
 INCLUDE_PACKAGE_DATA = True
 ZIP_SAFE = False  # We are using static files
@@ -38,6 +39,7 @@ def setup_package():
                     download_url=DOWNLOAD_URL,
                     python_requires=PYTHON_REQUIRES,
                     install_requires=INSTALL_REQUIRES,
+                    extras_require=EXTRAS_REQUIRE,
                     packages=PACKAGES,
                     include_package_data=INCLUDE_PACKAGE_DATA,
                     zip_safe=ZIP_SAFE)
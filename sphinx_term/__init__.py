@@ -5,15 +5,28 @@
 A Sphinx extension implementing the `cssterm` and `termynal` directives
 for authoring vivacious terminal transcripts.
 This extension is compatible with, and intended for, Jupyter Book.
+
+This module only depends on the standard library, hence it can be imported
+without Sphinx (e.g., by `setup.py`); the heavier dependencies of
+the extensions are imported by their modules -- some of them lazily.
 """
 
+import collections
+import functools
+import hashlib
 import os
+import time
 
 VERSION = '0.1'
 __version__ = VERSION
 
 _STATIC_PATH = os.path.join(os.path.dirname(__file__), '_static')
 
+TRANSCRIPT_CACHE_SIZE = 256
+# the directory (within the Sphinx doctree directory) holding the terminal
+# transcripts whose content is not embedded in the doctrees
+TRANSCRIPT_STORE_DIR = 'sphinx_term_store'
+
 
 def file_exists(file_path, file_type='code'):
     """Checks whether a path exists and is a file."""
@@ -36,24 +49,16 @@ def get_static_path(filename):
     return file_path
 
 
-def is_css_registered(app, filename):
-    """
-    Checks whether a given css file has been added to the Sphinx register.
+def get_asset_names(asset_files):
     """
-    for css_file, _ in app.registry.css_files:
-        if filename == css_file:
-            return True
-    return False
+    Returns the names of static files listed in a page context.
 
-
-def is_js_registered(app, filename):
-    """
-    Checks whether a given js file has been added to the Sphinx register.
+    Depending on the Sphinx version, the `css_files` and `script_files`
+    entries of a page context hold either strings or asset objects with
+    a `filename` attribute.
     """
-    for js_file, _ in app.registry.js_files:
-        if filename == js_file:
-            return True
-    return False
+    return [getattr(asset_file, 'filename', asset_file)
+            for asset_file in asset_files]
 
 
 def include_static_path(app):
@@ -108,3 +113,1037 @@ def localise_term_directory(src_dir, st_term_dir, request_type):
         raise RuntimeError('The {} ({}) does not exist.'.format(
             request_type[0], localised_directory))
     return localised_directory
+
+
+#### Transcript index #########################################################
+
+# the transcript indexes of the current build -- a `{(box_type, extension):
+# TranscriptIndex}` dictionary, which is inherited by parallel reader
+# processes
+_TRANSCRIPT_INDEXES = {}
+
+
+class TranscriptIndex(object):
+    """
+    An index of the terminal transcript files with the given `extension`
+    held by an ordered list of search directories and their subdirectories
+    (except the hidden ones and symbolic links to directories).
+
+    A terminal box id (without its `box_type:` prefix) maps to:
+
+    * the file whose path relative to a search directory -- without the
+      extension and with `/` separators -- is the id, found in the first
+      search directory holding such a file (i.e., earlier directories shadow
+      later ones); otherwise
+    * the file in a subdirectory whose name without the extension is the id
+      (for ids without `/`) -- if there are several such files, the id is
+      *ambiguous* and the first file in the search order (the search
+      directories in order, each walked in alphabetical order) is used.
+    """
+
+    def __init__(self, directories, extension):
+        """Scans the search `directories` for transcript files."""
+        self.directories = list(directories)
+        self.extension = extension
+        self._paths = {}
+        self._names = {}
+        for directory in self.directories:
+            self._scan(directory, '')
+
+    def __len__(self):
+        return len(self._paths)
+
+    def _scan(self, directory, prefix):
+        """Indexes the transcript files of a directory (recursively)."""
+        try:
+            entries = sorted(os.scandir(directory), key=lambda e: e.name)
+        except OSError:
+            return
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                if not entry.name.startswith('.'):
+                    self._scan(
+                        entry.path, '{}{}/'.format(prefix, entry.name))
+            elif entry.name.endswith(self.extension) and entry.is_file():
+                name = entry.name[:-len(self.extension)]
+                self._paths.setdefault(prefix + name, entry.path)
+                if prefix:
+                    self._names.setdefault(name, []).append(entry.path)
+
+    def find(self, term_id):
+        """
+        Finds the transcript file of a terminal box id -- returns a `(path,
+        candidates)` tuple, where `path` is `None` if no file matches the id
+        and `candidates` lists all the files matching an ambiguous id.
+        """
+        path = self._paths.get(term_id, None)
+        if path is not None:
+            return path, []
+        candidates = self._names.get(term_id, [])
+        if len(candidates) == 1:
+            return candidates[0], []
+        elif candidates:
+            return candidates[0], list(candidates)
+        return None, []
+
+
+def get_transcript_index(env, box_type, extension):
+    """
+    Returns the index of the transcript files held by the search directories
+    given by the `sphinx_term_<box_type>_dir` config value -- either a path
+    or a list of paths -- which is built on first use in every build.
+    """
+    key = (box_type, extension)
+    index = _TRANSCRIPT_INDEXES.get(key, None)
+    if index is None:
+        config_name = 'sphinx_term_{}_dir'.format(box_type)
+        directories = getattr(env.config, config_name)
+        if directories is None or isinstance(directories, str):
+            directories = [directories]
+        request_type = (config_name, '{} box content'.format(box_type))
+        index = TranscriptIndex(
+            [localise_term_directory(env.srcdir, directory, request_type)
+             for directory in (directories or [None])], extension)
+        _TRANSCRIPT_INDEXES[key] = index
+    return index
+
+
+def reset_transcript_indexes(app):
+    """
+    Discards the transcript indexes of the previous build.
+    (Attached to the `builder-inited` Sphinx event.)
+    """
+    _TRANSCRIPT_INDEXES.clear()
+
+
+def get_transcript_lookups(env):
+    """
+    Returns the transcript lookup record stored in the Sphinx environment,
+    which maps the name of every document that loads terminal transcripts
+    from files to a dictionary, which maps the `(box_type, extension, id)`
+    tuple of each box to the path of its transcript (relative to the source
+    directory) at the time the document was read.
+    """
+    if not hasattr(env, 'sphinx_term_lookups'):
+        env.sphinx_term_lookups = {}
+    return env.sphinx_term_lookups
+
+
+def find_transcript(env, box_type, extension, term_id, location=None):
+    """
+    Returns the path to the transcript file of a terminal box id (without
+    its `box_type:` prefix) found in the transcript index (see
+    `TranscriptIndex` and `get_transcript_index`).
+
+    Ids missing from the index are resolved against the first search
+    directory, raising a `RuntimeError` if the file does not exist.
+    When the `location` of the box is given (by its directive), ambiguous
+    ids are reported and the lookup is recorded for the current document
+    (see `get_outdated_documents`).
+    """
+    index = get_transcript_index(env, box_type, extension)
+    path, candidates = index.find(term_id)
+    if path is None:
+        path = os.path.join(
+            index.directories[0], '{}{}'.format(term_id, extension))
+        file_exists(path)
+
+    if location is not None:
+        if candidates:
+            from sphinx.util import logging
+            logger = logging.getLogger(__name__)
+            logger.warning(
+                '[sphinx-term] the %s box id (%s) is ambiguous -- it matches '
+                '%s; the first one is used', box_type, term_id,
+                ', '.join(os.path.relpath(i, env.srcdir) for i in candidates),
+                location=location)
+        get_transcript_lookups(env).setdefault(env.docname, {})[
+            (box_type, extension, term_id)] = os.path.relpath(
+                path, env.srcdir)
+    return path
+
+
+#### Option validation ########################################################
+
+
+def is_string(value):
+    """Checks whether a value is a string."""
+    return isinstance(value, str)
+
+
+def is_non_empty_string(value):
+    """Checks whether a value is a non-empty string."""
+    return is_string(value) and bool(value)
+
+
+def is_non_negative_integer(value):
+    """Checks whether a value is a string encoding a non-negative integer."""
+    return isinstance(value, str) and value.isdigit()
+
+
+def is_positive_integer(value):
+    """Checks whether a value is a string encoding a positive integer."""
+    return is_non_negative_integer(value) and int(value) > 0
+
+
+def is_boolean(value):
+    """Checks whether a value is a string encoding a boolean."""
+    return isinstance(value, str) and value.lower() in ['true', 'false', '']
+
+
+def is_line_range(value):
+    """
+    Checks whether a value is a string encoding a range of (1-based) line
+    numbers, e.g., `10-20`.
+    """
+    return parse_line_range(value) is not None
+
+
+def to_boolean(value):
+    """Normalises a string encoding a boolean to `true` or `false`."""
+    return 'false' if value.lower() == 'false' else 'true'
+
+
+def parse_line_range(value):
+    """
+    Parses a string encoding a range of (1-based) line numbers, e.g.,
+    `10-20`, into a `(first, last)` tuple (`None` if the range is invalid).
+    """
+    if not isinstance(value, str):
+        return None
+    first, _, last = value.strip().partition('-')
+    if not (is_positive_integer(first.strip())
+            and is_positive_integer(last.strip())):
+        return None
+    first, last = int(first), int(last)
+    if first > last:
+        return None
+    return first, last
+
+
+def validate_options(options, schema, box_type):
+    """
+    Validates the options of a `box_type` directive against an option
+    schema, which maps each option name to a tuple whose first two elements
+    are the option validator and the description of the option type.
+
+    Returns a list of error messages (empty for valid options).
+    """
+    errors = []
+    for option, value in options.items():
+        if option not in schema:
+            errors.append('The *{}* parameter is not a valid {} '
+                          'option.'.format(option, box_type))
+            continue
+        validator, description = schema[option][:2]
+        if not validator(value):
+            errors.append('The *{}* parameter should be a {}.'.format(
+                option, description))
+    return errors
+
+
+#### Shared environment state #################################################
+
+
+def get_term_labels(env):
+    """
+    Returns the terminal box labels record stored in the Sphinx environment.
+
+    The record maps the name of every terminal box (e.g., `cssterm:my-id`) to
+    a dictionary holding a `(docname, node_id, title)` tuple -- mirroring the
+    `labels` record of the standard domain -- for every document that
+    displays the box, and is created if it does not exist yet.
+    A single transcript may be displayed by many documents, in which case all
+    of its boxes share the same name.
+    """
+    if not hasattr(env, 'sphinx_term_labels'):
+        env.sphinx_term_labels = {}
+    return env.sphinx_term_labels
+
+
+def add_term_label(env, name, docname, node_id, title):
+    """Records the label of a terminal box displayed by a document."""
+    labels = get_term_labels(env)
+    labels.setdefault(name, {})[docname] = (docname, node_id, title)
+
+
+def purge_term_labels(app, env, docname):
+    """
+    Removes the terminal box labels of a document that is about to be
+    (re-)read.
+    (Attached to the `env-purge-doc` Sphinx event.)
+    """
+    labels = get_term_labels(env)
+    for name, instances in list(labels.items()):
+        instances.pop(docname, None)
+        if not instances:
+            del labels[name]
+
+
+def merge_term_labels(app, env, docnames, other):
+    """
+    Merges the terminal box labels collected by a parallel reader process.
+    (Attached to the `env-merge-info` Sphinx event.)
+    """
+    labels = get_term_labels(env)
+    for name, instances in get_term_labels(other).items():
+        for docname, data in instances.items():
+            if docname in docnames:
+                labels.setdefault(name, {})[docname] = data
+
+
+def resolve_term_label(instances):
+    """
+    Returns the `(docname, node_id, title)` tuple that a terminal box label
+    refers to -- the box displayed by the first document (in the order of
+    document names) when many documents share the label.
+
+    This choice does not depend on the order in which the documents are read,
+    hence serial, parallel and incremental builds resolve shared labels to
+    the same box.
+    """
+    return instances[min(instances)]
+
+
+def unregister_term_labels(app, env, docnames):
+    """
+    Removes the terminal box labels from the standard domain before documents
+    are read, so that re-reading a document whose terminal box label is
+    shared with other documents does not raise a *duplicate label* warning.
+    (Attached to the `env-before-read-docs` Sphinx event.)
+
+    The labels are registered anew by `register_term_labels`.
+    """
+    domain = env.get_domain('std')
+    for name in get_term_labels(env):
+        domain.labels.pop(name, None)
+
+
+def register_term_labels(app, env):
+    """
+    Registers the terminal box labels with the standard domain, which allows
+    referencing terminal boxes with the default `terminal box` title.
+    (Attached to the `env-updated` Sphinx event.)
+
+    This function is executed by the main process once all the documents
+    have been read (and the results of parallel reader processes merged),
+    hence it is safe to modify the labels record of the standard domain.
+    The anonymous labels of shared terminal boxes are resolved in the same
+    way, overriding the one recorded by the last document read.
+    """
+    domain = env.get_domain('std')
+    for name, instances in get_term_labels(env).items():
+        docname, node_id, title = resolve_term_label(instances)
+        domain.labels[name] = (docname, node_id, title)
+        domain.anonlabels[name] = (docname, node_id)
+
+
+def add_box_name(directive, node, name):
+    """
+    Assigns a name (and the id derived from it) to the node of a terminal box
+    built by a directive, which makes the box referenceable.
+    (Called by the `cssterm` and `termynal` directives.)
+
+    Since the boxes are named after their transcripts, displaying the same
+    (part of a) transcript twice in a document would give two boxes the same
+    name -- docutils would then strip the names of the second box -- hence
+    this is reported as a directive error instead.
+    """
+    from docutils import nodes
+
+    document = directive.state.document
+    if nodes.fully_normalize_name(name) in document.nameids:
+        raise directive.error(
+            'The {} terminal box is already displayed by this document; '
+            'the same transcript (or transcript slice) can only be displayed '
+            'once per document.'.format(name))
+    directive.options['name'] = name
+    directive.add_name(node)
+
+
+#### Document index ###########################################################
+
+# terminal box types indexed by `index_document` (populated by extensions)
+_BOX_TYPES = collections.OrderedDict()
+
+
+def register_box_type(box_type, node_class, index_box):
+    """
+    Registers a type of terminal box nodes with the document index.
+
+    `index_box(app, node)` is called for every `node_class` node found in
+    a document; it validates the node and returns a record describing it,
+    which is stored in the document index under the `box_type` key
+    (`None` records are not stored).
+    """
+    _BOX_TYPES[box_type] = (node_class, index_box)
+
+
+def get_term_index(env):
+    """
+    Returns the document index stored in the Sphinx environment.
+
+    The index maps the name of every document holding terminal boxes to
+    a dictionary, which maps each box type found in this document to a list
+    of box records.
+    """
+    if not hasattr(env, 'sphinx_term_index'):
+        env.sphinx_term_index = {}
+    return env.sphinx_term_index
+
+
+def purge_term_index(app, env, docname):
+    """
+    Removes a document that is about to be (re-)read from the document index.
+    (Attached to the `env-purge-doc` Sphinx event.)
+    """
+    get_term_index(env).pop(docname, None)
+
+
+def merge_term_index(app, env, docnames, other):
+    """
+    Merges the document index built by a parallel reader process.
+    (Attached to the `env-merge-info` Sphinx event.)
+    """
+    index = get_term_index(env)
+    other_index = get_term_index(other)
+    for docname in docnames:
+        if docname in other_index:
+            index[docname] = other_index[docname]
+
+
+def index_document(app, document):
+    """
+    Indexes all the terminal boxes of a document in a single traversal.
+    (Attached to the `doctree-read` Sphinx event.)
+    """
+    node_classes = tuple(i for i, _ in _BOX_TYPES.values())
+
+    document_index = {}
+    for node in document.traverse(
+            lambda node: isinstance(node, node_classes)):
+        for box_type, (node_class, index_box) in _BOX_TYPES.items():
+            if isinstance(node, node_class):
+                record = index_box(app, node)
+                if record is not None:
+                    document_index.setdefault(box_type, []).append(record)
+
+    if document_index:
+        get_term_index(app.env)[app.env.docname] = document_index
+
+
+def get_page_boxes(app, docname, box_type):
+    """
+    Returns the records of the `box_type` terminal boxes displayed by
+    the HTML page built from the given document.
+    """
+    # terminal boxes are replaced with snapshots
+    if getattr(app.config, 'sphinx_term_snapshot_html', False):
+        return []
+
+    index = get_term_index(app.env)
+    # a single page holds all the documents
+    if app.builder.name == 'singlehtml':
+        records = []
+        for name in sorted(index):
+            records += index[name].get(box_type, [])
+        return records
+
+    return index.get(docname, {}).get(box_type, [])
+
+
+#### Build instrumentation ####################################################
+
+# whether the build is instrumented (see the `sphinx_term_report` config
+# value); this flag is set before any documents are read or written, hence
+# it is inherited by parallel reader and writer processes
+_INSTRUMENTED = False
+# the metrics of the terminal box that is currently being built
+_BOX_METRICS = None
+# the time spent in the HTML visitors of terminal box nodes -- a
+# `{docname: {box_type: seconds}}` dictionary of pages that are yet to be
+# reported (see `sphinx_term.report`)
+_VISITOR_METRICS = {}
+
+
+class _Measurement(object):
+    """Adds the time elapsed within a `with` block to a box metric."""
+    __slots__ = ('metric', 'start')
+
+    def __init__(self, metric):
+        self.metric = metric
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        if _BOX_METRICS is not None:
+            _BOX_METRICS[self.metric] += time.perf_counter() - self.start
+        return False
+
+
+class _NoMeasurement(object):
+    """A no-op replacement of `_Measurement` for uninstrumented builds."""
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NO_MEASUREMENT = _NoMeasurement()
+
+
+def set_instrumented(instrumented):
+    """Enables (or disables) the build instrumentation."""
+    global _INSTRUMENTED
+    _INSTRUMENTED = bool(instrumented)
+
+
+def measure(metric):
+    """
+    Returns a context manager that adds the time spent within its block to
+    the `metric` of the terminal box that is currently being built.
+    """
+    if _BOX_METRICS is None:
+        return _NO_MEASUREMENT
+    return _Measurement(metric)
+
+
+def count(metric, value=1):
+    """Adds a value to the `metric` of the terminal box being built."""
+    if _BOX_METRICS is not None:
+        _BOX_METRICS[metric] += value
+
+
+def get_term_metrics(env):
+    """
+    Returns the terminal box metrics record stored in the Sphinx
+    environment.
+
+    The record maps the name of every document read by the current build to
+    a list of box metrics dictionaries (see `instrument_directive`).
+    """
+    if not hasattr(env, 'sphinx_term_metrics'):
+        env.sphinx_term_metrics = {}
+    return env.sphinx_term_metrics
+
+
+def purge_term_metrics(app, env, docname):
+    """
+    Removes the terminal box metrics of a document that is about to be
+    (re-)read.
+    (Attached to the `env-purge-doc` Sphinx event.)
+    """
+    get_term_metrics(env).pop(docname, None)
+
+
+def merge_term_metrics(app, env, docnames, other):
+    """
+    Merges the terminal box metrics collected by a parallel reader process.
+    (Attached to the `env-merge-info` Sphinx event.)
+    """
+    metrics = get_term_metrics(env)
+    other_metrics = get_term_metrics(other)
+    for docname in docnames:
+        if docname in other_metrics:
+            metrics[docname] = other_metrics[docname]
+
+
+def instrument_directive(box_type, count_lines):
+    """
+    Decorates the `run` method of a terminal box directive to collect
+    the metrics of each box it builds in instrumented builds.
+
+    The `count_lines` function returns the number of terminal lines held
+    by the nodes returned by the directive.
+    """
+    def decorator(run):
+        @functools.wraps(run)
+        def instrumented_run(self):
+            if not _INSTRUMENTED:
+                return run(self)
+
+            global _BOX_METRICS
+            _BOX_METRICS = collections.Counter()
+            start = time.perf_counter()
+            try:
+                result = run(self)
+            finally:
+                box_metrics, _BOX_METRICS = _BOX_METRICS, None
+            box_metrics['time'] = time.perf_counter() - start
+            box_metrics['lines'] = count_lines(result)
+
+            env = self.state.document.settings.env
+            box_metrics = dict(box_metrics)
+            box_metrics.update(type=box_type, id=self.arguments[0],
+                               line=self.lineno)
+            get_term_metrics(env).setdefault(env.docname, []).append(
+                box_metrics)
+            return result
+        return instrumented_run
+    return decorator
+
+
+def instrument_visitor(box_type, visitor):
+    """
+    Wraps an HTML visitor (or departure) function of terminal box nodes to
+    measure the time spent in it in instrumented builds.
+    """
+    @functools.wraps(visitor)
+    def instrumented_visitor(self, node):
+        if not _INSTRUMENTED:
+            return visitor(self, node)
+        start = time.perf_counter()
+        try:
+            return visitor(self, node)
+        finally:
+            page = _VISITOR_METRICS.setdefault(
+                self.builder.current_docname, collections.Counter())
+            page[box_type] += time.perf_counter() - start
+    return instrumented_visitor
+
+
+def pop_visitor_metrics():
+    """Returns and clears the visitor metrics that are yet to be reported."""
+    metrics = dict(_VISITOR_METRICS)
+    _VISITOR_METRICS.clear()
+    return metrics
+
+
+#### Transcript dependencies ##################################################
+
+# the terminal transcript files read ahead of the directives loading them
+# (see `sphinx_term.prefetch`) -- a `{path: (mtime, size, contents)}`
+# dictionary, which is inherited by parallel reader processes
+_PREFETCHED = {}
+
+
+def get_transcript_digest(contents):
+    """Returns the hash of a terminal transcript string."""
+    return hashlib.sha1(contents.encode('utf-8')).hexdigest()
+
+
+def get_document_transcripts(env):
+    """
+    Returns the transcript dependency record stored in the Sphinx
+    environment.
+
+    The record maps the name of every document that loads terminal
+    transcripts from files to a dictionary, which maps the path of each
+    transcript (relative to the source directory) to the hash of its content
+    at the time the document was read.
+    """
+    if not hasattr(env, 'sphinx_term_dependencies'):
+        env.sphinx_term_dependencies = {}
+    return env.sphinx_term_dependencies
+
+
+def get_transcript_documents(env):
+    """
+    Returns the reverse transcript dependency index stored in the Sphinx
+    environment, which maps the path of every terminal transcript (relative
+    to the source directory) to the set of documents that load it.
+    """
+    if not hasattr(env, 'sphinx_term_dependents'):
+        env.sphinx_term_dependents = {}
+    return env.sphinx_term_dependents
+
+
+def get_transcript_stats(env):
+    """
+    Returns the transcript file status cache stored in the Sphinx
+    environment, which maps the path of every terminal transcript (relative
+    to the source directory) to a `(mtime, size, digest)` tuple.
+    """
+    if not hasattr(env, 'sphinx_term_transcript_stats'):
+        env.sphinx_term_transcript_stats = {}
+    return env.sphinx_term_transcript_stats
+
+
+def read_transcript_file(path):
+    """
+    Reads a terminal transcript file.
+
+    Returns a `(mtime, size, contents)` tuple -- the modification time and
+    the size of the file, and its content without the leading and trailing
+    new lines.
+    """
+    with open(path, 'r') as f:
+        stat = os.fstat(f.fileno())
+        contents = f.read().strip('\n')
+    return stat.st_mtime, stat.st_size, contents
+
+
+def set_prefetched_transcripts(transcripts):
+    """
+    Replaces the prefetched terminal transcripts (see `read_transcript`)
+    with a `{path: (mtime, size, contents)}` dictionary.
+    """
+    _PREFETCHED.clear()
+    _PREFETCHED.update(transcripts)
+
+
+def read_transcript(env, path):
+    """
+    Reads a terminal transcript file -- unless it has been prefetched (see
+    `sphinx_term.prefetch`) -- and records that the current document depends
+    on its content.
+
+    Unlike `env.note_dependency`, which causes the document to be re-read
+    whenever the modification time of the file changes, the dependency is
+    tracked by content (see `get_outdated_documents`).
+    """
+    with measure('io'):
+        transcript = _PREFETCHED.get(path, None)
+        if transcript is None:
+            transcript = read_transcript_file(path)
+    mtime, size, contents = transcript
+    count('bytes', size)
+    digest = get_transcript_digest(contents)
+
+    rel_path = os.path.relpath(path, env.srcdir)
+    get_transcript_stats(env)[rel_path] = (mtime, size, digest)
+    get_document_transcripts(env).setdefault(
+        env.docname, {})[rel_path] = digest
+    get_transcript_documents(env).setdefault(
+        rel_path, set()).add(env.docname)
+
+    return contents
+
+
+def hash_transcript(env, rel_path):
+    """
+    Returns the hash of the current content of a terminal transcript file
+    (`None` if the file cannot be read).
+
+    The file is only read if its modification time or size changed since
+    it was last hashed.
+    """
+    path = os.path.join(env.srcdir, rel_path)
+    stats = get_transcript_stats(env)
+    try:
+        stat = os.stat(path)
+    except OSError:
+        stats.pop(rel_path, None)
+        return None
+
+    mtime, size, digest = stats.get(rel_path, (None, None, None))
+    if mtime == stat.st_mtime and size == stat.st_size:
+        return digest
+
+    try:
+        with open(path, 'r') as f:
+            contents = f.read().strip('\n')
+    except (OSError, UnicodeDecodeError):
+        stats.pop(rel_path, None)
+        return None
+    digest = get_transcript_digest(contents)
+    stats[rel_path] = (stat.st_mtime, stat.st_size, digest)
+    return digest
+
+
+def purge_transcript_dependencies(app, env, docname):
+    """
+    Removes the transcript dependencies (and lookups) of a document that is
+    about to be (re-)read.
+    (Attached to the `env-purge-doc` Sphinx event.)
+    """
+    get_transcript_lookups(env).pop(docname, None)
+    documents = get_transcript_documents(env)
+    for rel_path in get_document_transcripts(env).pop(docname, {}):
+        docnames = documents.get(rel_path, set())
+        docnames.discard(docname)
+        if not docnames:
+            documents.pop(rel_path, None)
+
+
+def merge_transcript_dependencies(app, env, docnames, other):
+    """
+    Merges the transcript dependencies (and lookups) recorded by a parallel
+    reader process.
+    (Attached to the `env-merge-info` Sphinx event.)
+    """
+    lookups = get_transcript_lookups(env)
+    other_lookups = get_transcript_lookups(other)
+    for docname in docnames:
+        if docname in other_lookups:
+            lookups[docname] = other_lookups[docname]
+    transcripts = get_document_transcripts(env)
+    documents = get_transcript_documents(env)
+    other_transcripts = get_document_transcripts(other)
+    for docname in docnames:
+        if docname not in other_transcripts:
+            continue
+        transcripts[docname] = other_transcripts[docname]
+        for rel_path in other_transcripts[docname]:
+            documents.setdefault(rel_path, set()).add(docname)
+    get_transcript_stats(env).update(get_transcript_stats(other))
+
+
+def get_outdated_documents(app, env, added, changed, removed):
+    """
+    Finds the documents that need to be re-read since the content of
+    the terminal transcripts they load has changed.
+    (Attached to the `env-get-outdated` Sphinx event.)
+
+    Transcripts whose modification time changed but whose content did not,
+    e.g., after a `git checkout`, do not cause any rebuilds.
+    Documents whose terminal box ids now resolve to a different transcript
+    file (see `find_transcript`), e.g., a file added to an earlier search
+    directory, are re-read as well.
+    The transcripts that caused rebuilds are recorded in the environment as
+    a `{path: [docnames]}` dictionary (`env.sphinx_term_outdated`) and
+    reported by `report_outdated_documents`.
+    """
+    transcripts = get_document_transcripts(env)
+    outdated = collections.OrderedDict()
+    for rel_path, docnames in sorted(get_transcript_documents(env).items()):
+        digest = hash_transcript(env, rel_path)
+        stale = sorted(
+            docname for docname in docnames
+            if docname not in removed and docname not in changed
+            and transcripts.get(docname, {}).get(rel_path) != digest)
+        if stale:
+            outdated[rel_path] = stale
+
+    for docname, lookups in sorted(get_transcript_lookups(env).items()):
+        if docname in removed or docname in changed:
+            continue
+        for (box_type, extension, term_id), rel_path in lookups.items():
+            try:
+                path = find_transcript(env, box_type, extension, term_id)
+            except RuntimeError:
+                # missing transcripts are found by their content hash
+                continue
+            new_rel_path = os.path.relpath(path, env.srcdir)
+            if new_rel_path != rel_path:
+                stale = outdated.setdefault(new_rel_path, [])
+                if docname not in stale:
+                    stale.append(docname)
+    outdated = collections.OrderedDict(
+        (rel_path, sorted(stale))
+        for rel_path, stale in sorted(outdated.items()))
+
+    env.sphinx_term_outdated = outdated
+    return sorted(set(
+        docname for docnames in outdated.values() for docname in docnames))
+
+
+def report_outdated_documents(app, env, docnames):
+    """
+    Lists the terminal transcripts that caused documents to be re-read in
+    the build log.
+    (Attached to the `env-before-read-docs` Sphinx event.)
+    """
+    from sphinx.util import logging
+    logger = logging.getLogger(__name__)
+
+    for rel_path, stale in getattr(env, 'sphinx_term_outdated', {}).items():
+        logger.info('[sphinx-term] transcript %s changed; re-reading: %s',
+                    rel_path, ', '.join(stale))
+
+
+#### Transcript store #########################################################
+
+
+def get_stored_transcript_path(env, digest):
+    """Returns the path to a terminal transcript in the content store."""
+    return os.path.join(
+        env.doctreedir, TRANSCRIPT_STORE_DIR, '{}.txt'.format(digest))
+
+
+def store_transcript(env, contents):
+    """
+    Saves a terminal transcript in the content store kept in the doctree
+    directory under a name derived from its hash, therefore a transcript
+    used by many documents is only stored once.
+
+    Returns the hash of the transcript.
+    """
+    digest = get_transcript_digest(contents)
+    path = get_stored_transcript_path(env, digest)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write to a temporary file first so that concurrent (parallel)
+        # readers never see partially written transcripts
+        path_tmp = '{}.{}.tmp'.format(path, os.getpid())
+        with open(path_tmp, 'w', encoding='utf-8') as f:
+            f.write(contents)
+        os.replace(path_tmp, path)
+    return digest
+
+
+def load_stored_transcript(env, rel_path, digest):
+    """
+    Loads a terminal transcript from the content store.
+
+    If the transcript is missing from the store, it is read from its file
+    (`rel_path`, relative to the source directory) provided that the file
+    content has not changed since the document was read.
+    """
+    try:
+        with open(get_stored_transcript_path(env, digest), 'r',
+                  encoding='utf-8') as f:
+            return f.read()
+    except OSError:
+        pass
+
+    with open(os.path.join(env.srcdir, rel_path), 'r') as f:
+        contents = f.read().strip('\n')
+    if get_transcript_digest(contents) != digest:
+        raise RuntimeError('The terminal transcript file ({}) changed after '
+                           'it was read; please rebuild the '
+                           'documentation.'.format(rel_path))
+    return contents
+
+
+def prune_transcript_store(app, env):
+    """
+    Removes the transcripts that are no longer loaded by any document from
+    the content store.
+    (Attached to the `env-updated` Sphinx event.)
+    """
+    store_dir = os.path.join(env.doctreedir, TRANSCRIPT_STORE_DIR)
+    if not os.path.isdir(store_dir):
+        return
+
+    digests = set(digest
+                  for transcripts in get_document_transcripts(env).values()
+                  for digest in transcripts.values())
+    for filename in os.listdir(store_dir):
+        if filename[:-len('.txt')] not in digests:
+            os.remove(os.path.join(store_dir, filename))
+
+
+#### Transcript cache #########################################################
+
+
+class TranscriptCache(object):
+    """
+    A size-bounded cache of parsed terminal transcripts with the least
+    recently used eviction policy.
+
+    The cache is stored in the Sphinx environment, therefore it persists
+    between (incremental) builds.
+    Its entries are keyed by the terminal box type, the transcript path
+    (`None` for content given explicitly within a directive) and the hash
+    of the transcript content; each entry holds the validated, parsed
+    transcript.
+    """
+
+    def __init__(self, maxsize=TRANSCRIPT_CACHE_SIZE):
+        """Initialises an empty cache holding at most `maxsize` entries."""
+        self.maxsize = maxsize
+        self._entries = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key, default=None):
+        """Retrieves a cache entry and marks it as the most recently used."""
+        if key not in self._entries:
+            return default
+        self._entries.move_to_end(key)
+        return self._entries[key]
+
+    def put(self, key, value):
+        """Stores a cache entry, evicting the least recently used ones."""
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        self.evict()
+
+    def evict(self):
+        """Evicts the least recently used entries exceeding the cache size."""
+        while len(self._entries) > max(self.maxsize, 0):
+            self._entries.popitem(last=False)
+
+    def merge(self, other):
+        """Adds the entries of another cache to this one."""
+        for key, value in other._entries.items():
+            if key not in self._entries:
+                self._entries[key] = value
+        self.evict()
+
+
+def get_transcript_cache(env):
+    """
+    Returns the transcript cache stored in the Sphinx environment (creating
+    it if necessary) sized according to the `sphinx_term_cache_size` config
+    value.
+    """
+    if not hasattr(env, 'sphinx_term_transcripts'):
+        env.sphinx_term_transcripts = TranscriptCache()
+    cache = env.sphinx_term_transcripts
+    maxsize = getattr(env.config, 'sphinx_term_cache_size',
+                      TRANSCRIPT_CACHE_SIZE)
+    if cache.maxsize != maxsize:
+        cache.maxsize = maxsize
+        cache.evict()
+    return cache
+
+
+def parse_transcript(env, box_type, contents, parse, path=None):
+    """
+    Parses a terminal transcript with the `parse` function, reusing the
+    result cached for identical content whenever possible.
+
+    `box_type` (either `cssterm` or `termynal`) and `path` (the transcript
+    file path or `None` for content given explicitly) are part of the cache
+    key alongside the hash of the `contents` string.
+    The parsed transcript is shared between all the terminal boxes using it,
+    therefore it must not be modified.
+    """
+    key = (box_type, path, get_transcript_digest(contents))
+
+    cache = get_transcript_cache(env)
+    parsed = cache.get(key, None)
+    if parsed is None:
+        with measure('parse'):
+            parsed = parse(contents)
+        cache.put(key, parsed)
+    else:
+        count('cache_hits')
+    return parsed
+
+
+def load_transcript(env, box_type, path, parse):
+    """
+    Reads a terminal transcript file (see `read_transcript`) and parses it
+    with the `parse` function (see `parse_transcript` for more details).
+    """
+    contents = read_transcript(env, path)
+    return parse_transcript(env, box_type, contents, parse, path=path)
+
+
+def merge_transcript_cache(app, env, docnames, other):
+    """
+    Merges the transcripts parsed by a parallel reader process into the
+    transcript cache.
+    (Attached to the `env-merge-info` Sphinx event.)
+    """
+    get_transcript_cache(env).merge(get_transcript_cache(other))
+
+
+def setup(app):
+    """
+    Sets up the Sphinx extension implementing both the `cssterm` and
+    `termynal` directives, which share a single set of static asset, box
+    registry and event handlers.
+
+    (The `sphinx_term.cssterm` and `sphinx_term.termynal` extensions can also
+    be loaded individually.)
+    """
+    app.setup_extension('sphinx_term.cssterm')
+    app.setup_extension('sphinx_term.termynal')
+
+    return {'version': VERSION,
+            'parallel_read_safe': True,
+            'parallel_write_safe': True}
@@ -0,0 +1,133 @@
+/**
+ * Virtualised cssterm boxes (sphinx-term)
+ *
+ * Each `.sphinx-term-virtual` box holds the initial view of its lines, and
+ * points to its complete line data -- a JSON list of strings -- with the
+ * `data-term-src` attribute; boxes with the `data-term-html` attribute hold
+ * lines of (escaped) HTML markup, e.g., spans styling ANSI escape sequences.
+ * Once the line data are fetched, the box becomes a scrollable window of
+ * `data-term-window` lines, and only the lines visible in this window are
+ * kept in the DOM.
+ *
+ * Copyright (C) 2021
+ * Author: Kacper Sokol <ks1591@my.bristol.ac.uk>
+ * License: new BSD
+ */
+
+(function () {
+  'use strict';
+
+  // the number of lines rendered above and below the visible window
+  var OVERSCAN = 20;
+
+  function render(state) {
+    var first = Math.floor(state.viewport.scrollTop / state.lineHeight);
+    var start = Math.max(0, first - OVERSCAN);
+    var end = Math.min(state.lines.length, first + state.window + OVERSCAN);
+    if (start === state.start && end === state.end) {
+      return;
+    }
+    state.start = start;
+    state.end = end;
+    state.pre.style.top = (start * state.lineHeight) + 'px';
+    if (state.html) {
+      state.pre.innerHTML = state.lines.slice(start, end).join('\n');
+    } else {
+      state.pre.textContent = state.lines.slice(start, end).join('\n');
+    }
+  }
+
+  // checks whether a child node of a box is a part of its initial view --
+  // text or a span styling ANSI escape sequences (with `ansi-*` classes or
+  // inline colours)
+  function isInitialView(node) {
+    if (node.nodeType === Node.TEXT_NODE) {
+      return true;
+    }
+    if (node.nodeName !== 'SPAN') {
+      return false;
+    }
+    return /(^| )ansi-/.test(node.className) || (
+      !node.className && node.hasAttribute('style'));
+  }
+
+  function virtualise(box, lines) {
+    var state = {
+      lines: lines,
+      window: parseInt(box.getAttribute('data-term-window'), 10) || 40,
+      html: box.hasAttribute('data-term-html'),
+      start: -1,
+      end: -1
+    };
+
+    state.viewport = document.createElement('div');
+    state.viewport.className = 'sphinx-term-viewport';
+    var spacer = document.createElement('div');
+    state.pre = document.createElement('pre');
+    state.viewport.appendChild(spacer);
+    state.viewport.appendChild(state.pre);
+
+    // replace the initial view (text and ANSI spans) but retain any
+    // decorations added to the box by the cssterm script
+    for (var i = box.childNodes.length - 1; i >= 0; i--) {
+      if (isInitialView(box.childNodes[i])) {
+        box.removeChild(box.childNodes[i]);
+      }
+    }
+    box.appendChild(state.viewport);
+
+    // measure the height of a single line
+    state.pre.textContent = 'X';
+    state.lineHeight = state.pre.getBoundingClientRect().height || 16;
+
+    spacer.style.height = (lines.length * state.lineHeight) + 'px';
+    state.viewport.style.height = (
+      Math.min(state.window, lines.length) * state.lineHeight) + 'px';
+    state.viewport.scrollTop = (
+      parseInt(box.getAttribute('data-term-start'), 10) || 0
+    ) * state.lineHeight;
+    render(state);
+
+    var scheduled = false;
+    state.viewport.addEventListener('scroll', function () {
+      if (scheduled) {
+        return;
+      }
+      scheduled = true;
+      window.requestAnimationFrame(function () {
+        scheduled = false;
+        render(state);
+      });
+    });
+  }
+
+  function load(box) {
+    var request = new XMLHttpRequest();
+    request.open('GET', box.getAttribute('data-term-src'));
+    request.onload = function () {
+      // keep the initial view if the line data cannot be loaded
+      if (request.status && request.status !== 200) {
+        return;
+      }
+      try {
+        virtualise(box, JSON.parse(request.responseText));
+      } catch (e) {
+        return;
+      }
+    };
+    request.send();
+  }
+
+  function init() {
+    var boxes = document.querySelectorAll('.sphinx-term-virtual');
+    for (var i = 0; i < boxes.length; i++) {
+      load(boxes[i]);
+    }
+  }
+
+  if (document.readyState === 'loading') {
+    document.addEventListener('DOMContentLoaded', init);
+  } else {
+    init();
+  }
+})();
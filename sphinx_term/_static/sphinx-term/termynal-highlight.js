@@ -0,0 +1,32 @@
+/**
+ * Highlighted termynal input lines (sphinx-term)
+ *
+ * termynal types input lines character by character as plain text, which
+ * discards the markup of highlighted commands; this script restores the
+ * markup of each highlighted input line once it has been typed.
+ *
+ * Copyright (C) 2021
+ * Author: Kacper Sokol <ks1591@my.bristol.ac.uk>
+ * License: new BSD
+ */
+
+(function () {
+  'use strict';
+
+  if (typeof Termynal === 'undefined') {
+    return;
+  }
+
+  var type = Termynal.prototype.type;
+  Termynal.prototype.type = function (line) {
+    if (!line.querySelector('.highlight')) {
+      return type.apply(this, arguments);
+    }
+    var markup = line.innerHTML;
+    return Promise.resolve(type.apply(this, arguments)).then(
+      function (result) {
+        line.innerHTML = markup;
+        return result;
+      });
+  };
+})();
@@ -0,0 +1,246 @@
+# Copyright (C) 2021
+# Author: Kacper Sokol <ks1591@my.bristol.ac.uk>
+# License: new BSD
+"""
+Implements the rendering of ANSI escape sequences in terminal transcripts.
+
+Transcripts are parsed in a single pass by a state machine that tracks the
+Select Graphic Rendition (SGR) attributes -- colours and text styles -- and
+discards all the other (e.g., cursor movement) escape sequences.
+A parsed transcript is its plain text and a list of style runs, each of
+which is a `(length, style)` tuple; adjacent runs never share a style.
+The styles are rendered as HTML spans with `ansi-*` classes (see the
+`sphinx-term/cssterm-ansi.css` file); the colours outside the 16-colour
+palette are given inline.
+"""
+
+import re
+
+# matches the escape sequences: CSI (e.g., SGR -- whose parameters are
+# captured -- and cursor movement), OSC (e.g., window titles and hyperlinks)
+# and the remaining two-character sequences (e.g., character set selection)
+ESCAPE_RE = re.compile(
+    r'\x1b(?:'
+    r'\[([0-9;]*)m'
+    r'|\[[0-?]*[ -/]*[@-~]'
+    r'|\][^\x07\x1b\n]*(?:\x07|\x1b\\)?'
+    r'|[ -/]*[0-~]'
+    r')?')
+
+# the text attributes that are turned on and off by SGR codes -- each code
+# maps to an `(attribute, value)` tuple
+SGR_ATTRIBUTES = {
+    1: ('bold', True), 2: ('dim', True), 3: ('italic', True),
+    4: ('underline', True), 7: ('inverse', True), 9: ('strike', True),
+    22: ('bold', False), 23: ('italic', False), 24: ('underline', False),
+    27: ('inverse', False), 29: ('strike', False)
+}
+TEXT_ATTRIBUTES = ['bold', 'dim', 'italic', 'underline', 'strike']
+
+
+def has_escapes(text):
+    """Checks whether a string holds any escape sequences."""
+    return '\x1b' in text
+
+
+#### Parser ###################################################################
+
+
+def get_palette_colour(index):
+    """
+    Converts a colour of the 256-colour palette (beyond its first 16
+    colours) into a `#rrggbb` string.
+    """
+    if index < 232:
+        index -= 16
+        rgb = (index // 36, index // 6 % 6, index % 6)
+        rgb = [0 if i == 0 else 55 + 40 * i for i in rgb]
+    else:
+        rgb = [8 + 10 * (index - 232)] * 3
+    return '#{:02x}{:02x}{:02x}'.format(*rgb)
+
+
+def parse_extended_colour(codes, i):
+    """
+    Parses an extended (256-colour or RGB) colour given by the SGR codes
+    following the `38` or `48` code at the `i` position.
+
+    Returns a `(colour, i)` tuple, where the colour is either an index of
+    the 16-colour palette, a `#rrggbb` string or `None` (an invalid colour),
+    and `i` is the position of the last code of the colour.
+    """
+    mode = codes[i + 1] if i + 1 < len(codes) else None
+    if mode == 5 and i + 2 < len(codes):
+        index = codes[i + 2]
+        if 0 <= index < 16:
+            return index, i + 2
+        if 16 <= index <= 255:
+            return get_palette_colour(index), i + 2
+        return None, i + 2
+    if mode == 2 and i + 4 < len(codes):
+        rgb = codes[i + 2:i + 5]
+        if all(0 <= j <= 255 for j in rgb):
+            return '#{:02x}{:02x}{:02x}'.format(*rgb), i + 4
+        return None, i + 4
+    return None, len(codes)
+
+
+def apply_sgr(state, parameters):
+    """
+    Updates the `state` dictionary of text attributes (see `parse_ansi`) with
+    the (`;`-separated) parameters of an SGR escape sequence.
+    """
+    try:
+        codes = [int(i) if i else 0 for i in parameters.split(';')]
+    except ValueError:  # e.g., colon-separated sub-parameters
+        return
+
+    i = 0
+    while i < len(codes):
+        code = codes[i]
+        if code == 0:
+            state.clear()
+        elif code in SGR_ATTRIBUTES:
+            attribute, value = SGR_ATTRIBUTES[code]
+            state[attribute] = value
+            if code == 22:
+                state['dim'] = False
+        elif 30 <= code <= 37:
+            state['fg'] = code - 30
+        elif 90 <= code <= 97:
+            state['fg'] = code - 90 + 8
+        elif 40 <= code <= 47:
+            state['bg'] = code - 40
+        elif 100 <= code <= 107:
+            state['bg'] = code - 100 + 8
+        elif code == 39:
+            state['fg'] = None
+        elif code == 49:
+            state['bg'] = None
+        elif code in (38, 48):
+            colour, i = parse_extended_colour(codes, i)
+            if colour is not None:
+                state['fg' if code == 38 else 'bg'] = colour
+        i += 1
+
+
+def get_style(state):
+    """
+    Converts the `state` dictionary of text attributes into a style --
+    a `(classes, css)` tuple of strings or `None` for the default style.
+    """
+    fg, bg = state.get('fg', None), state.get('bg', None)
+    if state.get('inverse', False):
+        fg, bg = ('inverse' if bg is None else bg,
+                  'inverse' if fg is None else fg)
+
+    classes, css = [], []
+    for attribute in TEXT_ATTRIBUTES:
+        if state.get(attribute, False):
+            classes.append('ansi-{}'.format(attribute))
+    for prefix, colour, css_property in (('fg', fg, 'color'),
+                                         ('bg', bg, 'background-color')):
+        if isinstance(colour, str) and colour.startswith('#'):
+            css.append('{}:{}'.format(css_property, colour))
+        elif colour is not None:
+            classes.append('ansi-{}-{}'.format(prefix, colour))
+
+    if not classes and not css:
+        return None
+    return ' '.join(classes), ';'.join(css)
+
+
+def parse_ansi(text):
+    """
+    Parses the ANSI escape sequences of a terminal transcript in a single
+    pass.
+
+    Returns a `(plain_text, runs)` tuple, where `runs` is a list of
+    `(length, style)` tuples covering the plain text (see `get_style`);
+    consecutive text fragments with the same style are merged into a single
+    run, and the runs with the same style share the style object.
+    """
+    # the text attributes are held by a (hashable) tuple of sorted
+    # `(attribute, value)` pairs, which allows memorising the transitions
+    # between states caused by each SGR escape sequence
+    state, style = (), None
+    transitions, styles = {}, {}
+
+    chunks, runs = [], []
+    run_style, run_length = None, 0
+    # the split alternates text fragments and the parameters of SGR escape
+    # sequences (`None` for the remaining escape sequences)
+    parts = ESCAPE_RE.split(text)
+    for i in range(0, len(parts), 2):
+        chunk = parts[i]
+        if chunk:
+            if style is not run_style:
+                if run_length:
+                    runs.append((run_length, run_style))
+                run_style, run_length = style, 0
+            chunks.append(chunk)
+            run_length += len(chunk)
+
+        parameters = parts[i + 1] if i + 1 < len(parts) else None
+        if parameters is None:
+            continue
+        transition = transitions.get((state, parameters), None)
+        if transition is None:
+            attributes = dict(state)
+            apply_sgr(attributes, parameters)
+            new_state = tuple(sorted(attributes.items()))
+            new_style = get_style(attributes)
+            new_style = styles.setdefault(new_style, new_style)
+            transition = transitions[(state, parameters)] = (
+                new_state, new_style)
+        state, style = transition
+    if run_length:
+        runs.append((run_length, run_style))
+
+    return ''.join(chunks), runs
+
+
+#### Renderer #################################################################
+
+
+def get_span_tags(style):
+    """Returns the opening and closing HTML tags of a style span."""
+    if style is None:
+        return '', ''
+    classes, css = style
+    attributes = []
+    if classes:
+        attributes.append(' class="{}"'.format(classes))
+    if css:
+        attributes.append(' style="{}"'.format(css))
+    return '<span{}>'.format(''.join(attributes)), '</span>'
+
+
+def render_ansi_lines(text, runs, encode):
+    """
+    Renders a parsed terminal transcript (see `parse_ansi`) as a list of
+    HTML lines -- the spans are closed at the end of each line, therefore
+    every line can be displayed on its own.
+    The text fragments are escaped with the `encode` function.
+    """
+    tags = {}
+    lines, line = [], []
+    position = 0
+    for length, style in runs:
+        fragment = text[position:position + length]
+        position += length
+        if style not in tags:
+            tags[style] = get_span_tags(style)
+        opening, closing = tags[style]
+
+        pieces = fragment.split('\n') if '\n' in fragment else [fragment]
+        for i, piece in enumerate(pieces):
+            if i:
+                lines.append(''.join(line))
+                line = []
+            if piece:
+                line.append(opening)
+                line.append(encode(piece))
+                line.append(closing)
+    lines.append(''.join(line))
+    return lines
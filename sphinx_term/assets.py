@@ -0,0 +1,309 @@
+# Copyright (C) 2021
+# Author: Kacper Sokol <ks1591@my.bristol.ac.uk>
+# License: new BSD
+"""
+Implements the static asset pipeline shared by the `cssterm` and `termynal`
+extensions.
+
+When an HTML builder is initialised, the CSS and JS files of each extension
+are concatenated, (conservatively) minified and saved as bundles named after
+the hash of their sources, e.g., `termynal.0123456789ab.js`.
+Since the name of a bundle changes whenever its content does, the bundles
+can be served with immutable, long-lived cache headers.
+
+The static files of each extension are registered with this module (see
+`register_static_files`), which bundles them once per build and loads them
+on the HTML pages that display the boxes of the extension.
+"""
+
+import collections
+import hashlib
+import os
+import posixpath
+
+import sphinx_term
+
+BUNDLE_DIR = 'sphinx_term_static'
+HASH_LENGTH = 12
+# bump to invalidate bundles minified by previous versions of the minifier
+MINIFY_VERSION = '2'
+
+# the static files of the terminal box types (populated by extensions) --
+# see `register_static_files`
+_STATIC_FILES = collections.OrderedDict()
+# the directories (within the `_static` folder of the HTML build) holding
+# the data files saved by the extensions (see `write_static_data`)
+_STATIC_DATA_DIRS = []
+
+
+def strip_lines(source, line_comments=False):
+    """
+    Minifies CSS or JavaScript conservatively by removing indentation, blank
+    lines and the comments that take up whole lines -- block comments
+    starting a line and, if `line_comments` is `True`, `//` comments.
+
+    The remaining lines are left untouched, hence the content of string,
+    template and regular expression literals is preserved as long as they do
+    not span multiple lines (which the bundled files never do).
+    """
+    lines = []
+    in_comment = False
+    for line in source.split('\n'):
+        line = line.lstrip()
+        if in_comment or line.startswith('/*'):
+            end = line.find('*/', 0 if in_comment else 2)
+            in_comment = end == -1
+            line = '' if in_comment else line[end + 2:].lstrip()
+        elif line_comments and line.startswith('//'):
+            line = ''
+        if line:
+            lines.append(line)
+    return '\n'.join(lines) + '\n'
+
+
+def minify_css(css):
+    """Minifies CSS conservatively (see `strip_lines`)."""
+    return strip_lines(css)
+
+
+def minify_js(js):
+    """
+    Minifies JavaScript conservatively (see `strip_lines`).
+
+    Line breaks between the remaining lines are preserved to avoid altering
+    the semantics of scripts that rely on automatic semicolon insertion.
+    """
+    return strip_lines(js, line_comments=True)
+
+
+def get_bundle_dir(app):
+    """Returns the directory holding the asset bundles of this build."""
+    return os.path.join(app.doctreedir, BUNDLE_DIR)
+
+
+def build_bundle(app, name, file_names, file_type):
+    """
+    Concatenates (and minifies) static extension files of the `file_type`
+    type (either `css` or `js`) into a bundle prefixed with `name`.
+
+    The bundle is saved in the bundle directory, which is registered with
+    the `html_static_path` config value, and stale bundles with the same
+    prefix are removed.
+    The bundle is named after the hash of its sources (and the minification
+    setting), hence the files are only minified when they change -- and not
+    by every build.
+    Returns the file name of the bundle.
+    """
+    contents = []
+    for file_name in file_names:
+        with open(sphinx_term.get_static_path(file_name), 'r',
+                  encoding='utf-8') as f:
+            contents.append(f.read())
+    bundle = '\n'.join(contents)
+    minify = bool(app.config.sphinx_term_minify)
+
+    digest = hashlib.sha1('{}\n{}\n{}\n{}'.format(
+        sphinx_term.VERSION, MINIFY_VERSION, minify,
+        bundle).encode('utf-8')).hexdigest()
+    bundle_name = '{}.{}.{}'.format(name, digest[:HASH_LENGTH], file_type)
+
+    bundle_dir = get_bundle_dir(app)
+    os.makedirs(bundle_dir, exist_ok=True)
+    # remove bundles created from outdated files
+    for stale_name in os.listdir(bundle_dir):
+        if (stale_name != bundle_name
+                and stale_name.startswith('{}.'.format(name))
+                and stale_name.endswith('.{}'.format(file_type))):
+            os.remove(os.path.join(bundle_dir, stale_name))
+    bundle_path = os.path.join(bundle_dir, bundle_name)
+    if not os.path.exists(bundle_path):
+        if minify:
+            bundle = minify_css(bundle) if file_type == 'css' else minify_js(
+                bundle)
+        with open(bundle_path, 'w', encoding='utf-8') as f:
+            f.write(bundle)
+
+    if bundle_dir not in app.config.html_static_path:
+        app.config.html_static_path.append(bundle_dir)
+
+    return bundle_name
+
+
+def include_bundles(app, name, css_files, js_files):
+    """
+    Builds the CSS and JS bundles of an extension and memorises their names
+    (see `get_bundle`).
+    """
+    bundles = get_bundles(app)
+    if css_files:
+        bundles[(name, 'css')] = build_bundle(app, name, css_files, 'css')
+    if js_files:
+        bundles[(name, 'js')] = build_bundle(app, name, js_files, 'js')
+
+
+def register_static_files(box_type, css_files, js_files,
+                          js_dependencies=None, css_dependencies=None,
+                          load_js=True):
+    """
+    Registers the static files of a terminal box type.
+
+    The `css_files` and `js_files` are bundled when an HTML builder is
+    initialised (see `include_static_files`) and, together with the external
+    `js_dependencies` and `css_dependencies` -- given as `{stub: path}`
+    dictionaries -- loaded by the pages displaying `box_type` boxes (see
+    `load_static_files`).
+    The JS bundle is not loaded when `load_js` is `False`, in which case the
+    extension is responsible for including it (see `get_bundle`).
+    """
+    _STATIC_FILES[box_type] = (
+        css_files, js_files, js_dependencies or {}, css_dependencies or {},
+        load_js)
+
+
+def include_static_files(app):
+    """
+    Bundles the static files registered by the extensions and ensures that
+    the bundles are copied into the build.
+    (Attached to the `builder-inited` Sphinx event.)
+    """
+    if app.builder.format != 'html':
+        return
+    for box_type, (css_files, js_files, _, _, _) in _STATIC_FILES.items():
+        include_bundles(app, box_type, css_files, js_files)
+
+
+def load_static_files(app, pagename, templatename, context, doctree):
+    """
+    Includes the static files of each terminal box type only on the pages
+    that display boxes of this type.
+    (Attached to the `html-page-context` Sphinx event.)
+
+    The bundles are added to the builder (and not the application registry)
+    so that they are only loaded by this page regardless of the order in
+    which the pages are written.
+    """
+    for box_type, static_files in _STATIC_FILES.items():
+        # skip pages without at least one box of this type
+        if not sphinx_term.get_page_boxes(app, pagename, box_type):
+            continue
+        _, _, js_dependencies, css_dependencies, load_js = static_files
+
+        app.builder.add_css_file(get_bundle(app, box_type, 'css'))
+        if load_js:
+            app.builder.add_js_file(get_bundle(app, box_type, 'js'))
+
+        # add external dependencies
+        for path in get_dependencies(
+                app, box_type, js_dependencies, context, 'js'):
+            app.builder.add_js_file(path)
+        for path in get_dependencies(
+                app, box_type, css_dependencies, context, 'css'):
+            app.builder.add_css_file(path)
+
+
+def get_bundles(app):
+    """Returns the asset bundle record of the current builder."""
+    if not hasattr(app.builder, 'sphinx_term_bundles'):
+        app.builder.sphinx_term_bundles = {}
+    return app.builder.sphinx_term_bundles
+
+
+def get_bundle(app, name, file_type):
+    """
+    Returns the file name of the `file_type` (`css` or `js`) bundle of
+    the `name` extension, or `None` if it does not exist.
+    """
+    return get_bundles(app).get((name, file_type), None)
+
+
+def get_bundle_names(app):
+    """Returns the file names of all the bundles of the current builder."""
+    return sorted(bundle for key, bundle in get_bundles(app).items()
+                  if len(key) == 2 and bundle is not None)
+
+
+def get_dependencies(app, name, dependencies, context, file_type):
+    """
+    Returns the paths of the external `file_type` (`css` or `js`)
+    `dependencies` -- given as a `{stub: path}` dictionary -- of the `name`
+    extension that are not yet loaded by the page `context`.
+
+    The dependencies are resolved once for every distinct list of static
+    files loaded by the pages, which is usually the same for all of them.
+    """
+    context_key = 'css_files' if file_type == 'css' else 'script_files'
+    files = tuple(sphinx_term.get_asset_names(context[context_key]))
+    bundles = get_bundles(app)
+    key = (name, 'dependencies', file_type, files)
+    if key not in bundles:
+        stubs = [os.path.basename(i) for i in files]
+        bundles[key] = [path for stub, path in dependencies.items()
+                        if not (path in files or stub in stubs)]
+    return bundles[key]
+
+
+def register_static_data_dir(directory):
+    """
+    Registers a directory (within the `_static` folder of the HTML build)
+    holding data files saved by an extension with `write_static_data`.
+    """
+    if directory not in _STATIC_DATA_DIRS:
+        _STATIC_DATA_DIRS.append(directory)
+
+
+def get_static_data_dirs():
+    """Returns the registered static data directories."""
+    return list(_STATIC_DATA_DIRS)
+
+
+def write_static_data(builder, directory, data, extension='json'):
+    """
+    Saves the `data` string in the `directory` folder (within the `_static`
+    folder of the HTML build) under a name derived from its hash, therefore
+    identical data are saved (and downloaded) only once.
+
+    Returns the (URI) path to the data file relative to the build root.
+    """
+    digest = hashlib.sha1(data.encode('utf-8')).hexdigest()
+    data_uri = posixpath.join(
+        '_static', directory, '{}.{}'.format(digest, extension))
+
+    data_path = os.path.join(builder.outdir, *data_uri.split('/'))
+    if not os.path.exists(data_path):
+        os.makedirs(os.path.dirname(data_path), exist_ok=True)
+        # write to a temporary file first so that concurrent writers never
+        # see partially written data
+        data_path_tmp = '{}.{}.tmp'.format(data_path, os.getpid())
+        with open(data_path_tmp, 'w', encoding='utf-8') as f:
+            f.write(data)
+        os.replace(data_path_tmp, data_path)
+
+    return data_uri
+
+
+def get_relative_uri(builder, uri):
+    """
+    Returns a (URI) path given relative to the build root as a path relative
+    to the page that is currently written.
+    """
+    return posixpath.relpath(
+        uri,
+        posixpath.dirname(builder.get_target_uri(builder.current_docname))
+        or '.')
+
+
+def setup(app):
+    """
+    Sets up the Sphinx extension for the static asset pipeline.
+    (Loaded automatically by the `sphinx_term.shared` extension.)
+    """
+    app.add_config_value('sphinx_term_minify', True, 'html')
+
+    # ensure the required static files are **copied** into the build
+    app.connect('builder-inited', include_static_files)
+    # ...and that the relevant html output pages **load** them
+    app.connect('html-page-context', load_static_files)
+
+    return {'version': sphinx_term.VERSION,
+            'parallel_read_safe': True,
+            'parallel_write_safe': True}
@@ -0,0 +1,272 @@
+# Copyright (C) 2021
+# Author: Kacper Sokol <ks1591@my.bristol.ac.uk>
+# License: new BSD
+"""
+Implements the precompression of the HTML build artifacts of terminal boxes.
+
+When the `sphinx_term_precompress` config value is set, the asset bundles of
+the extensions, the static data files saved by them (e.g., the externalised
+termynal transcripts -- see `sphinx_term.assets.write_static_data`) and the
+HTML pages displaying terminal boxes are accompanied by their gzip (`.gz`)
+and -- when the `brotli` package is installed -- brotli (`.br`) compressed
+copies once the build finishes, which static hosting can serve directly.
+Compressed copies that are not smaller than their files are not saved.
+
+The files are compressed in a pool of `sphinx_term_precompress_workers`
+processes (one per processor by default).
+The content hash of every compressed file is recorded in the doctree
+directory, hence files that have not changed since the previous build are
+not compressed again.
+"""
+
+import collections
+import concurrent.futures
+import gzip
+import hashlib
+import importlib.util
+import io
+import json
+import os
+
+from sphinx.util import logging
+
+import sphinx_term
+import sphinx_term.assets
+
+# the record of the compressed files (in the doctree directory)
+MANIFEST_FILE = 'sphinx_term_precompress.json'
+GZIP_LEVEL = 9
+BROTLI_QUALITY = 11
+
+logger = logging.getLogger(__name__)
+
+
+#### Compression ##############################################################
+
+
+def compress_gzip(data):
+    """
+    Compresses bytes with gzip -- the output is reproducible since neither
+    the file name nor the modification time is recorded.
+    """
+    buffer = io.BytesIO()
+    with gzip.GzipFile(filename='', mode='wb', fileobj=buffer,
+                       compresslevel=GZIP_LEVEL, mtime=0) as f:
+        f.write(data)
+    return buffer.getvalue()
+
+
+def compress_brotli(data):
+    """Compresses bytes with brotli (requires the `brotli` package)."""
+    import brotli
+    return brotli.compress(data, quality=BROTLI_QUALITY)
+
+
+# the compression formats -- each format (the extension of the compressed
+# files) maps to its compression function
+COMPRESSORS = collections.OrderedDict([
+    ('gz', compress_gzip),
+    ('br', compress_brotli)
+])
+COMPRESSED_EXTENSIONS = tuple('.{}'.format(i) for i in COMPRESSORS) + (
+    '.tmp',)
+
+
+def has_brotli():
+    """Checks whether the `brotli` package is installed."""
+    return importlib.util.find_spec('brotli') is not None
+
+
+def compress_file(path, formats):
+    """
+    Saves the compressed copies of a file in the given `formats` next to it,
+    removing the (stale) copies that would not be smaller than the file.
+    (This function is executed by the compression worker pool.)
+
+    Returns a `{format: size}` dictionary of the compressed copies, where the
+    size is `None` for the copies that are not saved.
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    sizes = {}
+    for compression_format in formats:
+        compressed = COMPRESSORS[compression_format](data)
+        compressed_path = '{}.{}'.format(path, compression_format)
+        if len(compressed) < len(data):
+            # write to a temporary file first so that the web server never
+            # sees partially written copies
+            compressed_path_tmp = '{}.{}.tmp'.format(
+                compressed_path, os.getpid())
+            with open(compressed_path_tmp, 'wb') as f:
+                f.write(compressed)
+            os.replace(compressed_path_tmp, compressed_path)
+            sizes[compression_format] = len(compressed)
+        else:
+            if os.path.exists(compressed_path):
+                os.remove(compressed_path)
+            sizes[compression_format] = None
+    return sizes
+
+
+#### Build artifacts ##########################################################
+
+
+def get_formats(app):
+    """
+    Returns the compression formats requested by the
+    `sphinx_term_precompress` config value -- either `True` (all the
+    available formats) or a list of formats, e.g., `['gz']`; the unknown
+    and unavailable formats are reported and ignored.
+    """
+    value = app.config.sphinx_term_precompress
+    available = [i for i in COMPRESSORS if i != 'br' or has_brotli()]
+    if not value:
+        return []
+    if value is True:
+        return available
+
+    formats = []
+    for compression_format in ([value] if isinstance(value, str) else value):
+        if compression_format not in COMPRESSORS:
+            logger.warning('[sphinx-term] unknown compression format (%s) '
+                           'given by the sphinx_term_precompress config '
+                           'value; it is ignored', compression_format)
+        elif compression_format not in available:
+            logger.warning('[sphinx-term] the %s compression format requires '
+                           'the brotli package (install sphinx-term[brotli]); '
+                           'it is ignored', compression_format)
+        elif compression_format not in formats:
+            formats.append(compression_format)
+    return formats
+
+
+def get_artifacts(app):
+    """
+    Returns the paths (relative to the output directory) of the build
+    artifacts of terminal boxes that exist: the asset bundles, the static
+    data files and the HTML pages displaying terminal boxes.
+    """
+    artifacts = []
+    for bundle in sphinx_term.assets.get_bundle_names(app):
+        artifacts.append(os.path.join('_static', bundle))
+    for directory in sphinx_term.assets.get_static_data_dirs():
+        data_dir = os.path.join(app.outdir, '_static', directory)
+        if os.path.isdir(data_dir):
+            artifacts += [os.path.join('_static', directory, i)
+                          for i in sorted(os.listdir(data_dir))
+                          if not i.endswith(COMPRESSED_EXTENSIONS)]
+
+    index = sphinx_term.get_term_index(app.env)
+    # a single page holds all the documents
+    if app.builder.name == 'singlehtml':
+        docnames = [app.config.master_doc] if index else []
+    else:
+        docnames = sorted(index)
+    for docname in docnames:
+        artifacts.append(os.path.relpath(
+            app.builder.get_outfilename(docname), app.outdir))
+
+    return [i for i in artifacts
+            if os.path.isfile(os.path.join(app.outdir, i))]
+
+
+def is_compressed(app, path, record, digest, formats):
+    """
+    Checks whether the compressed copies of a build artifact recorded by
+    a previous build are up to date.
+    """
+    if record is None or record['digest'] != digest:
+        return False
+    if sorted(record['formats']) != sorted(formats):
+        return False
+    return all(
+        os.path.exists(os.path.join(
+            app.outdir, '{}.{}'.format(path, compression_format)))
+        for compression_format, size in record['formats'].items()
+        if size is not None)
+
+
+def load_manifest(app):
+    """Loads the record of the files compressed by the previous build."""
+    manifest_path = os.path.join(app.doctreedir, MANIFEST_FILE)
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_manifest(app, manifest):
+    """Saves the record of the compressed files."""
+    manifest_path = os.path.join(app.doctreedir, MANIFEST_FILE)
+    with open(manifest_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+
+
+def precompress_artifacts(app, exception):
+    """
+    Saves the compressed copies of the build artifacts of terminal boxes
+    whose content has changed since the previous build, and reports the
+    number of bytes saved by each compression format.
+    (Attached to the `build-finished` Sphinx event.)
+    """
+    if exception is not None or app.builder.format != 'html':
+        return
+    formats = get_formats(app)
+    if not formats:
+        return
+
+    previous = load_manifest(app)
+    manifest, missing = {}, {}
+    for path in get_artifacts(app):
+        with open(os.path.join(app.outdir, path), 'rb') as f:
+            data = f.read()
+        digest = hashlib.sha1(data).hexdigest()
+        record = previous.get(path, None)
+        if is_compressed(app, path, record, digest, formats):
+            manifest[path] = record
+        else:
+            manifest[path] = {'digest': digest, 'size': len(data)}
+            missing[path] = os.path.join(app.outdir, path)
+
+    workers = app.config.sphinx_term_precompress_workers
+    if len(missing) <= 1 or workers == 1:
+        for path, full_path in missing.items():
+            manifest[path]['formats'] = compress_file(full_path, formats)
+    else:
+        # 0 workers stands for the number of processors on the machine
+        with concurrent.futures.ProcessPoolExecutor(
+                max_workers=workers or None) as executor:
+            futures = {path: executor.submit(compress_file, full_path,
+                                             formats)
+                       for path, full_path in missing.items()}
+            for path, future in futures.items():
+                manifest[path]['formats'] = future.result()
+    save_manifest(app, manifest)
+
+    saved = collections.OrderedDict((i, 0) for i in formats)
+    for record in manifest.values():
+        for compression_format, size in record['formats'].items():
+            if size is not None:
+                saved[compression_format] += record['size'] - size
+    logger.info('[sphinx-term] precompressed %d of %d terminal box files; '
+                'saved %s', len(missing), len(manifest),
+                ', '.join('{:.1f} KiB with {}'.format(size / 1024, i)
+                          for i, size in saved.items()))
+
+
+def setup(app):
+    """
+    Sets up the Sphinx extension for precompressing the build artifacts of
+    terminal boxes.
+    (Loaded automatically by the `sphinx_term.shared` extension.)
+    """
+    app.add_config_value('sphinx_term_precompress', False, '')
+    app.add_config_value('sphinx_term_precompress_workers', 0, '')
+
+    app.connect('build-finished', precompress_artifacts)
+
+    return {'version': sphinx_term.VERSION,
+            'parallel_read_safe': True,
+            'parallel_write_safe': True}
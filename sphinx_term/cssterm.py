@@ -5,25 +5,59 @@
 Implements the `cssterm` directive for Jupyter Book and Sphinx.
 """
 
+import collections
+import json
 import os
+import re
 import sys
 
 from docutils import nodes
-from docutils.parsers.rst import Directive
+from docutils.parsers.rst import Directive, directives
 
 import sphinx_term
+import sphinx_term.ansi
+import sphinx_term.assets
+import sphinx_term.execute
+import sphinx_term.highlight
+import sphinx_term.prefetch
+import sphinx_term.slicing
 
 DEPENDENCIES = {  # See sphinx_term/_static/README.md for more info
     # jQuery (MIT): https://github.com/jquery/jquery
     'jquery.js': 'https://code.jquery.com/jquery-latest.min.js'
 }
 
-STATIC_CSS_FILES = ['cssterm/css/cssterm.css']
-STATIC_JS_FILES = ['cssterm/scripts/cssterm.js']
+STATIC_CSS_FILES = ['cssterm/css/cssterm.css',
+                    'sphinx-term/cssterm-virtual.css',
+                    'sphinx-term/cssterm-ansi.css',
+                    'sphinx-term/highlight.css']
+STATIC_JS_FILES = ['cssterm/scripts/cssterm.js',
+                   'sphinx-term/cssterm-virtual.js']
 STATIC_FILES = STATIC_CSS_FILES + STATIC_JS_FILES
 
 REFNAME = 'terminal box'
 
+# the schema of the cssterm directive options -- each option maps to
+# a `(validator, type description)` tuple
+CSSTERM_OPTION_SCHEMA = collections.OrderedDict([
+    ('view-tail', (sphinx_term.is_positive_integer, 'positive integer')),
+    ('view-lines', (sphinx_term.is_line_range, 'line range (e.g., 10-20)')),
+    ('start-after', (sphinx_term.is_non_empty_string, 'non-empty string')),
+    ('end-before', (sphinx_term.is_non_empty_string, 'non-empty string')),
+    ('lines', (sphinx_term.is_line_range, 'line range (e.g., 10-20)')),
+    ('tail', (sphinx_term.is_positive_integer, 'positive integer')),
+    ('execute', (sphinx_term.is_boolean, 'boolean'))
+])
+
+# the directory (within the `_static` folder of the HTML build) holding
+# the line data of virtualised cssterm boxes
+VIRTUAL_DATA_DIR = 'sphinx_term/cssterm'
+
+# the number of parsed and rendered transcripts with ANSI escape sequences
+# memorised by each reader and writer process (see `parse_ansi_transcript`)
+ANSI_CACHE_SIZE = 16
+_ANSI_CACHE = sphinx_term.TranscriptCache(ANSI_CACHE_SIZE)
+
 if sys.version_info >= (3, 0):
     unicode = str
 
@@ -45,38 +79,212 @@ def depart_cssterm_anchor_node(self, node):
     self.body.append('</div>\n')
 
 
-def visit_cssterm_anchor_node_(self, node):
-    """Builds a prefix for embedding cssterm anchors in LaTeX and raw text."""
-    raise NotImplemented
+class cssterm_box(nodes.literal_block, nodes.Element):
+    """
+    A `docutils` node holding cssterm boxes.
+
+    The content of *deferred* boxes is not held by the node, which instead
+    references its transcript -- the `transcript` attribute holds the path
+    to the transcript file (relative to the source directory) and the `digest`
+    attribute holds the hash of its content in the transcript store (see
+    `get_box_text`).
+
+    The node of a box whose transcript holds ANSI escape sequences only
+    holds its plain text; the `ansi` attribute holds its style runs (see
+    `sphinx_term.ansi.parse_ansi`) -- or `True` for deferred boxes, whose
+    transcript is parsed when the box is written -- and the `ansi_digest`
+    attribute holds the hash of its (sliced) transcript.
+    """
 
 
-def depart_cssterm_anchor_node_(self, node):
-    """Builds a postfix for embedding cssterm anchors in LaTeX and raw text."""
-    raise NotImplemented
+def parse_ansi_transcript(contents, digest):
+    """
+    Parses the ANSI escape sequences of a cssterm transcript (see
+    `sphinx_term.ansi.parse_ansi`) whose content hash is `digest`.
 
+    The parsed transcripts are memorised by each process rather than in the
+    transcript cache (see `sphinx_term.parse_transcript`), hence the -- large
+    -- plain text of the transcripts is not saved in the Sphinx environment.
+    """
+    key = ('parse', digest)
+    parsed = _ANSI_CACHE.get(key, None)
+    if parsed is None:
+        with sphinx_term.measure('parse'):
+            parsed = sphinx_term.ansi.parse_ansi(contents)
+        _ANSI_CACHE.put(key, parsed)
+    else:
+        sphinx_term.count('cache_hits')
+    return parsed
+
+
+def get_box_content(env, node):
+    """
+    Returns the `(text, runs)` tuple of a cssterm box -- its plain text and
+    its ANSI style runs (`None` for boxes without ANSI escape sequences) --
+    loading the content of deferred boxes from the transcript store.
+    """
+    if 'digest' not in node:
+        return node.astext(), node.get('ansi', None)
+
+    contents = sphinx_term.load_stored_transcript(
+        env, node['transcript'], node['digest'])
+    if not node.get('ansi', False):
+        return contents, None
+    return parse_ansi_transcript(contents, node['digest'])
 
-class cssterm_box(nodes.literal_block, nodes.Element):
-    """A `docutils` node holding cssterm boxes."""
+
+def get_box_text(env, node):
+    """
+    Returns the (plain) text of a cssterm box, loading the content of
+    deferred boxes from the transcript store.
+    """
+    return get_box_content(env, node)[0]
+
+
+def has_markup(node):
+    """
+    Checks whether a cssterm box is written as HTML markup (see
+    `get_box_lines`) rather than plain text.
+    """
+    return (node.get('ansi', None) is not None
+            or sphinx_term.highlight.is_enabled())
+
+
+def get_box_lines(self, node):
+    """
+    Returns the HTML lines of a cssterm box -- the text styled by ANSI
+    escape sequences is wrapped in spans (see
+    `sphinx_term.ansi.render_ansi_lines`), and the commands of the remaining
+    boxes are highlighted when enabled (see `highlight_line`).
+    The rendered lines are memorised by the hash of the (sliced) transcript
+    of the box, therefore a transcript displayed on many pages is rendered
+    only once.
+    """
+    text, runs = get_box_content(self.builder.env, node)
+    if runs is None:
+        return [highlight_line(self, line) for line in text.split('\n')]
+    key = ('render', node['digest'] if 'digest' in node
+           else node['ansi_digest'])
+    lines = _ANSI_CACHE.get(key, None)
+    if lines is None:
+        lines = sphinx_term.ansi.render_ansi_lines(text, runs, self.encode)
+        _ANSI_CACHE.put(key, lines)
+    return lines
+
+
+def count_box_lines(node):
+    """Counts the lines of a cssterm box (without loading its content)."""
+    if 'digest' in node:
+        return node['line_count']
+    return node.astext().count('\n') + 1
+
+
+def highlight_line(self, line):
+    """
+    Encodes a line of a cssterm box, highlighting the command that follows
+    the prompt matched by the `sphinx_term_cssterm_prompt` config setting
+    (a regular expression) at the beginning of the line.
+    """
+    prompt = self.builder.config.sphinx_term_cssterm_prompt
+    match = None
+    if prompt and sphinx_term.highlight.is_enabled():
+        match = re.match(prompt, line)
+    if match is None:
+        return self.encode(line)
+    return '{}{}'.format(
+        self.encode(line[:match.end()]),
+        sphinx_term.highlight.highlight_command(line[match.end():]))
 
 
 def visit_cssterm_box_node(self, node):
     """Builds an opening HTML tag for cssterm boxes."""
+    if node.get('virtual', False):
+        visit_virtual_cssterm_box_node(self, node)
     self.body.append(self.starttag(node, 'div', CLASS='cssterm'))
+    # deferred boxes do not have a text node, and the text node of boxes
+    # with ANSI escape sequences or highlighted commands is replaced by its
+    # markup
+    if has_markup(node):
+        self.body.append('\n'.join(get_box_lines(self, node)))
+        raise nodes.SkipChildren
+    if 'digest' in node:
+        self.body.append(self.encode(get_box_text(self.builder.env, node)))
 
 
-def depart_cssterm_box_node(self, node):
-    """Builds a closing HTML tag for cssterm boxes."""
+def visit_virtual_cssterm_box_node(self, node):
+    """
+    Builds a virtualised cssterm box, which only holds the initial view of
+    its lines; the complete line data are saved in a separate JSON file
+    that is fetched by the page and rendered one window at a time.
+
+    The line data of boxes with ANSI escape sequences or highlighted
+    commands are HTML lines, which is indicated by the `data-term-html`
+    attribute.
+    """
+    markup = has_markup(node)
+    if markup:
+        lines = get_box_lines(self, node)
+    else:
+        lines = get_box_text(self.builder.env, node).split('\n')
+    window = self.builder.config.sphinx_term_cssterm_virtual_window
+    start, end = get_virtual_view(node.get('view', None), len(lines), window)
+
+    data_uri = sphinx_term.assets.get_relative_uri(
+        self.builder, write_virtual_data(self.builder, lines))
+    attributes = {
+        'data-term-src': data_uri,
+        'data-term-lines': len(lines),
+        'data-term-start': start,
+        'data-term-window': window
+    }
+    if markup:
+        attributes['data-term-html'] = 'true'
+    self.body.append(self.starttag(
+        node, 'div', CLASS='cssterm sphinx-term-virtual', **attributes))
+    if markup:
+        self.body.append('\n'.join(lines[start:end]))
+    else:
+        self.body.append(self.encode('\n'.join(lines[start:end])))
     self.body.append('</div>\n')
+    raise nodes.SkipNode
 
 
-def visit_cssterm_box_node_(self, node):
-    """Builds a prefix for embedding cssterm boxes in LaTeX and raw text."""
-    raise NotImplemented
+def get_virtual_view(view, line_count, window):
+    """
+    Computes the (0-based, half-open) `(start, end)` range of lines
+    displayed by a virtualised cssterm box on page load.
 
+    `view` is either `None` (the first `window` lines), a `('tail', n)`
+    tuple (the last `n` lines) or a `('lines', first, last)` tuple (1-based,
+    inclusive line numbers).
+    """
+    if view is None:
+        start, end = 0, window
+    elif view[0] == 'tail':
+        start, end = line_count - view[1], line_count
+    else:
+        start, end = view[1] - 1, view[2]
+    start = min(max(start, 0), line_count)
+    end = min(max(end, start), line_count)
+    return start, end
+
+
+def write_virtual_data(builder, lines):
+    """
+    Saves the line data of a virtualised cssterm box as a JSON list in
+    the `_static` folder of the HTML build -- under a name derived from its
+    hash, therefore identical logs are saved (and downloaded) only once.
+
+    Returns the (URI) path to the JSON file relative to the build root.
+    """
+    data = json.dumps(lines, ensure_ascii=False, separators=(',', ':'))
+    return sphinx_term.assets.write_static_data(
+        builder, VIRTUAL_DATA_DIR, data)
 
-def depart_cssterm_box_node_(self, node):
-    """Builds a postfix for embedding cssterm boxes in LaTeX and raw text. """
-    raise NotImplemented
+
+def depart_cssterm_box_node(self, node):
+    """Builds a closing HTML tag for cssterm boxes."""
+    self.body.append('</div>\n')
 
 
 class CSSterm(Directive):
@@ -88,12 +296,61 @@ class CSSterm(Directive):
 
     If loaded from an external file, the box id needs to be a terminal
     transcript file name **with** the `cssterm:` prefix and **without**
-    the `.log` extension, located in a single directory.
-    The directory is given to Sphinx via the `sphinx_term_cssterm_dir`
-    config setting.
+    the `.log` extension, located in a search directory.
+    The directory -- or an ordered list of search directories, whose
+    subdirectories are searched as well (see `sphinx_term.TranscriptIndex`)
+    -- is given to Sphinx via the `sphinx_term_cssterm_dir` config setting.
     If this parameter is not set, terminal box content must be provided
     explicitly.
 
+    When the `sphinx_term_cssterm_deferred` config setting is enabled, boxes
+    loaded from a file do not embed their content in the (pickled) doctree;
+    it is saved in a transcript store shared by all the documents and only
+    loaded when the box is written.
+
+    Boxes with more lines than the `sphinx_term_cssterm_virtual_lines` config
+    setting are virtualised -- only the lines visible in a scrollable window
+    of `sphinx_term_cssterm_virtual_window` lines are rendered.
+    The initial view of a virtualised box can be changed with one of
+    the following parameters:
+
+    view-tail
+      Display the last *n* lines on page load.
+    view-lines
+      Display the given range of lines (e.g., `10-20`) on page load.
+
+    Only a part of the transcript is displayed when one of the following
+    parameters is given (see `sphinx_term.slicing`):
+
+    start-after
+      Display the lines following the first line holding this marker.
+    end-before
+      Display the lines preceding the first (subsequent) line holding this
+      marker.
+    lines
+      Display the given range of lines (e.g., `10-20`) -- of the section
+      selected by the markers, if given.
+    tail
+      Display the last *n* lines -- of the section selected by the markers,
+      if given.
+
+    The transcript files of such boxes are memory-mapped, and only the
+    selected lines are read; these boxes are never deferred.  Each slice is
+    labelled after the transcript and its slicing parameters (in the above
+    order), e.g., `cssterm:my-id[start-after=BEGIN,lines=1-10]`, hence many
+    slices of one transcript can be displayed (and referenced) in the same
+    document; the plain `cssterm:my-id` label refers to the unsliced box.
+
+    ANSI escape sequences found in the transcripts are rendered as coloured
+    and styled text (unless the `sphinx_term_cssterm_ansi` config setting is
+    disabled); the remaining escape sequences, e.g., cursor movement, are
+    removed.
+
+    When the `execute` parameter is set (to `true` or left empty), the content
+    of the directive is a list of shell commands (one per line), which are
+    run at build time (see `sphinx_term.execute`) -- each command is
+    displayed after a `$` prompt and followed by its output.
+
     This Sphinx extension monitors the terminal transcript files for changes
     and regenerates the content pages that use them if a change is detected.
     """
@@ -101,15 +358,18 @@ class CSSterm(Directive):
     optional_arguments = 0
     final_argument_whitespace = False
     has_content = True
-    option_spec = {}
+    option_spec = {i: directives.unchanged for i in CSSTERM_OPTION_SCHEMA}
 
+    @sphinx_term.instrument_directive(
+        'cssterm', lambda result: count_box_lines(result[0][0]))
     def run(self):
         """Builds a cssterm box."""
         env = self.state.document.settings.env
 
         # retrieve the path to the directory holding the code files
         st_term_dir = env.config.sphinx_term_cssterm_dir
-        assert isinstance(st_term_dir, str) or st_term_dir is None
+        assert (isinstance(st_term_dir, (str, list, tuple))
+                or st_term_dir is None)
 
         # get the terminal file name for this particular cssterm box
         assert len(self.arguments) == 1, (
@@ -122,41 +382,83 @@ class CSSterm(Directive):
         assert not term_filename_id.endswith('.log'), (
             'The terminal box label ({}) must not end with the ".log" '
             'extension prefix.'.format(term_filename_id))
-        # add the .log extension as it is missing
-        term_filename = '{}.log'.format(term_filename_id[8:])
 
-        # if the content is given explicitly, use it instead of loading a file
-        if self.content:
+        # validate the view and slicing parameters
+        with sphinx_term.measure('option_validation'):
+            errors = validate_cssterm_options(self.options)
+        if errors:
+            raise ValueError(errors[0])
+        sliced = sphinx_term.slicing.is_sliced(self.options)
+
+        # if the content is given explicitly, use it instead of loading a
+        # file -- executed boxes run the commands given as their content
+        path_localised = None
+        if sphinx_term.execute.is_executed(self.options):
+            contents = format_executed_transcript(
+                sphinx_term.execute.execute_transcript(
+                    env, sphinx_term.execute.get_commands(self.content),
+                    location=(env.docname, self.lineno)))
+        elif self.content:
             contents = '\n'.join(self.content)
         else:
-            localised_directory = sphinx_term.localise_term_directory(
-                env.srcdir,
-                st_term_dir,
-                ('sphinx_term_cssterm_dir', 'cssterm box content'))
-            # compose the full path to the code file and ensure it exists
-            path_localised = os.path.join(localised_directory, term_filename)
-            # path_original = os.path.join(st_term_dir, term_filename)
-            sphinx_term.file_exists(path_localised)
-
-            # memorise the association between the document (a content source
-            # file) and the terminal box -- this is used for watching for
-            # terminal file updates
-            env.note_dependency(path_localised)
-
-            # read in the terminal file
-            with open(path_localised, 'r') as f:
-                contents = f.read().strip('\n')
-
-        # create a cssterm node
-        box = cssterm_box(contents.strip(), contents,
-                          ids=['{}-box'.format(
-                              nodes.make_id(term_filename_id))],
-                          label=term_filename_id)
+            # find the code file in the transcript index
+            path_localised = get_transcript_path(
+                env, term_filename_id, location=(env.docname, self.lineno))
+
+            # read in the terminal file (or the selected part of it),
+            # memorising the association between the document (a content
+            # source file) and the terminal box -- this is used for watching
+            # for terminal file updates
+            if sliced:
+                contents = sphinx_term.slicing.read_transcript_slice(
+                    env, path_localised, self.options)
+            else:
+                contents = sphinx_term.read_transcript(env, path_localised)
+        if sliced and path_localised is None:
+            contents = sphinx_term.slicing.slice_transcript(
+                contents, self.options)
+
+        # create a cssterm node -- deferred boxes only reference the content
+        # of their transcript file saved in the transcript store, and the
+        # ANSI escape sequences of the remaining boxes are parsed into style
+        # runs held by the node
+        box_name = sphinx_term.slicing.get_slice_name(
+            term_filename_id, self.options)
+        box_ids = ['{}-box'.format(nodes.make_id(box_name))]
+        line_count = contents.count('\n') + 1
+        ansi = (env.config.sphinx_term_cssterm_ansi
+                and sphinx_term.ansi.has_escapes(contents))
+        deferred = env.config.sphinx_term_cssterm_deferred
+        if deferred and path_localised is not None and not sliced:
+            box = cssterm_box(
+                ids=box_ids, label=term_filename_id,
+                transcript=os.path.relpath(path_localised, env.srcdir),
+                digest=sphinx_term.store_transcript(env, contents),
+                line_count=line_count)
+            if ansi:
+                box['ansi'] = True
+        elif ansi:
+            digest = sphinx_term.get_transcript_digest(contents)
+            text, runs = parse_ansi_transcript(contents, digest)
+            box = cssterm_box(text.strip(), text, ids=box_ids,
+                              label=term_filename_id, ansi=runs,
+                              ansi_digest=digest)
+        else:
+            box = cssterm_box(contents.strip(), contents, ids=box_ids,
+                              label=term_filename_id)
+        # virtualise large boxes
+        virtual_lines = env.config.sphinx_term_cssterm_virtual_lines
+        if virtual_lines and line_count > virtual_lines:
+            box['virtual'] = True
+            if 'view-tail' in self.options:
+                box['view'] = ('tail', int(self.options['view-tail']))
+            elif 'view-lines' in self.options:
+                box['view'] = (('lines', ) + sphinx_term.parse_line_range(
+                    self.options['view-lines']))
         # create anchor
         anchor = cssterm_anchor()
-        # assign label and id (`ids=[nodes.make_id(term_filename_id)]`)
-        self.options['name'] = term_filename_id
-        self.add_name(anchor)
+        # assign label and id (`ids=[nodes.make_id(box_name)]`)
+        sphinx_term.add_box_name(self, anchor, box_name)
 
         # insert the terminal box node into the anchor node
         anchor += box
@@ -164,114 +466,152 @@ class CSSterm(Directive):
         return [anchor]
 
 
-def assign_reference_title(app, document):
-    """
-    Update the labels record of the standard environment to allow referencing
-    cssterm boxes.
+def validate_cssterm_options(options):
     """
-    # get the standard domain
-    domain = app.env.get_domain('std')
-
-    # go through every cssterm box
-    for node in document.traverse(cssterm_anchor):
-        # every cssterm box must have exactly one name starting with 'cssterm:'
-        assert node['names']
-        assert len(node['names']) == 1
-        node_name = node['names'][0]
+    Validates the options of a cssterm directive against the cssterm option
+    schema, and checks that the mutually exclusive options are not combined.
 
-        assert node_name.startswith('cssterm:'), (
-            'cssterm box ids must start with cssterm:')
-        refname = REFNAME
+    Returns a list of error messages (empty for valid options).
+    """
+    errors = sphinx_term.validate_options(
+        options, CSSTERM_OPTION_SCHEMA, 'cssterm')
+    if 'view-tail' in options and 'view-lines' in options:
+        errors.append('The *view-tail* and *view-lines* parameters are '
+                      'mutually exclusive.')
+    errors += sphinx_term.slicing.validate_slicing_options(options)
+    return errors
 
-        # every cssterm box has a single id
-        assert len(node['ids']) == 1
-        node_id = node['ids'][0]
 
-        # get the document name
-        docname = app.env.docname
+def get_transcript_path(env, term_filename_id, location=None):
+    """
+    Returns the path to the transcript file of a cssterm box -- the box id
+    without the `cssterm:` prefix and with the `.log` extension, found in
+    the `sphinx_term_cssterm_dir` search directories (see
+    `sphinx_term.find_transcript`).
+    """
+    return sphinx_term.find_transcript(
+        env, 'cssterm', '.log', term_filename_id[8:], location=location)
 
-        # every cssterm box should **already** be referenceable without a title
-        assert node_name in domain.anonlabels
-        assert domain.anonlabels[node_name] == (docname, node_id)
 
-        # allow this cssterm box to be referenced with the default
-        # 'terminal box' stub (REFNAME)
-        domain.labels[node_name] = (docname, node_id, refname)
+def is_prefetch_skipped(env, options):
+    """
+    Checks whether the transcript file of a cssterm box is not prefetched
+    (see `sphinx_term.prefetch`) -- sliced boxes only read a part of the
+    file, and deferred boxes do not hold its content.
+    """
+    return (env.config.sphinx_term_cssterm_deferred
+            or sphinx_term.slicing.is_sliced(options))
 
 
-#### Extension setup ##########################################################
+def format_executed_transcript(results):
+    """
+    Formats the `(command, output)` tuples of an executed cssterm box as
+    a terminal transcript.
+    """
+    lines = []
+    for command, output in results:
+        lines.append('$ {}'.format(command))
+        if output:
+            lines.append(output)
+    return '\n'.join(lines)
 
 
-def include_static_files(app):
+def index_box(app, node):
     """
-    Copies the static files required by this extension.
-    (Attached to the `builder-inited` Sphinx event.)
+    Validates the label of a cssterm box (given by its anchor node) and
+    records it in the environment to allow referencing the box.
+    (Called by `sphinx_term.index_document` for every cssterm anchor.)
+
+    The labels record of the standard domain is not modified directly since
+    it would not survive parallel builds; the labels are instead kept in the
+    environment and registered by `sphinx_term.register_term_labels`.
+    Returns the id of the cssterm box anchor.
     """
-    for file_name in STATIC_FILES:
-        file_path = sphinx_term.get_static_path(file_name)
-        if file_path not in app.config.html_static_path:
-            app.config.html_static_path.append(file_path)
+    # every cssterm box must have exactly one name starting with 'cssterm:'
+    assert node['names']
+    assert len(node['names']) == 1
+    node_name = node['names'][0]
 
+    assert node_name.startswith('cssterm:'), (
+        'cssterm box ids must start with cssterm:')
+    refname = REFNAME
 
-def load_static_files(app, pagename, templatename, context, doctree):
-    """Includes cssterm static files only on pages that use the module."""
-    # only go through non-empty documents
-    if doctree is None:
-        return
+    # every cssterm box has a single id
+    assert len(node['ids']) == 1
+    node_id = node['ids'][0]
 
-    # get cssterm boxes
-    cssterm_boxes = doctree.traverse(cssterm_box)
-    # skip pages without at least one cssterm box
-    if not cssterm_boxes:
-        return
+    # get the document name
+    docname = app.env.docname
 
-    # ensure that custom files were included
-    for css_file in STATIC_CSS_FILES:
-        _css_file = os.path.basename(css_file)
-        if not sphinx_term.is_css_registered(app, _css_file):
-            app.add_css_file(_css_file)
-    for js_file in STATIC_JS_FILES:
-        _js_file = os.path.basename(js_file)
-        if not sphinx_term.is_js_registered(app, _js_file):
-            app.add_js_file(_js_file)
+    # every cssterm box should **already** be referenceable without a title
+    domain = app.env.get_domain('std')
+    assert node_name in domain.anonlabels
+    assert domain.anonlabels[node_name] == (docname, node_id)
+
+    # allow this cssterm box to be referenced with the default
+    # 'terminal box' stub (REFNAME)
+    sphinx_term.add_term_label(
+        app.env, node_name, docname, node_id, refname)
 
-    # add external dependencies
-    script_files = [os.path.basename(i) for i in context['script_files']]
-    for stub, path in DEPENDENCIES.items():
-        if sphinx_term.is_js_registered(app, path) or stub in script_files:
-            continue
-        app.add_js_file(path)
+    return node_id
+
+
+#### Extension setup ##########################################################
 
 
 def setup(app):
     """
     Sets up the Sphinx extension for the `cssterm` directive.
     """
-    # register two Sphinx config values used for the extension
+    # register the Sphinx config values used for the extension
     app.add_config_value('sphinx_term_cssterm_dir', None, 'env')
-
-    # register the custom docutils nodes with Sphinx
+    app.add_config_value('sphinx_term_cssterm_deferred', False, 'env')
+    app.add_config_value('sphinx_term_cssterm_ansi', True, 'env')
+    app.add_config_value('sphinx_term_cssterm_prompt', r'\$ ', 'html')
+    app.add_config_value('sphinx_term_cssterm_virtual_lines', 2000, 'env')
+    app.add_config_value('sphinx_term_cssterm_virtual_window', 40, 'html')
+
+    # load the environment and event handlers shared with other sphinx_term
+    # extensions
+    app.setup_extension('sphinx_term.shared')
+
+    # register the custom docutils nodes with Sphinx -- only HTML builders
+    # write them since the boxes are replaced with their snapshots for the
+    # other builders (see `sphinx_term.snapshot`)
     app.add_node(
         cssterm_box,
-        html=(visit_cssterm_box_node, depart_cssterm_box_node),
-        latex=(visit_cssterm_box_node_, depart_cssterm_box_node_),
-        text=(visit_cssterm_box_node_, depart_cssterm_box_node_)
+        html=(sphinx_term.instrument_visitor(
+                  'cssterm', visit_cssterm_box_node),
+              sphinx_term.instrument_visitor(
+                  'cssterm', depart_cssterm_box_node))
     )
     app.add_node(
         cssterm_anchor,
-        html=(visit_cssterm_anchor_node, depart_cssterm_anchor_node),
-        latex=(visit_cssterm_anchor_node_, depart_cssterm_anchor_node_),
-        text=(visit_cssterm_anchor_node_, depart_cssterm_anchor_node_)
+        html=(visit_cssterm_anchor_node, depart_cssterm_anchor_node)
     )
 
     # register the custom role and directives with Sphinx
     app.add_directive('cssterm', CSSterm)
 
-    # connect custom hooks to the Sphinx build process
-    app.connect('doctree-read', assign_reference_title)
-    # ...ensure the required static files are **copied** into the build
-    app.connect('builder-inited', include_static_files)
-    # ...ensure that relevant html output pages **load** the static files
-    app.connect('html-page-context', load_static_files)
-
-    return {'version': sphinx_term.VERSION}
+    # index cssterm boxes (and their labels) when documents are read
+    sphinx_term.register_box_type('cssterm', cssterm_anchor, index_box)
+    # read the transcript files of the documents ahead of the directives
+    # (the ANSI escape sequences are parsed by each process -- see
+    # `parse_ansi_transcript`)
+    sphinx_term.prefetch.register_transcripts(
+        'cssterm', get_transcript_path, None,
+        is_skipped=is_prefetch_skipped)
+    # keep the line indexes of sliced transcripts built by parallel readers
+    app.connect('env-merge-info', sphinx_term.slicing.merge_line_indexes)
+    # bundle the static files and load them on the pages with cssterm boxes
+    sphinx_term.assets.register_static_files(
+        'cssterm', STATIC_CSS_FILES, STATIC_JS_FILES,
+        js_dependencies=DEPENDENCIES)
+    # (the line data of virtualised cssterm boxes are saved in the `_static`
+    # folder)
+    sphinx_term.assets.register_static_data_dir(VIRTUAL_DATA_DIR)
+
+    return {'version': sphinx_term.VERSION,
+            'env_version': 1,
+            'parallel_read_safe': True,
+            'parallel_write_safe': True}
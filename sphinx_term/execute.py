@@ -0,0 +1,511 @@
+# Copyright (C) 2021
+# Author: Kacper Sokol <ks1591@my.bristol.ac.uk>
+# License: new BSD
+"""
+Implements executed terminal transcripts, i.e., `cssterm` and `termynal`
+boxes whose content is produced by running commands at build time.
+
+The content of a `cssterm` or `termynal` directive with the `execute`
+parameter is a list of shell commands (one per line), which are run one
+after another when the document is read.
+Each command is executed in a subprocess with:
+
+* a fresh, temporary working directory shared by the commands of the box,
+  which holds a copy of the `sphinx_term_execute_cwd` directory if set;
+* a minimal environment (`PATH`, a UTF-8 locale and the variables given by
+  the `sphinx_term_execute_env` config value);
+* no standard input; and
+* a timeout of `sphinx_term_execute_timeout` seconds, after which the
+  command and all its child processes are killed.
+
+The results are cached on disk by the commands, their environment and
+the hash of the working directory, therefore unchanged commands are never
+re-run.
+Before the documents are read, the commands of all the executed boxes that
+are not cached yet are run in a pool of `sphinx_term_execute_workers`
+concurrent subprocesses (one per processor by default).
+Since running commands found in the documentation sources is a security
+risk, this feature needs to be explicitly enabled with the
+`sphinx_term_execute` config value.
+"""
+
+import collections
+import concurrent.futures
+import hashlib
+import json
+import os
+import shutil
+import signal
+import subprocess
+import tempfile
+
+from sphinx.util import logging
+
+import sphinx_term
+
+EXECUTE_DIR = 'sphinx_term_execute'
+# bump to invalidate the results cached by previous versions of the runner
+EXECUTE_VERSION = '1'
+
+logger = logging.getLogger(__name__)
+
+_EXECUTOR = None
+_SETTINGS = None
+# the hashes of the working directories computed during the current build
+_TREE_DIGESTS = {}
+
+
+#### Command execution ########################################################
+
+
+def is_executed(options):
+    """Checks whether the options of a directive enable its execution."""
+    execute = options.get('execute', None)
+    return (execute is not None and sphinx_term.is_boolean(execute)
+            and sphinx_term.to_boolean(execute) == 'true')
+
+
+def get_commands(content):
+    """Extracts the commands (non-empty lines) from a directive content."""
+    return [line.strip() for line in content if line.strip()]
+
+
+def run_command(command, cwd, environment, timeout):
+    """
+    Runs a shell command, killing it (and its child processes) once
+    the timeout expires.
+
+    Returns a `(output, returncode)` tuple, where the output combines
+    the standard output and error streams and the return code is `None` if
+    the command timed out.
+    """
+    process = subprocess.Popen(
+        command, shell=True, cwd=cwd, env=environment,
+        stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT, start_new_session=hasattr(os, 'killpg'))
+    try:
+        output, _ = process.communicate(timeout=timeout)
+        returncode = process.returncode
+    except subprocess.TimeoutExpired:
+        if hasattr(os, 'killpg'):
+            os.killpg(process.pid, signal.SIGKILL)
+        else:
+            process.kill()
+        output, _ = process.communicate()
+        returncode = None
+    return output.decode('utf-8', errors='replace').rstrip('\n'), returncode
+
+
+# the files skipped when copying (and hashing) the working directory --
+# the `paths` (of the Sphinx build directories and the execution cache) and
+# the documents (with one of the `source_suffixes` extensions) found in the
+# `source_dir` directory
+Exclusions = collections.namedtuple(
+    'Exclusions', ['paths', 'source_dir', 'source_suffixes'])
+
+
+def is_ignored(path, excluded):
+    """
+    Checks whether a path is skipped when copying (and hashing) the working
+    directory -- hidden files and directories as well as the `excluded`
+    paths and Sphinx source documents (see `Exclusions`) are skipped.
+    """
+    if os.path.basename(path).startswith('.'):
+        return True
+    if excluded is None:
+        return False
+    path = os.path.abspath(path)
+    if path in excluded.paths:
+        return True
+    return (path.startswith(excluded.source_dir + os.sep)
+            and path.endswith(excluded.source_suffixes)
+            and os.path.isfile(path))
+
+
+def run_commands(commands, cwd, environment, timeout, excluded=None):
+    """
+    Runs the commands of an executed terminal box one after another in
+    the same fresh, temporary working directory -- holding a copy of the `cwd`
+    directory unless it is `None` -- stopping after a command that timed
+    out.
+    (This function is executed by the execution worker pool.)
+
+    Returns a list of `[command, output, returncode]` lists.
+    """
+    sandbox = tempfile.mkdtemp(prefix='sphinx-term-')
+    results = []
+    try:
+        workdir = os.path.join(sandbox, 'cwd')
+        if cwd is None:
+            os.mkdir(workdir)
+        else:
+            shutil.copytree(cwd, workdir, ignore=lambda root, names: [
+                i for i in names
+                if is_ignored(os.path.join(root, i), excluded)])
+        environment = dict(environment, HOME=workdir)
+
+        for command in commands:
+            output, returncode = run_command(
+                command, workdir, environment, timeout)
+            results.append([command, output, returncode])
+            if returncode is None:
+                break
+    finally:
+        shutil.rmtree(sandbox, ignore_errors=True)
+    return results
+
+
+#### Execution cache ##########################################################
+
+
+# the execution settings of the current build (see `init_execution`) --
+# the directory copied into the working directory of the commands (`None`
+# for empty working directories), their environment variables and timeout,
+# the directory holding the cached execution results, and the files excluded
+# from the working directory (see `Exclusions`)
+ExecutionSettings = collections.namedtuple(
+    'ExecutionSettings',
+    ['enabled', 'cwd', 'environment', 'timeout', 'cache_dir', 'excluded'])
+
+
+def get_execution_settings(app):
+    """Collects the execution settings from the Sphinx config values."""
+    config = app.config
+
+    cwd = config.sphinx_term_execute_cwd
+    if cwd is not None:
+        cwd = os.path.abspath(os.path.join(str(app.confdir), cwd))
+
+    environment = {
+        'PATH': os.environ.get('PATH', os.defpath),
+        'LANG': 'C.UTF-8',
+        'LC_ALL': 'C.UTF-8',
+        'TERM': 'dumb'
+    }
+    environment.update(
+        {str(key): str(value) for key, value in
+         (config.sphinx_term_execute_env or {}).items()})
+
+    cache_dir = config.sphinx_term_execute_cache
+    if cache_dir is None:
+        cache_dir = os.path.join(str(app.doctreedir), EXECUTE_DIR)
+    else:
+        cache_dir = os.path.join(str(app.confdir), cache_dir)
+
+    # the build directory holding the output and doctree directories, e.g.,
+    # `_build` for `sphinx-build -M`, is excluded unless it holds the sources
+    paths = [os.path.abspath(str(i))
+             for i in (app.outdir, app.doctreedir, cache_dir)]
+    srcdir = os.path.abspath(str(app.srcdir))
+    build_dir = os.path.commonpath(paths[:2])
+    if os.path.commonpath([srcdir, build_dir]) != build_dir:
+        paths.append(build_dir)
+    excluded = Exclusions(
+        frozenset(paths), srcdir, tuple(config.source_suffix))
+
+    return ExecutionSettings(
+        bool(config.sphinx_term_execute), cwd, environment,
+        config.sphinx_term_execute_timeout, cache_dir, excluded)
+
+
+def get_tree_digest(settings):
+    """
+    Returns the hash of the working directory of the commands, computed from
+    the path and content of its files (see `is_ignored`).
+
+    The hash is computed once per build.
+    """
+    cwd = settings.cwd
+    if cwd is None:
+        return ''
+    if cwd in _TREE_DIGESTS:
+        return _TREE_DIGESTS[cwd]
+
+    digest = hashlib.sha1()
+    for root, dirnames, filenames in os.walk(cwd):
+        dirnames[:] = sorted(
+            i for i in dirnames
+            if not is_ignored(os.path.join(root, i), settings.excluded))
+        for filename in sorted(filenames):
+            path = os.path.join(root, filename)
+            if is_ignored(path, settings.excluded):
+                continue
+            try:
+                file_digest = get_file_digest(path)
+            except OSError:
+                continue
+            digest.update('{}\0{}\n'.format(
+                os.path.relpath(path, cwd), file_digest).encode('utf-8'))
+    _TREE_DIGESTS[cwd] = digest.hexdigest()
+    return _TREE_DIGESTS[cwd]
+
+
+def get_file_digest(path, chunk_size=1024 * 1024):
+    """Returns the hash of the content of a file (read in chunks)."""
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def get_execution_key(settings, commands):
+    """
+    Returns the cache key of executing a list of commands -- the hash of
+    the commands, their environment, timeout and working directory.
+    """
+    key = json.dumps(
+        [EXECUTE_VERSION, commands, sorted(settings.environment.items()),
+         settings.timeout, settings.cwd, get_tree_digest(settings)])
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def get_results_path(settings, key):
+    """Returns the path to cached execution results."""
+    return os.path.join(settings.cache_dir, '{}.json'.format(key))
+
+
+def load_results(settings, key):
+    """Loads cached execution results (`None` if not cached)."""
+    path = get_results_path(settings, key)
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def save_results(settings, key, results):
+    """
+    Caches execution results.
+
+    The results of commands that timed out are cached as well, hence they
+    are only re-run once their cache key changes (e.g., the timeout is
+    increased) rather than by every build; the timeout is reported whenever
+    the document displaying them is read (see `execute_transcript`).
+    """
+    os.makedirs(settings.cache_dir, exist_ok=True)
+    path = get_results_path(settings, key)
+    # write to a temporary file first so that concurrent (parallel) readers
+    # never see partially written results
+    path_tmp = '{}.{}.tmp'.format(path, os.getpid())
+    with open(path_tmp, 'w', encoding='utf-8') as f:
+        json.dump(results, f)
+    os.replace(path_tmp, path)
+
+
+def execute(settings, commands):
+    """
+    Returns the (cached) results of executing a list of commands (see
+    `run_commands`), running them if they are not cached yet.
+    """
+    key = get_execution_key(settings, commands)
+    results = load_results(settings, key)
+    if results is None:
+        results = run_commands(
+            commands, settings.cwd, settings.environment, settings.timeout,
+            settings.excluded)
+        save_results(settings, key, results)
+    return results
+
+
+#### Executed transcripts #####################################################
+
+
+def init_execution(app):
+    """
+    Collects the execution settings of the build and forgets the working
+    directory hashes computed by previous builds.
+    (Attached to the `builder-inited` Sphinx event.)
+
+    The settings are kept in a module variable, which is inherited by
+    parallel reader processes.
+    """
+    global _SETTINGS
+    _SETTINGS = get_execution_settings(app)
+    _TREE_DIGESTS.clear()
+
+
+def execute_transcript(env, commands, location=None):
+    """
+    Executes the commands of an executed terminal box and records them in
+    the environment (see `get_document_executions`).
+    (Called by the `cssterm` and `termynal` directives.)
+
+    Returns a list of `(command, output)` tuples -- when execution is
+    disabled, the commands are displayed without any output.
+    """
+    if not commands:
+        raise ValueError('An executed terminal box needs at least one '
+                         'command.')
+    settings = _SETTINGS
+    if settings is None or not settings.enabled:
+        logger.warning('[sphinx-term] executing terminal transcripts is '
+                       'disabled; set the sphinx_term_execute config value '
+                       'to True to enable it', location=location)
+        return [(command, '') for command in commands]
+
+    with sphinx_term.measure('execution'):
+        results = execute(settings, commands)
+    get_document_executions(env).setdefault(env.docname, {})[
+        get_execution_key(settings, commands)] = commands
+
+    for command, _, returncode in results:
+        if returncode is None:
+            logger.warning('[sphinx-term] command timed out after %ss: %s',
+                           settings.timeout, command, location=location)
+    return [(command, output) for command, output, _ in results]
+
+
+def get_document_executions(env):
+    """
+    Returns the record of executed terminal boxes stored in the Sphinx
+    environment, which maps the name of every document with executed boxes
+    to a `{key: commands}` dictionary (see `get_execution_key`).
+    """
+    if not hasattr(env, 'sphinx_term_executions'):
+        env.sphinx_term_executions = {}
+    return env.sphinx_term_executions
+
+
+def purge_executions(app, env, docname):
+    """
+    Removes the executed terminal boxes of a document that is about to be
+    (re-)read.
+    (Attached to the `env-purge-doc` Sphinx event.)
+    """
+    get_document_executions(env).pop(docname, None)
+
+
+def merge_executions(app, env, docnames, other):
+    """
+    Merges the executed terminal boxes recorded by a parallel reader
+    process.
+    (Attached to the `env-merge-info` Sphinx event.)
+    """
+    executions = get_document_executions(env)
+    other_executions = get_document_executions(other)
+    for docname in docnames:
+        if docname in other_executions:
+            executions[docname] = other_executions[docname]
+
+
+def get_outdated_documents(app, env, added, changed, removed):
+    """
+    Finds the documents that need to be re-read since the commands of their
+    executed terminal boxes need to be re-run, e.g., after their working
+    directory or the execution config values changed, or since their results
+    are not cached (e.g., the cache directory was removed).
+    (Attached to the `env-get-outdated` Sphinx event.)
+    """
+    outdated = []
+    for docname, executions in sorted(get_document_executions(env).items()):
+        if docname in removed or docname in changed:
+            continue
+        if any(get_execution_key(_SETTINGS, commands) != key
+               or not os.path.exists(get_results_path(_SETTINGS, key))
+               for key, commands in executions.items()):
+            outdated.append(docname)
+    return outdated
+
+
+#### Parallel execution #######################################################
+
+
+def find_executed_commands(env, docnames):
+    """
+    Finds the commands of the executed terminal boxes in the sources of
+    the given documents.
+    """
+    from sphinx_term import lint
+
+    found = []
+    for docname in docnames:
+        path = str(env.doc2path(docname))
+        for directive in lint.find_source_directives(path):
+            if is_executed(directive.options):
+                commands = get_commands(directive.content)
+                if commands:
+                    found.append(commands)
+    return found
+
+
+def prefetch_executions(app, env, docnames):
+    """
+    Runs the commands of all the executed terminal boxes in the documents
+    that are about to be read and are not cached yet in a pool of concurrent
+    subprocesses.
+    (Attached to the `env-before-read-docs` Sphinx event.)
+    """
+    settings = _SETTINGS
+    if not settings.enabled:
+        return
+
+    missing = {}
+    for commands in find_executed_commands(env, docnames):
+        key = get_execution_key(settings, commands)
+        if key not in missing and load_results(settings, key) is None:
+            missing[key] = commands
+    if len(missing) < 2:
+        return
+
+    logger.info('[sphinx-term] executing %d terminal transcripts',
+                len(missing))
+    workers = app.config.sphinx_term_execute_workers
+    executor = get_executor(workers or None)
+    futures = {key: executor.submit(
+                   run_commands, commands, settings.cwd,
+                   settings.environment, settings.timeout, settings.excluded)
+               for key, commands in missing.items()}
+    for key, future in futures.items():
+        save_results(settings, key, future.result())
+
+
+def get_executor(workers):
+    """
+    Returns the (lazily created) execution worker pool -- since the commands
+    are run in subprocesses, each worker thread only waits for its
+    subprocess to finish.
+    """
+    global _EXECUTOR
+    if _EXECUTOR is None:
+        if workers is None:
+            workers = os.cpu_count() or 1
+        _EXECUTOR = concurrent.futures.ThreadPoolExecutor(
+            max_workers=workers)
+    return _EXECUTOR
+
+
+def shutdown_executor(app, exception):
+    """
+    Shuts down the execution worker pool.
+    (Attached to the `build-finished` Sphinx event.)
+    """
+    global _EXECUTOR
+    if _EXECUTOR is not None:
+        _EXECUTOR.shutdown()
+        _EXECUTOR = None
+
+
+def setup(app):
+    """
+    Sets up the Sphinx extension for executed terminal transcripts.
+    (Loaded automatically by the `sphinx_term.shared` extension.)
+    """
+    app.add_config_value('sphinx_term_execute', False, 'env')
+    app.add_config_value('sphinx_term_execute_timeout', 30, 'env')
+    app.add_config_value('sphinx_term_execute_workers', 0, '')
+    app.add_config_value('sphinx_term_execute_cwd', None, 'env')
+    app.add_config_value('sphinx_term_execute_env', {}, 'env')
+    app.add_config_value('sphinx_term_execute_cache', None, '')
+
+    app.connect('builder-inited', init_execution)
+    app.connect('env-get-outdated', get_outdated_documents)
+    app.connect('env-before-read-docs', prefetch_executions)
+    app.connect('env-purge-doc', purge_executions)
+    app.connect('env-merge-info', merge_executions)
+    app.connect('build-finished', shutdown_executor)
+
+    return {'version': sphinx_term.VERSION,
+            'parallel_read_safe': True,
+            'parallel_write_safe': True}
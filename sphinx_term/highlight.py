@@ -0,0 +1,104 @@
+# Copyright (C) 2021
+# Author: Kacper Sokol <ks1591@my.bristol.ac.uk>
+# License: new BSD
+"""
+Implements the syntax highlighting of the commands displayed by terminal
+boxes.
+
+When the `sphinx_term_highlight` config value names a Pygments lexer, e.g.,
+`bash`, the input lines of termynal boxes and the cssterm lines following
+a prompt (see the `sphinx_term_cssterm_prompt` config value) are
+highlighted with the Pygments classes styled by the `pygments.css` file of
+Sphinx HTML builds.
+
+The lexer and the formatter are created once per build (and inherited by
+parallel writer processes), and the highlighted commands are memorised by
+each process in a size-bounded cache.
+"""
+
+from pygments import highlight
+from pygments.formatters import HtmlFormatter
+from pygments.lexers import get_lexer_by_name
+from pygments.util import ClassNotFound
+from sphinx.util import logging
+
+import sphinx_term
+
+# the number of highlighted commands memorised by each process
+HIGHLIGHT_CACHE_SIZE = 4096
+# the lexer used when the `sphinx_term_highlight` config value is `True`
+DEFAULT_LEXER = 'bash'
+
+logger = logging.getLogger(__name__)
+
+# the `(lexer_name, lexer, formatter)` tuple of the current build (see
+# `init_highlighting`) -- `None` when highlighting is disabled
+_HIGHLIGHTER = None
+_HIGHLIGHTED = sphinx_term.TranscriptCache(HIGHLIGHT_CACHE_SIZE)
+
+
+def init_highlighting(app):
+    """
+    Creates the Pygments lexer and formatter used by the current build and
+    empties the cache of highlighted commands.
+    (Attached to the `builder-inited` Sphinx event.)
+
+    The highlighter is kept in a module variable, which is inherited by
+    parallel writer processes.
+    """
+    global _HIGHLIGHTER, _HIGHLIGHTED
+    _HIGHLIGHTER = None
+    _HIGHLIGHTED = sphinx_term.TranscriptCache(HIGHLIGHT_CACHE_SIZE)
+
+    lexer_name = app.config.sphinx_term_highlight
+    if not lexer_name:
+        return
+    if lexer_name is True:
+        lexer_name = DEFAULT_LEXER
+    try:
+        lexer = get_lexer_by_name(lexer_name, stripnl=False)
+    except ClassNotFound:
+        logger.warning('[sphinx-term] unknown Pygments lexer (%s) given by '
+                       'the sphinx_term_highlight config value; commands '
+                       'are not highlighted', lexer_name)
+        return
+    _HIGHLIGHTER = (lexer_name, lexer, HtmlFormatter(nowrap=True))
+
+
+def is_enabled():
+    """Checks whether commands are highlighted by the current build."""
+    return _HIGHLIGHTER is not None
+
+
+def highlight_command(command):
+    """
+    Highlights a command -- returns its HTML markup wrapped in a span with
+    the `highlight` class, which scopes the Pygments styles of Sphinx.
+    """
+    if not command.strip():
+        return command
+    lexer_name, lexer, formatter = _HIGHLIGHTER
+    key = (lexer_name, command)
+    markup = _HIGHLIGHTED.get(key, None)
+    if markup is None:
+        # commands are single lines, hence the new line appended by the
+        # Pygments formatter is removed
+        markup = '<span class="highlight">{}</span>'.format(
+            highlight(command, lexer, formatter).rstrip('\n'))
+        _HIGHLIGHTED.put(key, markup)
+    return markup
+
+
+def setup(app):
+    """
+    Sets up the Sphinx extension for highlighting the commands of terminal
+    boxes.
+    (Loaded automatically by the `sphinx_term.shared` extension.)
+    """
+    app.add_config_value('sphinx_term_highlight', None, 'html')
+
+    app.connect('builder-inited', init_highlighting)
+
+    return {'version': sphinx_term.VERSION,
+            'parallel_read_safe': True,
+            'parallel_write_safe': True}
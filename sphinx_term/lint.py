@@ -0,0 +1,451 @@
+# Copyright (C) 2021
+# Author: Kacper Sokol <ks1591@my.bristol.ac.uk>
+# License: new BSD
+"""
+Implements a standalone linter of `cssterm` and `termynal` terminal
+transcripts, which does not require building the documentation with Sphinx.
+
+The linter is executed with::
+
+   python -m sphinx_term.lint [-j JOBS] [--termynal-dir DIR]
+                              [--cssterm-dir DIR] [PATH [PATH ...]]
+
+The `--termynal-dir` and `--cssterm-dir` directories -- i.e., the values of
+the `sphinx_term_termynal_dir` and `sphinx_term_cssterm_dir` config
+settings, which can be given multiple times for multiple search
+directories -- are searched for terminal transcripts (`.yml` and `.log`
+files respectively).
+Each `PATH` is either a terminal transcript, a content source file
+(`.rst` or `.md`) whose `termynal` and `cssterm` directives are validated,
+or a directory searched for such files.
+All the files are linted in parallel and every error is reported as
+a `path:line: message` line.
+The exit code is `0` when no errors are found, `1` when errors are found
+and `2` for invalid command line arguments.
+"""
+
+import argparse
+import collections
+import concurrent.futures
+import os
+import re
+import sys
+
+import sphinx_term
+import sphinx_term.execute
+from sphinx_term import cssterm, termynal
+
+# transcript extensions (the termynal directive only loads `.yml` files)
+TERMYNAL_EXTENSIONS = ('.yml', )
+CSSTERM_EXTENSIONS = ('.log', )
+SOURCE_EXTENSIONS = ('.rst', '.md')
+
+_RST_DIRECTIVE = re.compile(
+    r'^(?P<indent>\s*)\.\.\s+(?P<name>termynal|cssterm)::(?P<argument>.*)$')
+_RST_OPTION = re.compile(r'^:(?P<name>[^:\s]+):(?:\s+(?P<value>.*))?$')
+_MYST_DIRECTIVE = re.compile(
+    r'^(?P<indent>\s*)(?P<fence>`{3,}|:{3,})'
+    r'\{(?P<name>termynal|cssterm)\}(?P<argument>.*)$')
+
+# a directive found in a content source file
+Directive = collections.namedtuple(
+    'Directive', ['name', 'argument', 'options', 'content', 'lineno',
+                  'content_lineno'])
+
+
+#### Transcript linting #######################################################
+
+
+def format_message(message):
+    """Collapses a (multi-line) error message into a single line."""
+    return ' '.join(str(message).split())
+
+
+def lint_termynal_transcript(contents, lineno=1):
+    """
+    Lints a yml-formatted termynal transcript.
+
+    Returns a list of `(line, message)` tuples -- one for each error --
+    where the line numbers start at `lineno`.
+    Unlike the `termynal` directive, which stops at the first error, all the
+    termynal lines are validated (unless the YAML syntax is invalid).
+    """
+    # (the `yaml` module is imported on demand since this module is also
+    # used by Sphinx builds -- see `sphinx_term.prefetch`)
+    import yaml
+    errors = []
+    events = yaml.parse(contents, Loader=termynal.get_yaml_loader())
+    constructor = yaml.constructor.SafeConstructor()
+    try:
+        for line_node in termynal.compose_yaml_list(events):
+            line = constructor.construct_document(line_node)
+            for message in termynal.get_termynal_line_errors(line):
+                errors.append(
+                    (lineno + line_node.start_mark.line, message))
+    except yaml.MarkedYAMLError as e:
+        mark = e.problem_mark or e.context_mark
+        line = lineno if mark is None else lineno + mark.line
+        errors.append((line, 'Invalid termynal content YAML format: '
+                             '{}'.format(e.problem or e.context)))
+    except (yaml.YAMLError, ValueError) as e:
+        errors.append((lineno, str(e)))
+    return errors
+
+
+def lint_cssterm_transcript(data, lineno=1):
+    """
+    Lints a cssterm transcript given as bytes, which must be UTF-8 encoded.
+
+    Returns a list of `(line, message)` tuples.
+    """
+    try:
+        data.decode('utf-8')
+    except UnicodeDecodeError as e:
+        line = lineno + data.count(b'\n', 0, e.start)
+        return [(line, 'The cssterm transcript is not UTF-8 encoded: '
+                       '{}.'.format(e.reason))]
+    return []
+
+
+#### Directive linting ########################################################
+
+
+def find_rst_directives(lines):
+    """Finds the `termynal` and `cssterm` directives in reST source lines."""
+    directives = []
+    i = 0
+    while i < len(lines):
+        match = _RST_DIRECTIVE.match(lines[i])
+        i += 1
+        if match is None:
+            continue
+        lineno = i
+        indent = len(match.group('indent'))
+
+        # collect the (indented) directive block
+        block = []
+        while i < len(lines) and (not lines[i].strip() or len(
+                lines[i]) - len(lines[i].lstrip()) > indent):
+            block.append(lines[i])
+            i += 1
+        while block and not block[-1].strip():
+            block.pop()
+
+        # leading field list holds the options -- docutils lowercases their
+        # names
+        options = collections.OrderedDict()
+        j = 0
+        while j < len(block):
+            option = _RST_OPTION.match(block[j].strip())
+            if option is None:
+                break
+            name = option.group('name').lower()
+            options[name] = option.group('value') or ''
+            j += 1
+        while j < len(block) and not block[j].strip():
+            j += 1
+
+        content = block[j:]
+        margin = min([len(l) - len(l.lstrip()) for l in content if l.strip()]
+                     or [0])
+        directives.append(Directive(
+            match.group('name'), match.group('argument').strip(), options,
+            [l[margin:] for l in content], lineno, lineno + 1 + j))
+    return directives
+
+
+def find_myst_directives(lines):
+    """Finds the `termynal` and `cssterm` directives in MyST source lines."""
+    directives = []
+    i = 0
+    while i < len(lines):
+        match = _MYST_DIRECTIVE.match(lines[i])
+        i += 1
+        if match is None:
+            continue
+        lineno = i
+        fence = match.group('fence')
+        closing = re.compile(r'^\s*{}{{{},}}\s*$'.format(
+            re.escape(fence[0]), len(fence)))
+
+        # collect the fenced directive block
+        block = []
+        while i < len(lines) and not closing.match(lines[i]):
+            block.append(lines[i])
+            i += 1
+        i += 1
+
+        # the options are either given as a YAML block or a field list
+        options = collections.OrderedDict()
+        j = 0
+        if block and block[0].strip() == '---':
+            import yaml
+            j = 1
+            while j < len(block) and block[j].strip() != '---':
+                j += 1
+            try:
+                parsed = yaml.safe_load('\n'.join(block[1:j])) or {}
+            except yaml.YAMLError:
+                parsed = {}
+            if isinstance(parsed, dict):
+                for key, value in parsed.items():
+                    if value is None:
+                        value = ''
+                    elif isinstance(value, bool):
+                        value = str(value).lower()
+                    options[str(key)] = str(value)
+            j += 1
+        else:
+            while j < len(block):
+                option = _RST_OPTION.match(block[j].strip())
+                if option is None:
+                    break
+                options[option.group('name')] = option.group('value') or ''
+                j += 1
+        while j < len(block) and not block[j].strip():
+            j += 1
+
+        content = block[j:]
+        while content and not content[-1].strip():
+            content.pop()
+        directives.append(Directive(
+            match.group('name'), match.group('argument').strip(), options,
+            content, lineno, lineno + 1 + j))
+    return directives
+
+
+def find_source_directives(path):
+    """
+    Finds the `termynal` and `cssterm` directives in a content source file
+    (an empty list if the file cannot be read).
+
+    The sources that do not mention either directive are not parsed.
+    """
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            contents = f.read()
+    except (OSError, UnicodeDecodeError):
+        return []
+    if 'termynal' not in contents and 'cssterm' not in contents:
+        return []
+    lines = contents.splitlines()
+    if path.endswith('.md'):
+        return find_myst_directives(lines)
+    return find_rst_directives(lines)
+
+
+def lint_directive(directive, termynal_index, cssterm_index):
+    """
+    Lints the id, options and content of a `termynal` or `cssterm`
+    directive -- the transcript files are looked up in the given
+    `sphinx_term.TranscriptIndex` indexes.
+
+    Returns a list of `(line, message)` tuples.
+    """
+    if directive.name == 'termynal':
+        extension, transcript_index = '.yml', termynal_index
+    else:
+        extension, transcript_index = '.log', cssterm_index
+    prefix = '{}:'.format(directive.name)
+    term_filename_id = directive.argument
+
+    errors = []
+    if not term_filename_id.startswith(prefix):
+        errors.append((directive.lineno,
+                       'The terminal box label ({}) must start with the '
+                       '"{}" prefix.'.format(term_filename_id, prefix)))
+    elif term_filename_id.endswith(extension):
+        errors.append((directive.lineno,
+                       'The terminal box label ({}) must not end with the '
+                       '"{}" extension prefix.'.format(
+                           term_filename_id, extension)))
+
+    if directive.name == 'termynal':
+        messages = termynal.validate_termynal_options(directive.options)
+    else:
+        messages = cssterm.validate_cssterm_options(directive.options)
+    errors += [(directive.lineno, message) for message in messages]
+
+    if sphinx_term.execute.is_executed(directive.options):
+        # the content of executed boxes is a list of commands
+        if not sphinx_term.execute.get_commands(directive.content):
+            errors.append((directive.lineno,
+                           'An executed terminal box needs at least one '
+                           'command.'))
+    elif directive.content:
+        contents = '\n'.join(directive.content)
+        if directive.name == 'termynal':
+            errors += lint_termynal_transcript(
+                contents, lineno=directive.content_lineno)
+    elif (transcript_index is not None
+            and term_filename_id.startswith(prefix)):
+        term_id = term_filename_id[len(prefix):]
+        path, candidates = transcript_index.find(term_id)
+        if path is None:
+            path = os.path.join(transcript_index.directories[0],
+                                '{}{}'.format(term_id, extension))
+        if candidates:
+            errors.append((directive.lineno,
+                           'The terminal box id ({}) is ambiguous -- it '
+                           'matches {}.'.format(term_id,
+                                                ', '.join(candidates))))
+        elif not os.path.isfile(path):
+            errors.append((directive.lineno,
+                           'The code file ({}) does not exist.'.format(path)))
+    return errors
+
+
+#### Linter ###################################################################
+
+
+def lint_file(path, termynal_index=None, cssterm_index=None):
+    """
+    Lints a terminal transcript or a content source file.
+    (This function is executed by the linter worker pool.)
+
+    Returns a list of `(path, line, message)` tuples.
+    """
+    extension = os.path.splitext(path)[1].lower()
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+    except (IOError, OSError) as e:
+        return [(path, 1, 'Cannot read the file: {}.'.format(e.strerror))]
+
+    if extension in CSSTERM_EXTENSIONS:
+        errors = lint_cssterm_transcript(data)
+    else:
+        try:
+            contents = data.decode('utf-8')
+        except UnicodeDecodeError as e:
+            return [(path, 1 + data.count(b'\n', 0, e.start),
+                     'The file is not UTF-8 encoded: {}.'.format(e.reason))]
+        if extension in TERMYNAL_EXTENSIONS:
+            errors = lint_termynal_transcript(contents)
+        else:
+            lines = contents.splitlines()
+            if extension == '.md':
+                directives = find_myst_directives(lines)
+            else:
+                directives = find_rst_directives(lines)
+            errors = []
+            for directive in directives:
+                errors += lint_directive(
+                    directive, termynal_index, cssterm_index)
+
+    return [(path, line, format_message(message))
+            for line, message in sorted(errors, key=lambda e: e[0])]
+
+
+def find_files(path, extensions):
+    """
+    Lists the files with one of the `extensions` found (recursively) in
+    the `path` directory, or the `path` itself if it is a file.
+    """
+    if os.path.isfile(path):
+        return [path]
+    files = []
+    for root, dirs, filenames in os.walk(path):
+        dirs[:] = sorted(d for d in dirs if not d.startswith('.'))
+        for filename in sorted(filenames):
+            if os.path.splitext(filename)[1].lower() in extensions:
+                files.append(os.path.join(root, filename))
+    return files
+
+
+def get_directories(directories):
+    """Returns a list of search directories given a path or a list."""
+    if directories is None:
+        return []
+    if isinstance(directories, str):
+        return [directories]
+    return list(directories)
+
+
+def lint(paths, termynal_dir=None, cssterm_dir=None, jobs=0):
+    """
+    Lints terminal transcripts and content source files in parallel using
+    `jobs` processes (`0` uses one process per processor).
+    The transcript directories are either paths or lists of search
+    directories (see `sphinx_term.TranscriptIndex`).
+
+    Returns a list of `(path, line, message)` tuples ordered by path.
+    """
+    termynal_dirs = get_directories(termynal_dir)
+    cssterm_dirs = get_directories(cssterm_dir)
+    termynal_index = (sphinx_term.TranscriptIndex(termynal_dirs, '.yml')
+                      if termynal_dirs else None)
+    cssterm_index = (sphinx_term.TranscriptIndex(cssterm_dirs, '.log')
+                     if cssterm_dirs else None)
+
+    files = []
+    for directory in termynal_dirs:
+        files += find_files(directory, TERMYNAL_EXTENSIONS)
+    for directory in cssterm_dirs:
+        files += find_files(directory, CSSTERM_EXTENSIONS)
+    for path in paths:
+        files += find_files(path, TERMYNAL_EXTENSIONS + CSSTERM_EXTENSIONS
+                            + SOURCE_EXTENSIONS)
+    files = list(collections.OrderedDict.fromkeys(files))
+
+    if len(files) < 2 or jobs == 1:
+        results = [lint_file(path, termynal_index, cssterm_index)
+                   for path in files]
+    else:
+        with concurrent.futures.ProcessPoolExecutor(
+                max_workers=jobs or None) as executor:
+            results = list(executor.map(
+                lint_file, files, [termynal_index] * len(files),
+                [cssterm_index] * len(files), chunksize=8))
+
+    return [error for result in results for error in result]
+
+
+def main(argv=None):
+    """Runs the terminal transcript linter from the command line."""
+    parser = argparse.ArgumentParser(
+        prog='python -m sphinx_term.lint',
+        description='Lints sphinx-term terminal transcripts and the cssterm '
+                    'and termynal directives of content source files.')
+    parser.add_argument(
+        'paths', metavar='PATH', nargs='*',
+        help='a terminal transcript (.yml or .log), a content source file '
+             '(.rst or .md) or a directory holding such files')
+    parser.add_argument(
+        '-t', '--termynal-dir', metavar='DIR', action='append', default=[],
+        help='a termynal transcript search directory '
+             '(sphinx_term_termynal_dir); can be given multiple times')
+    parser.add_argument(
+        '-c', '--cssterm-dir', metavar='DIR', action='append', default=[],
+        help='a cssterm transcript search directory '
+             '(sphinx_term_cssterm_dir); can be given multiple times')
+    parser.add_argument(
+        '-j', '--jobs', metavar='N', type=int, default=0,
+        help='the number of worker processes (default: one per processor)')
+    args = parser.parse_args(argv)
+
+    if not (args.paths or args.termynal_dir or args.cssterm_dir):
+        parser.error('at least one PATH, --termynal-dir or --cssterm-dir '
+                     'is required')
+    if args.jobs < 0:
+        parser.error('the number of jobs must be non-negative')
+    for path in args.paths + args.termynal_dir + args.cssterm_dir:
+        if not os.path.exists(path):
+            parser.error('the path ({}) does not exist'.format(path))
+    for path in args.termynal_dir + args.cssterm_dir:
+        if not os.path.isdir(path):
+            parser.error('the path ({}) is not a directory'.format(path))
+
+    errors = lint(args.paths, termynal_dir=args.termynal_dir,
+                  cssterm_dir=args.cssterm_dir, jobs=args.jobs)
+    for path, line, message in errors:
+        print('{}:{}: {}'.format(path, line, message))
+    if errors:
+        print('Found {} error(s) in {} file(s).'.format(
+            len(errors), len(set(e[0] for e in errors))), file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,225 @@
+# Copyright (C) 2021
+# Author: Kacper Sokol <ks1591@my.bristol.ac.uk>
+# License: new BSD
+"""
+Implements the concurrent prefetching of terminal transcript files.
+
+The `cssterm` and `termynal` directives read their transcript files one at
+a time in document order, which is slow on file systems with a high
+per-file latency, e.g., network mounts.
+Therefore, before the documents are read, their sources are scanned for
+the directives loading transcript files (see `sphinx_term.lint`), and these
+files are read -- and parsed -- concurrently in a pool of
+`sphinx_term_prefetch_workers` threads.
+The directives then take the prefetched transcripts (see
+`sphinx_term.read_transcript`) and their parsed content (see
+`sphinx_term.parse_transcript`) instead of waiting for the file system.
+
+The prefetched transcripts are kept in memory until all the documents are
+read, and are inherited by parallel reader processes, therefore prefetching
+is disabled by default (see the `sphinx_term_prefetch` config setting) and
+bounded by the `sphinx_term_prefetch_bytes` config setting -- the transcript
+files that do not fit this budget are read by their directives.
+The boxes that only read a part of their transcript file or do not hold its
+content, e.g., sliced and deferred cssterm boxes, are never prefetched.
+Since the transcripts are read ahead of their boxes, the time spent reading
+and parsing them is not attributed to the boxes by the build
+instrumentation report (see `sphinx_term.report`).
+"""
+
+import collections
+import concurrent.futures
+import os
+
+from sphinx.util import logging
+
+import sphinx_term
+import sphinx_term.execute
+
+logger = logging.getLogger(__name__)
+
+# the box types loading transcript files -- each box type maps to
+# a `(get_path, get_parser, is_skipped)` tuple (see `register_transcripts`)
+_TRANSCRIPT_TYPES = collections.OrderedDict()
+
+
+def register_transcripts(box_type, get_path, get_parser, is_skipped=None):
+    """
+    Registers the transcript files loaded by the directive of a terminal box
+    type, which builds boxes labelled `box_type:id`.
+
+    `get_path(env, label)` returns the path to the transcript file of a box
+    (raising a `RuntimeError` if the transcript directory is not set), and
+    `get_parser(env, contents)` returns the function used by the directive
+    to parse the transcript (see `sphinx_term.parse_transcript`) or `None`
+    if it is not parsed -- `get_parser` is `None` for the directives that
+    do not use the transcript cache.
+    `is_skipped(env, options)` checks whether the transcript file of a box
+    should not be prefetched given its directive options, e.g., when the box
+    only reads a part of the file.
+    """
+    _TRANSCRIPT_TYPES[box_type] = (get_path, get_parser, is_skipped)
+
+
+def find_transcripts(env, docnames):
+    """
+    Finds the transcript files loaded by the terminal boxes of the given
+    documents -- returns a `{path: box_type}` dictionary.
+    """
+    from sphinx_term import lint
+
+    found = collections.OrderedDict()
+    for docname in docnames:
+        path = str(env.doc2path(docname))
+        for directive in lint.find_source_directives(path):
+            # the content of the boxes given explicitly (or executed) is not
+            # loaded from files
+            if (directive.content or directive.name not in _TRANSCRIPT_TYPES
+                    or sphinx_term.execute.is_executed(directive.options)):
+                continue
+            prefix = '{}:'.format(directive.name)
+            if not directive.argument.startswith(prefix):
+                continue
+            get_path, _, is_skipped = _TRANSCRIPT_TYPES[directive.name]
+            if is_skipped is not None and is_skipped(env, directive.options):
+                continue
+            try:
+                transcript_path = get_path(env, directive.argument)
+            except RuntimeError:
+                continue
+            found.setdefault(transcript_path, directive.name)
+    return found
+
+
+def get_transcript_size(path):
+    """
+    Returns the size of a transcript file -- `None` if it cannot be read.
+    (This function is executed by the prefetch worker pool.)
+    """
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return None
+
+
+def select_transcripts(paths, sizes, budget):
+    """
+    Selects the transcript files -- in document order -- whose total size
+    fits the prefetch budget (in bytes; `0` stands for no limit).
+    """
+    selected = []
+    total = 0
+    for path, size in zip(paths, sizes):
+        if size is None or (budget and total + size > budget):
+            continue
+        selected.append(path)
+        total += size
+    return selected
+
+
+def prefetch_transcript(path):
+    """
+    Reads a transcript file (see `sphinx_term.read_transcript_file`) --
+    `None` if it cannot be read.
+    (This function is executed by the prefetch worker pool.)
+    """
+    try:
+        return sphinx_term.read_transcript_file(path)
+    except (OSError, UnicodeDecodeError):
+        return None
+
+
+def parse_transcript(parse, contents):
+    """
+    Parses a prefetched transcript -- `None` if it is invalid, in which case
+    the error is reported by its directive.
+    (This function is executed by the prefetch worker pool.)
+    """
+    try:
+        return parse(contents)
+    except Exception:
+        return None
+
+
+def prefetch_transcripts(app, env, docnames):
+    """
+    Reads the transcript files loaded by the documents that are about to be
+    read -- up to the `sphinx_term_prefetch_bytes` budget -- concurrently in
+    a pool of threads, and parses the transcripts that are not in the
+    transcript cache yet.
+    (Attached to the `env-before-read-docs` Sphinx event.)
+    """
+    sphinx_term.set_prefetched_transcripts({})
+    if not app.config.sphinx_term_prefetch or not _TRANSCRIPT_TYPES:
+        return
+
+    found = find_transcripts(env, docnames)
+    if len(found) < 2:
+        return
+
+    workers = app.config.sphinx_term_prefetch_workers
+    # 0 workers stands for the default size of Python thread pools
+    with concurrent.futures.ThreadPoolExecutor(
+            max_workers=workers or None) as executor:
+        paths = select_transcripts(
+            found, executor.map(get_transcript_size, found),
+            app.config.sphinx_term_prefetch_bytes)
+        transcripts = collections.OrderedDict(
+            (path, transcript)
+            for path, transcript in zip(
+                paths, executor.map(prefetch_transcript, paths))
+            if transcript is not None)
+
+        # parse the transcripts missing from the cache (shared by the
+        # transcripts with the same content)
+        cache = sphinx_term.get_transcript_cache(env)
+        futures = collections.OrderedDict()
+        for path, (_, _, contents) in transcripts.items():
+            # do not evict the prefetched transcripts from the cache before
+            # their directives take them
+            if len(futures) >= cache.maxsize:
+                break
+            box_type = found[path]
+            _, get_parser, _ = _TRANSCRIPT_TYPES[box_type]
+            if get_parser is None:
+                continue
+            parse = get_parser(env, contents)
+            key = (box_type, path, sphinx_term.get_transcript_digest(contents))
+            if parse is not None and key not in cache:
+                futures[key] = executor.submit(
+                    parse_transcript, parse, contents)
+        parsed = 0
+        for key, future in futures.items():
+            result = future.result()
+            if result is not None:
+                cache.put(key, result)
+                parsed += 1
+
+    sphinx_term.set_prefetched_transcripts(transcripts)
+    logger.info('[sphinx-term] prefetched %d terminal transcripts (%d '
+                'parsed)', len(transcripts), parsed)
+
+
+def forget_transcripts(app, env):
+    """
+    Releases the prefetched transcripts once all the documents are read.
+    (Attached to the `env-updated` Sphinx event.)
+    """
+    sphinx_term.set_prefetched_transcripts({})
+
+
+def setup(app):
+    """
+    Sets up the Sphinx extension for prefetching terminal transcripts.
+    (Loaded automatically by the `sphinx_term.shared` extension.)
+    """
+    app.add_config_value('sphinx_term_prefetch', False, '')
+    app.add_config_value('sphinx_term_prefetch_bytes', 64 * 1024 * 1024, '')
+    app.add_config_value('sphinx_term_prefetch_workers', 8, '')
+
+    app.connect('env-before-read-docs', prefetch_transcripts)
+    app.connect('env-updated', forget_transcripts)
+
+    return {'version': sphinx_term.VERSION,
+            'parallel_read_safe': True,
+            'parallel_write_safe': True}
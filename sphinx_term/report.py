@@ -0,0 +1,253 @@
+# Copyright (C) 2021
+# Author: Kacper Sokol <ks1591@my.bristol.ac.uk>
+# License: new BSD
+"""
+Implements the build instrumentation report of `cssterm` and `termynal`
+boxes.
+
+When the `sphinx_term_report` config value is set, the extensions measure
+every terminal box built by the `cssterm` and `termynal` directives -- its
+number of lines, the number of bytes read from its transcript file, and
+the time spent reading, parsing, validating and executing its transcript --
+as well as the time spent in the HTML visitors of terminal box nodes.
+At the end of the build these metrics are saved as a JSON report, and
+a summary is printed to the console if the `sphinx_term_report_summary`
+config value is set.
+
+Only the documents read (or written) by the current build are included in
+the report.
+"""
+
+import collections
+import json
+import os
+import shutil
+
+from sphinx.util import logging
+
+import sphinx_term
+
+REPORT_FILE = 'sphinx_term_report.json'
+# the directory (in the doctree directory) holding the visitor metrics saved
+# by (parallel) writer processes
+PARTS_DIR = 'sphinx_term_report'
+# the number of the slowest transcripts and documents listed in the report
+TOP = 10
+
+BOX_METRICS = ['lines', 'bytes', 'io', 'parse', 'validation', 'execution',
+               'time', 'cache_hits']
+
+logger = logging.getLogger(__name__)
+
+
+#### Metrics collection #######################################################
+
+
+def is_instrumented(config):
+    """Checks whether the build should be instrumented."""
+    return bool(config.sphinx_term_report
+                or config.sphinx_term_report_summary)
+
+
+def init_report(app):
+    """
+    Enables the build instrumentation and removes the metrics saved by
+    previous builds.
+    (Attached to the `builder-inited` Sphinx event.)
+    """
+    sphinx_term.set_instrumented(is_instrumented(app.config))
+    shutil.rmtree(os.path.join(app.doctreedir, PARTS_DIR),
+                  ignore_errors=True)
+
+
+def reset_term_metrics(app, env, docnames):
+    """
+    Removes the terminal box metrics collected by previous builds.
+    (Attached to the `env-before-read-docs` Sphinx event.)
+    """
+    sphinx_term.get_term_metrics(env).clear()
+
+
+def save_visitor_metrics(app, pagename, templatename, context, doctree):
+    """
+    Saves the time spent in the HTML visitors of terminal box nodes while
+    writing a page.
+    (Attached to the `html-page-context` Sphinx event.)
+
+    The page may be written by a parallel writer process, whose memory is
+    discarded once it finishes, therefore the metrics are appended to
+    a file owned by the process.
+    """
+    if not is_instrumented(app.config):
+        return
+    metrics = sphinx_term.pop_visitor_metrics()
+    if not metrics:
+        return
+
+    parts_dir = os.path.join(app.doctreedir, PARTS_DIR)
+    os.makedirs(parts_dir, exist_ok=True)
+    parts_file = os.path.join(parts_dir, '{}.jsonl'.format(os.getpid()))
+    with open(parts_file, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(metrics))
+        f.write('\n')
+
+
+def load_visitor_metrics(app):
+    """
+    Loads the visitor metrics saved by all the writer processes as
+    a `{docname: {box_type: seconds}}` dictionary.
+    """
+    metrics = collections.defaultdict(collections.Counter)
+    parts_dir = os.path.join(app.doctreedir, PARTS_DIR)
+    if os.path.isdir(parts_dir):
+        for parts_file in sorted(os.listdir(parts_dir)):
+            with open(os.path.join(parts_dir, parts_file), 'r',
+                      encoding='utf-8') as f:
+                for line in f:
+                    for docname, page in json.loads(line).items():
+                        metrics[docname].update(page)
+        shutil.rmtree(parts_dir, ignore_errors=True)
+    for docname, page in sphinx_term.pop_visitor_metrics().items():
+        metrics[docname].update(page)
+    return metrics
+
+
+#### Report ###################################################################
+
+
+def summarise_boxes(boxes):
+    """Aggregates the metrics of a list of terminal boxes."""
+    summary = collections.OrderedDict()
+    summary['boxes'] = dict(collections.Counter(box['type'] for box in boxes))
+    for metric in BOX_METRICS:
+        summary[metric] = sum(box.get(metric, 0) for box in boxes)
+    return summary
+
+
+def get_box_metrics(box, docname):
+    """
+    Computes the reported metrics of a terminal box -- the transcript parsing
+    time is reported without the time spent validating termynal lines.
+    """
+    line_validation = box.get('line_validation', 0)
+    metrics = collections.OrderedDict()
+    metrics['id'] = box['id']
+    metrics['type'] = box['type']
+    metrics['document'] = docname
+    metrics['line'] = box['line']
+    metrics['lines'] = box.get('lines', 0)
+    metrics['bytes'] = box.get('bytes', 0)
+    metrics['io'] = box.get('io', 0)
+    metrics['parse'] = box.get('parse', 0) - line_validation
+    metrics['validation'] = (
+        box.get('option_validation', 0) + line_validation)
+    metrics['execution'] = box.get('execution', 0)
+    metrics['time'] = box.get('time', 0)
+    metrics['cache_hits'] = box.get('cache_hits', 0)
+    return metrics
+
+
+def build_report(app, visitor_metrics):
+    """Compiles the build instrumentation report."""
+    term_metrics = sphinx_term.get_term_metrics(app.env)
+
+    boxes = []
+    documents = {}
+    for docname in sorted(set(term_metrics).union(visitor_metrics)):
+        document_boxes = [get_box_metrics(box, docname)
+                          for box in term_metrics.get(docname, [])]
+        boxes += document_boxes
+        document = summarise_boxes(document_boxes)
+        document['visitors'] = sum(visitor_metrics.get(docname, {}).values())
+        document['total'] = document['time'] + document['visitors']
+        documents[docname] = document
+
+    totals = summarise_boxes(boxes)
+    totals['documents'] = len(documents)
+    totals['visitors'] = sum(i['visitors'] for i in documents.values())
+    totals['total'] = totals['time'] + totals['visitors']
+
+    report = collections.OrderedDict()
+    report['version'] = sphinx_term.VERSION
+    report['builder'] = app.builder.name
+    report['totals'] = totals
+    report['slowest_transcripts'] = sorted(
+        boxes, key=lambda box: box['time'], reverse=True)[:TOP]
+    report['slowest_documents'] = [
+        {'document': docname, 'total': document['total']}
+        for docname, document in sorted(
+            documents.items(), key=lambda i: i[1]['total'],
+            reverse=True)[:TOP]]
+    report['documents'] = collections.OrderedDict(sorted(documents.items()))
+    return report
+
+
+def get_report_path(app):
+    """
+    Returns the path of the JSON report -- either given by the
+    `sphinx_term_report` config value (relative to the configuration
+    directory) or placed in the doctree directory.
+    """
+    path = app.config.sphinx_term_report
+    if isinstance(path, str):
+        return os.path.join(app.confdir, path)
+    return os.path.join(app.doctreedir, REPORT_FILE)
+
+
+def log_summary(report):
+    """Prints a summary of the build instrumentation report."""
+    totals = report['totals']
+    logger.info('[sphinx-term] %d terminal boxes (%s) with %d lines in %d '
+                'documents; %.1f KiB read',
+                sum(totals['boxes'].values()),
+                ', '.join('{} {}'.format(count, box_type) for box_type, count
+                          in sorted(totals['boxes'].items())) or 'none',
+                totals['lines'], totals['documents'], totals['bytes'] / 1024)
+    logger.info('[sphinx-term] directives %.3fs (file I/O %.3fs, parsing '
+                '%.3fs, validation %.3fs, execution %.3fs); HTML visitors '
+                '%.3fs', totals['time'], totals['io'], totals['parse'],
+                totals['validation'], totals['execution'], totals['visitors'])
+    if report['slowest_transcripts']:
+        logger.info('[sphinx-term] slowest transcripts: %s', ', '.join(
+            '{} ({}) {:.3f}s'.format(box['id'], box['document'], box['time'])
+            for box in report['slowest_transcripts'][:5]))
+    if report['slowest_documents']:
+        logger.info('[sphinx-term] slowest documents: %s', ', '.join(
+            '{} {:.3f}s'.format(document['document'], document['total'])
+            for document in report['slowest_documents'][:5]))
+
+
+def write_report(app, exception):
+    """
+    Saves the build instrumentation report (and prints its summary).
+    (Attached to the `build-finished` Sphinx event.)
+    """
+    if exception is not None or not is_instrumented(app.config):
+        return
+
+    report = build_report(app, load_visitor_metrics(app))
+    if app.config.sphinx_term_report_summary:
+        log_summary(report)
+    if app.config.sphinx_term_report:
+        path = get_report_path(app)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        logger.info('[sphinx-term] build report saved to %s', path)
+
+
+def setup(app):
+    """
+    Sets up the Sphinx extension for the build instrumentation report.
+    (Loaded automatically by the `sphinx_term.shared` extension.)
+    """
+    app.add_config_value('sphinx_term_report', False, '')
+    app.add_config_value('sphinx_term_report_summary', False, '')
+
+    app.connect('builder-inited', init_report)
+    app.connect('env-before-read-docs', reset_term_metrics)
+    app.connect('html-page-context', save_visitor_metrics)
+    app.connect('build-finished', write_report)
+
+    return {'version': sphinx_term.VERSION,
+            'parallel_read_safe': True,
+            'parallel_write_safe': True}
@@ -0,0 +1,67 @@
+# Copyright (C) 2021
+# Author: Kacper Sokol <ks1591@my.bristol.ac.uk>
+# License: new BSD
+"""
+Implements the Sphinx setup shared by the `cssterm` and `termynal`
+extensions -- it registers the environment and event handlers defined in
+the `sphinx_term` module and loads the auxiliary extensions (snapshots,
+execution, highlighting, assets, report, precompression and prefetching)
+exactly once per build.
+"""
+
+import sphinx_term
+
+
+def setup(app):
+    """
+    Sets up the environment and event handlers shared by the `cssterm` and
+    `termynal` extensions.
+    (Loaded automatically by both extensions.)
+    """
+    # register the size of the parsed transcript cache
+    app.add_config_value(
+        'sphinx_term_cache_size', sphinx_term.TRANSCRIPT_CACHE_SIZE, '')
+
+    app.connect('builder-inited', sphinx_term.reset_transcript_indexes)
+    app.connect('doctree-read', sphinx_term.index_document)
+    app.connect('env-get-outdated', sphinx_term.get_outdated_documents)
+    app.connect(
+        'env-before-read-docs', sphinx_term.report_outdated_documents)
+    app.connect(
+        'env-before-read-docs', sphinx_term.unregister_term_labels)
+    app.connect('env-purge-doc', sphinx_term.purge_term_labels)
+    app.connect('env-purge-doc', sphinx_term.purge_term_index)
+    app.connect(
+        'env-purge-doc', sphinx_term.purge_transcript_dependencies)
+    app.connect('env-purge-doc', sphinx_term.purge_term_metrics)
+    app.connect('env-merge-info', sphinx_term.merge_term_labels)
+    app.connect('env-merge-info', sphinx_term.merge_term_index)
+    app.connect(
+        'env-merge-info', sphinx_term.merge_transcript_dependencies)
+    app.connect('env-merge-info', sphinx_term.merge_term_metrics)
+    app.connect('env-merge-info', sphinx_term.merge_transcript_cache)
+    app.connect('env-updated', sphinx_term.register_term_labels)
+    app.connect('env-updated', sphinx_term.prune_transcript_store)
+
+    # replace terminal boxes with their snapshots for non-HTML builders
+    app.setup_extension('sphinx_term.snapshot')
+    # run the commands of executed terminal boxes
+    app.setup_extension('sphinx_term.execute')
+    # highlight the commands displayed by terminal boxes
+    app.setup_extension('sphinx_term.highlight')
+    # bundle the static files of the extensions
+    app.setup_extension('sphinx_term.assets')
+    # report the build metrics of terminal boxes
+    app.setup_extension('sphinx_term.report')
+    # precompress the HTML build artifacts of terminal boxes
+    app.setup_extension('sphinx_term.compress')
+    # read the transcript files ahead of the directives
+    app.setup_extension('sphinx_term.prefetch')
+
+    return {'version': sphinx_term.VERSION,
+            # the version of the terminal box records kept in the
+            # environment -- the environments pickled with a different
+            # version are re-read
+            'env_version': 2,
+            'parallel_read_safe': True,
+            'parallel_write_safe': True}
@@ -0,0 +1,250 @@
+# Copyright (C) 2021
+# Author: Kacper Sokol <ks1591@my.bristol.ac.uk>
+# License: new BSD
+"""
+Implements the slicing of (large) terminal transcripts -- the `start-after`,
+`end-before`, `lines` and `tail` options of the `cssterm` directive.
+
+The `start-after` and `end-before` markers select the section of
+a transcript between the line holding the first occurrence of the former
+and the line holding the first subsequent occurrence of the latter
+(both excluded); the `lines` range (1-based, inclusive) and the last `tail`
+lines are then selected from this section.
+Lines are separated by the `\\n` character.
+
+Transcript files are memory-mapped, therefore only the selected lines are
+copied into memory and decoded -- slicing a few lines out of a large log
+costs constant memory.
+Line ranges are found with a sparse line index (see `LineIndex`) --
+the number of lines preceding every block of `LINE_INDEX_BLOCK` bytes --
+which is cached in the Sphinx environment for every transcript file.
+"""
+
+import bisect
+import os
+
+import sphinx_term
+
+# the number of bytes covered by every entry of a line index
+LINE_INDEX_BLOCK = 256 * 1024
+
+SLICING_OPTIONS = ('start-after', 'end-before', 'lines', 'tail')
+
+
+class LineIndex(object):
+    """
+    A sparse index of the line offsets of a transcript -- it holds the number
+    of lines preceding every block of `block` bytes, hence the start of any
+    line is found by scanning at most a single block.
+    """
+
+    def __init__(self, buffer, block=LINE_INDEX_BLOCK):
+        """Indexes the lines of a bytes-like `buffer` (e.g., an `mmap`)."""
+        import array
+        self.block = block
+        self.size = len(buffer)
+        self.counts = array.array('q')
+        total = 0
+        # memory maps cannot count characters, hence every block is copied
+        for start in range(0, self.size, block):
+            self.counts.append(total)
+            total += buffer[start:start + block].count(b'\n')
+        self.newlines = total
+
+    def line_at(self, buffer, offset):
+        """Returns the (0-based) number of the line holding an offset."""
+        if not self.counts or offset <= 0:
+            return 0
+        block = min(offset // self.block, len(self.counts) - 1)
+        start = block * self.block
+        return self.counts[block] + buffer[start:offset].count(b'\n')
+
+    def line_start(self, buffer, line):
+        """
+        Returns the offset of the start of a (0-based) line -- the size of
+        the buffer for lines past its end.
+        """
+        if line <= 0:
+            return 0
+        if line > self.newlines:
+            return self.size
+        # the block holding the `line`-th new line character
+        block = bisect.bisect_left(self.counts, line) - 1
+        offset = block * self.block - 1
+        for _ in range(line - self.counts[block]):
+            offset = buffer.find(b'\n', offset + 1)
+        return offset + 1
+
+
+def is_sliced(options):
+    """Checks whether the options of a cssterm box slice its transcript."""
+    return any(option in options for option in SLICING_OPTIONS)
+
+
+def get_slice_name(label, options):
+    """
+    Returns the name of a cssterm box given its label and options -- sliced
+    boxes are named after their label followed by their slicing options in
+    brackets (in the order of `SLICING_OPTIONS`), e.g.,
+    `cssterm:build[lines=2-3]`, hence many slices of a transcript can be
+    displayed (and referenced) in a single document.
+    """
+    spec = ','.join('{}={}'.format(option, options[option])
+                    for option in SLICING_OPTIONS if option in options)
+    if not spec:
+        return label
+    return '{}[{}]'.format(label, spec)
+
+
+def validate_slicing_options(options):
+    """
+    Validates the combination of the slicing options of a cssterm box (see
+    `sphinx_term.cssterm.CSSTERM_OPTION_SCHEMA` for their values).
+
+    Returns a list of error messages (empty for valid options).
+    """
+    if 'lines' in options and 'tail' in options:
+        return ['The *lines* and *tail* parameters are mutually exclusive.']
+    return []
+
+
+def find_marker(buffer, option, marker, start, end):
+    """
+    Returns the offset of the first occurrence of a marker between
+    the `start` and `end` offsets of a buffer.
+    """
+    offset = buffer.find(marker.encode('utf-8'), start, end)
+    if offset == -1:
+        raise ValueError('The *{}* marker ({}) is not found in the '
+                         'transcript.'.format(option, marker))
+    return offset
+
+
+def slice_buffer(buffer, options, get_index):
+    """
+    Returns the `(start, end)` offsets of the part of a transcript (given as
+    a bytes-like `buffer`) selected by the slicing options of a cssterm box.
+
+    `get_index` returns the `LineIndex` of the buffer; it is only called for
+    the `lines` option.
+    """
+    start, end = 0, len(buffer)
+    if 'start-after' in options:
+        marker = options['start-after']
+        offset = find_marker(buffer, 'start-after', marker, start, end)
+        offset = buffer.find(
+            b'\n', offset + len(marker.encode('utf-8')), end)
+        start = end if offset == -1 else offset + 1
+    if 'end-before' in options:
+        offset = find_marker(
+            buffer, 'end-before', options['end-before'], start, end)
+        offset = buffer.rfind(b'\n', start, offset)
+        end = start if offset == -1 else offset + 1
+
+    if 'lines' in options:
+        first, last = sphinx_term.parse_line_range(options['lines'])
+        index = get_index()
+        base = index.line_at(buffer, start)
+        start, end = (
+            min(max(index.line_start(buffer, base + first - 1), start), end),
+            min(index.line_start(buffer, base + last), end))
+    elif 'tail' in options:
+        tail = int(options['tail'])
+        offset = end
+        # ignore the new line character ending the last line
+        if offset > start and buffer[offset - 1:offset] == b'\n':
+            offset -= 1
+        for _ in range(tail):
+            offset = buffer.rfind(b'\n', start, offset)
+            if offset == -1:
+                offset = start - 1
+                break
+        start = offset + 1
+
+    if start >= end:
+        raise ValueError('The slicing parameters select no lines of the '
+                         'transcript.')
+    return start, end
+
+
+def decode_slice(data):
+    """
+    Decodes a transcript slice, translating its new lines as text files do,
+    without the leading and trailing new lines.
+    """
+    text = data.decode('utf-8')
+    return text.replace('\r\n', '\n').replace('\r', '\n').strip('\n')
+
+
+def slice_transcript(contents, options):
+    """
+    Slices a terminal transcript given as a string (e.g., the content of
+    a cssterm directive).
+    """
+    buffer = contents.encode('utf-8')
+    start, end = slice_buffer(buffer, options, lambda: LineIndex(buffer))
+    return decode_slice(buffer[start:end])
+
+
+def get_line_indexes(env):
+    """
+    Returns the line index cache stored in the Sphinx environment, which maps
+    the path of every sliced transcript (relative to the source directory)
+    to a `(mtime, size, LineIndex)` tuple.
+    """
+    if not hasattr(env, 'sphinx_term_line_indexes'):
+        env.sphinx_term_line_indexes = {}
+    return env.sphinx_term_line_indexes
+
+
+def get_line_index(env, path, stat, buffer):
+    """
+    Returns the line index of a transcript file, which is only rebuilt when
+    the modification time or size of the file changes.
+    """
+    rel_path = os.path.relpath(path, env.srcdir)
+    indexes = get_line_indexes(env)
+    mtime, size, index = indexes.get(rel_path, (None, None, None))
+    if mtime != stat.st_mtime or size != stat.st_size:
+        index = LineIndex(buffer)
+        indexes[rel_path] = (stat.st_mtime, stat.st_size, index)
+    return index
+
+
+def merge_line_indexes(app, env, docnames, other):
+    """
+    Merges the line indexes built by a parallel reader process.
+    (Attached to the `env-merge-info` Sphinx event.)
+    """
+    get_line_indexes(env).update(get_line_indexes(other))
+
+
+def read_transcript_slice(env, path, options):
+    """
+    Reads the part of a terminal transcript file selected by the slicing
+    options of a cssterm box from the memory-mapped file.
+
+    Unlike `sphinx_term.read_transcript`, which hashes the entire transcript
+    to track it by content, the dependency of the current document on the
+    file is recorded with `env.note_dependency`, i.e., by modification time.
+    """
+    import mmap
+    with sphinx_term.measure('io'):
+        with open(path, 'rb') as f:
+            stat = os.fstat(f.fileno())
+            # empty files cannot be memory-mapped
+            if stat.st_size:
+                buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                buffer = b''
+            try:
+                start, end = slice_buffer(
+                    buffer, options,
+                    lambda: get_line_index(env, path, stat, buffer))
+                data = buffer[start:end]
+            finally:
+                if stat.st_size:
+                    buffer.close()
+    sphinx_term.count('bytes', len(data))
+    env.note_dependency(path)
+    return decode_slice(data)
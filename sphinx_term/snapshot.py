@@ -0,0 +1,411 @@
+# Copyright (C) 2021
+# Author: Kacper Sokol <ks1591@my.bristol.ac.uk>
+# License: new BSD
+"""
+Implements build-time snapshots of `cssterm` and `termynal` boxes.
+
+A snapshot captures the final frame of a terminal box -- i.e., its content
+once the animation has finished -- and is used by builders that cannot run
+the JavaScript animations.
+Builders that support SVG images, e.g., EPUB, receive the snapshot as an SVG
+image, and so do the builders whose image types SVG images can be converted
+into by an enabled (and available) image converter, e.g., LaTeX with
+`sphinx.ext.imgconverter` and ImageMagick installed.
+All the other builders, e.g., text, man or LaTeX without an image converter,
+receive the snapshot as a literal block.
+HTML builders use snapshots only when the `sphinx_term_snapshot_html` config
+value is set to `True`, in which case the pages do not need JavaScript.
+"""
+
+import concurrent.futures
+import hashlib
+import os
+
+from docutils import nodes
+from sphinx.transforms.post_transforms import SphinxPostTransform
+
+import sphinx_term
+
+SNAPSHOT_DIR = 'sphinx_term_snapshots'
+# bump to invalidate snapshots cached by previous versions of the renderer
+SNAPSHOT_VERSION = '1'
+
+FONT_SIZE = 14
+CHAR_WIDTH = 8.4  # approximate advance of a monospaced glyph (0.6em)
+LINE_HEIGHT = 21
+PADDING = 16
+HEADER_HEIGHT = 32
+
+STYLES = {
+    'cssterm': {
+        'background': '#000000',
+        'foreground': '#c0c0c0',
+        'prompt': '#c0c0c0',
+        'header': False
+    },
+    'termynal': {
+        'background': '#252a33',
+        'foreground': '#eeeeee',
+        'prompt': '#a2a2a2',
+        'header': True
+    }
+}
+
+TEXT_FORMATS = ('text', 'man')
+
+_EXECUTOR = None
+
+
+#### Final frames #############################################################
+
+
+def cssterm_frame(text):
+    """
+    Computes the final frame of a cssterm box (given its text) as a list of
+    `(prompt, text)` tuples.
+    """
+    return [(None, line) for line in text.split('\n')]
+
+
+def termynal_frame(box):
+    """
+    Computes the final frame of a termynal box as a list of
+    `(prompt, text)` tuples -- mirroring the termynal JavaScript library.
+    """
+    from sphinx_term import termynal
+
+    def get_attribute(node, names, default):
+        for name in names:
+            value = node.get(name, None)
+            if value is not None:
+                return value
+        return default
+
+    progress_length = termynal.get_box_setting(box, 'progressLength')
+    progress_char = termynal.get_box_setting(box, 'progressChar')
+    prompt_default = termynal.get_line_default(box, 'prompt')
+    percent_default = termynal.get_line_default(box, 'progressPercent')
+
+    frame = []
+    for line in box.expand_lines():
+        line_type = line.get('type', '')
+        if line_type == 'input':
+            prompt = get_attribute(line, ['prompt'], prompt_default)
+            frame.append((prompt, line.astext()))
+        elif line_type == 'progress':
+            length = int(get_attribute(
+                line, ['progressLength', 'progresslength'], progress_length))
+            char = get_attribute(
+                line, ['progressChar', 'progresschar'], progress_char)
+            percent_max = int(get_attribute(
+                line, ['progressPercent', 'progresspercent'],
+                percent_default))
+            chars = char * length
+            text = ''
+            for i in range(1, len(chars) + 1):
+                # JavaScript's Math.round for non-negative numbers
+                percent = int(i / len(chars) * 100 + 0.5)
+                text = '{} {}%'.format(chars[:i], percent)
+                if percent > percent_max:
+                    break
+            frame.append((None, text))
+        else:
+            frame.append((None, line.astext()))
+    return frame
+
+
+def frame_to_text(frame):
+    """Renders a final frame as plain text."""
+    lines = []
+    for prompt, text in frame:
+        if prompt is None:
+            lines.append(text)
+        else:
+            lines.append('{} {}'.format(prompt, text))
+    return '\n'.join(lines)
+
+
+#### SVG rendering ############################################################
+
+
+def render_svg(frame, box_type):
+    """
+    Renders a final frame of a terminal box (of the `box_type` type) as
+    an SVG image.
+    (This function is executed by the snapshot worker pool, therefore it
+    only operates on plain Python objects.)
+    """
+    style = STYLES[box_type]
+
+    columns = max([len(frame_to_text([line])) for line in frame] + [1])
+    header = HEADER_HEIGHT if style['header'] else 0
+    width = int(2 * PADDING + columns * CHAR_WIDTH + 0.5)
+    height = header + 2 * PADDING + len(frame) * LINE_HEIGHT
+
+    svg = ['<svg xmlns="http://www.w3.org/2000/svg" '
+           'width="{w}" height="{h}" viewBox="0 0 {w} {h}">'.format(
+               w=width, h=height),
+           '<rect width="100%" height="100%" rx="4" fill="{}"/>'.format(
+               style['background'])]
+    if style['header']:
+        for i, colour in enumerate(['#d9515d', '#f4c025', '#3ec930']):
+            svg.append('<circle cx="{}" cy="{}" r="6" fill="{}"/>'.format(
+                PADDING + 6 + i * 20, HEADER_HEIGHT / 2 + 4, colour))
+    svg.append('<g font-family="\'Fira Mono\', Consolas, Menlo, Monaco, '
+               'monospace" font-size="{}" fill="{}" '
+               'xml:space="preserve">'.format(FONT_SIZE, style['foreground']))
+    for i, (prompt, text) in enumerate(frame):
+        y = header + PADDING + (i + 1) * LINE_HEIGHT - (
+            LINE_HEIGHT - FONT_SIZE) / 2 - 2
+        line = ['<text x="{}" y="{}">'.format(PADDING, y)]
+        if prompt is not None:
+            line.append('<tspan fill="{}">{} </tspan>'.format(
+                style['prompt'], escape_xml(prompt)))
+        line.append(escape_xml(text))
+        line.append('</text>')
+        svg.append(''.join(line))
+    svg.append('</g>')
+    svg.append('</svg>\n')
+
+    return '\n'.join(svg)
+
+
+def escape_xml(text):
+    """Escapes text for embedding in XML."""
+    return (text.replace('&', '&amp;')
+                .replace('<', '&lt;')
+                .replace('>', '&gt;'))
+
+
+def write_svg(path, frame, box_type):
+    """
+    Renders a final frame of a terminal box as an SVG image and saves it
+    under the given path.
+    (This function is executed by the snapshot worker pool.)
+    """
+    svg = render_svg(frame, box_type)
+    # write to a temporary file first so that concurrent builds never see
+    # partially written snapshots
+    path_tmp = '{}.{}.tmp'.format(path, os.getpid())
+    with open(path_tmp, 'w', encoding='utf-8') as f:
+        f.write(svg)
+    os.replace(path_tmp, path)
+    return path
+
+
+def get_snapshot_path(app, frame, box_type):
+    """
+    Returns the (absolute) path to the (cached) SVG snapshot of a final
+    frame, which is named after the hash of the frame content.
+    """
+    digest = hashlib.sha1(repr(
+        (SNAPSHOT_VERSION, box_type, frame)).encode('utf-8')).hexdigest()
+    return os.path.join(app.doctreedir, SNAPSHOT_DIR,
+                        '{}-{}.svg'.format(box_type, digest))
+
+
+def render_snapshots(app, snapshots):
+    """
+    Renders the SVG snapshots that are not cached yet.
+
+    `snapshots` is a list of `(path, frame, box_type)` tuples.
+    More than one snapshot is rendered concurrently in a pool of
+    `sphinx_term_snapshot_workers` processes (one per processor by default).
+    """
+    missing = {}
+    for path, frame, box_type in snapshots:
+        if not os.path.exists(path):
+            missing[path] = (frame, box_type)
+    if not missing:
+        return
+    os.makedirs(os.path.join(app.doctreedir, SNAPSHOT_DIR), exist_ok=True)
+
+    workers = app.config.sphinx_term_snapshot_workers
+    if len(missing) == 1 or workers == 1:
+        for path, (frame, box_type) in missing.items():
+            write_svg(path, frame, box_type)
+    else:
+        # 0 workers stands for the number of processors on the machine
+        executor = get_executor(workers or None)
+        futures = [executor.submit(write_svg, path, frame, box_type)
+                   for path, (frame, box_type) in missing.items()]
+        for future in futures:
+            future.result()
+
+
+def get_executor(workers):
+    """Returns the (lazily created) snapshot worker pool."""
+    global _EXECUTOR
+    if _EXECUTOR is None:
+        _EXECUTOR = concurrent.futures.ProcessPoolExecutor(
+            max_workers=workers)
+    return _EXECUTOR
+
+
+def shutdown_executor(app, exception):
+    """
+    Shuts down the snapshot worker pool.
+    (Attached to the `build-finished` Sphinx event.)
+    """
+    global _EXECUTOR
+    if _EXECUTOR is not None:
+        _EXECUTOR.shutdown()
+        _EXECUTOR = None
+
+
+def can_convert_svg(app, document):
+    """
+    Checks whether an enabled image converter (e.g., the one provided by
+    `sphinx.ext.imgconverter`) is available and can convert SVG images into
+    an image type supported by the current builder.
+    """
+    from sphinx.transforms.post_transforms.images import ImageConverter
+
+    supported = app.builder.supported_image_types
+    for converter in app.registry.get_post_transforms():
+        if not (isinstance(converter, type)
+                and issubclass(converter, ImageConverter)):
+            continue
+        if not any(source == 'image/svg+xml' and destination in supported
+                   for source, destination in converter.conversion_rules):
+            continue
+        # the availability is memorised by the converter class itself
+        # (mirroring `ImageConverter.match`)
+        if converter.available is None:
+            converter.available = converter(document).is_available()
+        if converter.available:
+            return True
+    return False
+
+
+def get_snapshot_type(app, document):
+    """
+    Returns the type of the snapshots replacing the terminal boxes for the
+    current builder -- `'image'` for SVG images (possibly converted),
+    `'literal'` for literal blocks or `None` when the builder runs the
+    JavaScript animations.
+    """
+    builder = app.builder
+    if builder.format == 'html' and not app.config.sphinx_term_snapshot_html:
+        return None
+    # the builders that can neither include nor convert SVG images receive
+    # literal blocks
+    if builder.format in TEXT_FORMATS or not builder.supported_image_types:
+        return 'literal'
+    if ('image/svg+xml' in builder.supported_image_types
+            or can_convert_svg(app, document)):
+        return 'image'
+    return 'literal'
+
+
+def get_boxes(env, document):
+    """
+    Returns the `(anchor, box, frame, box_type)` tuples of all the terminal
+    boxes of a document -- the node referenced by the box labels, the box
+    node, its final frame and its type.
+    """
+    from sphinx_term import cssterm, termynal
+
+    boxes = []
+    for node in document.traverse(cssterm.cssterm_box):
+        boxes.append((node.parent, node,
+                      cssterm_frame(cssterm.get_box_text(env, node)),
+                      'cssterm'))
+    for node in document.traverse(termynal.termynal_box):
+        boxes.append((node, node, termynal_frame(node), 'termynal'))
+    return boxes
+
+
+def get_snapshot_uri(app, frame, box_type):
+    """
+    Returns the URI of the SVG snapshot of a final frame -- images are given
+    relative to the source directory.
+    """
+    return os.path.relpath(
+        get_snapshot_path(app, frame, box_type), app.srcdir)
+
+
+def register_snapshot_images(app, doctree):
+    """
+    Registers the SVG snapshots of the terminal boxes of a document as its
+    images, which are copied into the build output by the builder.
+
+    The snapshots are registered when the document is read, since the Sphinx
+    environment must not change while the documents are (possibly
+    concurrently) written; they are rendered by the `TerminalSnapshots`
+    post-transform.
+    (Attached to the `doctree-read` Sphinx event.)
+    """
+    if get_snapshot_type(app, doctree) != 'image':
+        return
+    for _, _, frame, box_type in get_boxes(app.env, doctree):
+        app.env.images.add_file(
+            app.env.docname, get_snapshot_uri(app, frame, box_type))
+
+
+#### Snapshot post-transform ##################################################
+
+
+class TerminalSnapshots(SphinxPostTransform):
+    """
+    Replaces cssterm and termynal boxes with their snapshots for builders
+    that cannot run the JavaScript animations.
+    """
+    default_priority = 5
+
+    def is_supported(self):
+        """Checks whether the current builder needs snapshots."""
+        return get_snapshot_type(self.app, self.document) is not None
+
+    def run(self, **kwargs):
+        """
+        Builds the snapshots of all the terminal boxes -- the SVG snapshots
+        are registered as images when the document is read (see
+        `register_snapshot_images`).
+        """
+        boxes = get_boxes(self.env, self.document)
+        if not boxes:
+            return
+
+        literal = get_snapshot_type(self.app, self.document) == 'literal'
+        if not literal:
+            render_snapshots(
+                self.app,
+                [(get_snapshot_path(self.app, frame, box_type),
+                  frame, box_type) for _, _, frame, box_type in boxes])
+
+        for anchor, box, frame, box_type in boxes:
+            if literal:
+                text = frame_to_text(frame)
+                snapshot = nodes.literal_block(text, text)
+            else:
+                path = get_snapshot_uri(self.app, frame, box_type)
+                snapshot = nodes.image(
+                    uri=path,
+                    alt=frame_to_text(frame),
+                    candidates={'image/svg+xml': path})
+            snapshot['classes'].append('sphinx-term-snapshot')
+            # retain the ids used to reference the box
+            ids = list(anchor['ids'])
+            if box is not anchor:
+                ids += box['ids']
+            target = nodes.target('', '', ids=ids)
+            anchor.replace_self([target, snapshot])
+
+
+def setup(app):
+    """
+    Sets up the Sphinx extension for terminal box snapshots.
+    (Loaded automatically by the `sphinx_term.shared` extension.)
+    """
+    # (the documents are read again to register their snapshot images)
+    app.add_config_value('sphinx_term_snapshot_html', False, 'env')
+    app.add_config_value('sphinx_term_snapshot_workers', 0, '')
+
+    app.connect('doctree-read', register_snapshot_images)
+    app.add_post_transform(TerminalSnapshots)
+    app.connect('build-finished', shutdown_executor)
+
+    return {'version': sphinx_term.VERSION,
+            'parallel_read_safe': True,
+            'parallel_write_safe': True}
@@ -5,14 +5,21 @@
 Implements the `termynal` directive for Jupyter Book and Sphinx.
 """
 
+import collections
+import json
+import math
 import os
 import sys
-import yaml
 
 from docutils import nodes
 from docutils.parsers.rst import Directive, directives
+from sphinx.util import logging
 
 import sphinx_term
+import sphinx_term.assets
+import sphinx_term.execute
+import sphinx_term.highlight
+import sphinx_term.prefetch
 
 DEPENDENCIES = {  # See sphinx_term/_static/README.md for more info
 }
@@ -21,12 +28,17 @@ STYLES = {
     'firamono.css': 'https://fonts.googleapis.com/css?family=Fira+Mono'
 }
 
-STATIC_CSS_FILES = ['termynal/termynal.css']
-STATIC_JS_FILES = ['termynal/termynal.js']
+STATIC_CSS_FILES = ['termynal/termynal.css', 'sphinx-term/highlight.css',
+                    'sphinx-term/termynal-css.css']
+STATIC_JS_FILES = ['termynal/termynal.js', 'sphinx-term/termynal-highlight.js']
 STATIC_FILES = STATIC_CSS_FILES + STATIC_JS_FILES
 
 REFNAME = 'terminal box'
 
+# the directory (within the `_static` folder of the HTML build) holding
+# the externalised lines of termynal boxes
+EXTERNAL_DATA_DIR = 'transcripts'
+
 TERMYNAL_ATTRS = [
     'prefix',
     'startDelay',
@@ -45,62 +57,515 @@ TERMYNAL_LINE_ATTRS = [
     'typeDelay',
     'cursor'
 ]
+# the `(option, attribute name)` pairs of the termynal box options emitted
+# as `data-ty-*` HTML attributes, and the attribute names of the (lowercase)
+# termynal line keys (docutils lowercases the names of node attributes)
+TERMYNAL_ATTR_NAMES = [(i, 'data-ty-{}'.format(i.lower()))
+                       for i in TERMYNAL_ATTRS]
+TERMYNAL_LINE_ATTR_NAMES = {i.lower(): 'data-ty-{}'.format(i.lower())
+                            for i in TERMYNAL_LINE_ATTRS}
+# the default settings of the termynal script and style sheet, which can be
+# overridden for the whole project with the `sphinx_term_termynal_defaults`
+# config value (see `init_termynal_defaults`) -- the settings equal to their
+# termynal defaults are not emitted as HTML attributes
+TERMYNAL_DEFAULTS = {
+    'startDelay': 600,
+    'typeDelay': 90,
+    'lineDelay': 1500,
+    'progressLength': 40,
+    'progressChar': '\u2588',
+    'progressPercent': 100,
+    'cursor': '\u258b',
+    'prompt': '$'
+}
+# the line settings whose defaults can be given for all the lines of a box
+# (the remaining line settings default to the settings of their box)
+TERMYNAL_LINE_DEFAULTS = ['prompt', 'progressPercent']
+
+
+# initialises termynal boxes once they scroll into view (see the
+# `inject_termynal_init` function); the `{}` placeholder is replaced with
+# a `|`-separated list of box selectors
+TERMYNAL_LAZY_INIT = """
+    <script>
+      document.addEventListener('DOMContentLoaded', function () {{
+        var containers = '{}'.split('|');
+        if (!('IntersectionObserver' in window)) {{
+          containers.forEach(function (c) {{ new Termynal(c); }});
+          return;
+        }}
+        var observer = new IntersectionObserver(function (entries) {{
+          entries.forEach(function (entry) {{
+            if (entry.isIntersecting) {{
+              observer.unobserve(entry.target);
+              new Termynal(entry.target);
+            }}
+          }});
+        }});
+        containers.forEach(function (c) {{
+          var box = document.querySelector(c);
+          if (box) {{ observer.observe(box); }}
+        }});
+      }});
+    </script>
+"""
+
+# initialises termynal boxes whose lines are loaded from external JSON files
+# (see the `write_external_lines` function); the first `{}` placeholder is
+# replaced with a `|`-separated list of the box selectors initialised on page
+# load and the second one with a list of the box selectors initialised once
+# they scroll into view
+TERMYNAL_EXTERNAL_INIT = """
+    <script>
+      document.addEventListener('DOMContentLoaded', function () {{
+        var load = function (box) {{
+          var request = new XMLHttpRequest();
+          request.open('GET', box.getAttribute('data-ty-src'));
+          request.onload = function () {{
+            if (request.status && request.status !== 200) {{ return; }}
+            new Termynal(box, {{lineData: JSON.parse(request.responseText)}});
+          }};
+          request.send();
+        }};
+        var select = function (containers) {{
+          return containers.split('|').filter(function (c) {{ return c; }})
+            .map(function (c) {{ return document.querySelector(c); }})
+            .filter(function (box) {{ return box; }});
+        }};
+        select('{}').forEach(load);
+        var boxes = select('{}');
+        if (!('IntersectionObserver' in window)) {{
+          boxes.forEach(load);
+          return;
+        }}
+        var observer = new IntersectionObserver(function (entries) {{
+          entries.forEach(function (entry) {{
+            if (entry.isIntersecting) {{
+              observer.unobserve(entry.target);
+              load(entry.target);
+            }}
+          }});
+        }});
+        boxes.forEach(function (box) {{ observer.observe(box); }});
+      }});
+    </script>
+"""
 
 if sys.version_info >= (3, 0):
     unicode = str
 
+logger = logging.getLogger(__name__)
+
+# the termynal defaults of the current build -- overridden by the
+# `sphinx_term_termynal_defaults` config value (see `init_termynal_defaults`)
+_DEFAULTS = dict(TERMYNAL_DEFAULTS)
+
+
+#### termynal schema ##########################################################
+
+
+def is_optional(validator):
+    """Extends a (yaml) value validator to accept a missing value."""
+    return lambda value: value is None or validator(value)
+
+
+def is_optional_non_negative_integer(value):
+    """Checks whether a (yaml) value is a non-negative integer or missing."""
+    return value is None or (isinstance(value, int) and value >= 0)
+
+
+# the schema of the termynal directive options -- each option maps to
+# a `(validator, type description, attribute converter)` tuple, where
+# the converter is `None` for options not stored as `data-ty-*` attributes
+# (only the `TERMYNAL_ATTRS` options are emitted as HTML attributes)
+TERMYNAL_OPTION_SCHEMA = collections.OrderedDict([
+    ('prefix', (sphinx_term.is_string, 'string', str)),
+    ('startDelay', (sphinx_term.is_non_negative_integer,
+                    'non-negative integer', str)),
+    ('typeDelay', (sphinx_term.is_non_negative_integer,
+                   'non-negative integer', str)),
+    ('lineDelay', (sphinx_term.is_non_negative_integer,
+                   'non-negative integer', str)),
+    ('progressLength', (sphinx_term.is_positive_integer,
+                        'positive integer', str)),
+    ('progressChar', (sphinx_term.is_string, 'string', str)),
+    ('cursor', (sphinx_term.is_string, 'string', str)),
+    ('prompt', (sphinx_term.is_string, 'string', str)),
+    ('progressPercent', (sphinx_term.is_non_negative_integer,
+                         'non-negative integer', str)),
+    ('noInit', (sphinx_term.is_boolean, 'boolean', sphinx_term.to_boolean)),
+    ('lineData', (sphinx_term.is_string, 'string (Object[])', None)),
+    ('lazy', (sphinx_term.is_boolean, 'boolean', None)),
+    ('css', (sphinx_term.is_boolean, 'boolean', None)),
+    ('execute', (sphinx_term.is_boolean, 'boolean', None))
+])
+# the schema of the (yaml) termynal line keys -- each key maps to
+# a `(validator, error message)` tuple
+TERMYNAL_LINE_SCHEMA = collections.OrderedDict([
+    ('value', (is_optional(sphinx_term.is_string),
+               'Line value (*value* key for a line of termynal '
+               'directive) must be a string or not specified.')),
+    ('type', (lambda value: value in (None, '', 'input', 'progress'),
+              'Line type (*type* key for a line of '
+              'termynal directive) must be one of '
+              '*input*, *progress* or not specified.')),
+    ('prompt', (is_optional(sphinx_term.is_string),
+                'Prompt specifier (*prompt* key for a line '
+                'of termynal directive) must be a string.')),
+    ('progressPercent', (is_optional_non_negative_integer,
+                         'Prompt percentage (*progressPercent* key for a '
+                         'line of termynal directive) '
+                         'must be a non-negative integer.')),
+    ('progressChar', (is_optional(sphinx_term.is_string),
+                      'Progress cursor (*progressChar* key for a '
+                      'line of termynal directive) must be a string.')),
+    ('typeDelay', (is_optional_non_negative_integer,
+                   'Typing delay (*typeDelay* key for a line of '
+                   'termynal directive) must be a non-negative integer.')),
+    ('cursor', (is_optional(sphinx_term.is_string),
+                'Prompt cursor (*cursor* key for a line of '
+                'termynal directive) must be a string.'))
+])
+
+
+#### termynal defaults ########################################################
+
+
+def init_termynal_defaults(app):
+    """
+    Validates the project-level termynal defaults given by the
+    `sphinx_term_termynal_defaults` config value -- a dictionary mapping
+    termynal settings (see `TERMYNAL_DEFAULTS`) to their values -- and
+    merges them with the termynal defaults; invalid settings are reported
+    and ignored.
+    (Attached to the `builder-inited` Sphinx event.)
+
+    The defaults are kept in a module variable, which is inherited by
+    parallel writer processes.
+    """
+    global _DEFAULTS
+    _DEFAULTS = dict(TERMYNAL_DEFAULTS)
+
+    defaults = app.config.sphinx_term_termynal_defaults
+    if not defaults:
+        return
+    if not isinstance(defaults, dict):
+        logger.warning('[sphinx-term] the sphinx_term_termynal_defaults '
+                       'config value should be a dictionary; it is ignored')
+        return
+    for name, value in sorted(defaults.items()):
+        if name not in TERMYNAL_DEFAULTS:
+            logger.warning('[sphinx-term] unknown termynal setting (%s) '
+                           'given by the sphinx_term_termynal_defaults config '
+                           'value; it is ignored', name)
+            continue
+        # numbers may be given as integers or strings (like directive
+        # options)
+        if isinstance(value, int) and not isinstance(value, bool):
+            value = str(value)
+        validator, description, _ = TERMYNAL_OPTION_SCHEMA[name]
+        if not validator(value):
+            logger.warning('[sphinx-term] the %s termynal setting given by '
+                           'the sphinx_term_termynal_defaults config value '
+                           'should be a %s; it is ignored', name, description)
+            continue
+        if isinstance(TERMYNAL_DEFAULTS[name], int):
+            value = int(value)
+        # like the termynal script, zero (and empty) box settings fall back
+        # to the termynal defaults
+        if value or name in TERMYNAL_LINE_DEFAULTS:
+            _DEFAULTS[name] = value
+
+
+def get_box_setting(node, name):
+    """
+    Returns a setting of a termynal box or its (project-level) default --
+    like the termynal script, the default also replaces zero (and empty)
+    settings.
+    """
+    # (docutils lowercases the names of node attributes)
+    value = node.get('data-ty-{}'.format(name.lower()), None)
+    if value and isinstance(TERMYNAL_DEFAULTS[name], int):
+        value = int(value)
+    return value or _DEFAULTS[name]
+
+
+def get_line_default(node, name):
+    """
+    Returns the default of a line setting (see `TERMYNAL_LINE_DEFAULTS`) for
+    the lines of a termynal box -- given by the box option or the
+    project-level default.
+    """
+    value = node.get('data-ty-{}'.format(name.lower()), None)
+    if value is None:
+        return _DEFAULTS[name]
+    return int(value) if isinstance(TERMYNAL_DEFAULTS[name], int) else value
+
+
+def get_line_setting(node, name, default):
+    """
+    Returns a setting of a termynal line or the `default` if it is not set
+    (or empty) -- unlike box settings, zero line settings are honoured.
+    """
+    value = node.get(name.lower(), None)
+    return default if value is None or value == '' else value
+
+
+def get_line_defaults(node):
+    """
+    Returns the settings inherited by the lines of a termynal box -- a
+    dictionary mapping each line type to the `(key, attribute, default,
+    implicit)` tuples of the (lowercase) line keys that affect the lines of
+    this type, where `default` is the value of the setting for the lines that
+    do not set it and `implicit` is the value assumed by termynal when the
+    HTML attribute is omitted (either is `None` if there is no such value).
+
+    Line attributes are only emitted when their value differs from the
+    implicit one (see `get_line_attributes`).
+    """
+    type_delay = get_box_setting(node, 'typeDelay')
+    progress_char = get_box_setting(node, 'progressChar')
+    names = TERMYNAL_LINE_ATTR_NAMES
+
+    # line cursors are always emitted since they are displayed until the
+    # termynal script starts
+    cursor = ('cursor', names['cursor'], None, None)
+    prompt = ('prompt', names['prompt'], None, None)
+    return {
+        '': [cursor, prompt],
+        'input': [
+            cursor,
+            ('prompt', names['prompt'], get_line_default(node, 'prompt'),
+             TERMYNAL_DEFAULTS['prompt']),
+            ('typedelay', names['typedelay'], type_delay, type_delay)],
+        'progress': [
+            cursor,
+            ('progresschar', names['progresschar'], progress_char,
+             progress_char),
+            ('progresspercent', names['progresspercent'],
+             get_line_default(node, 'progressPercent'),
+             TERMYNAL_DEFAULTS['progressPercent']),
+            prompt]
+    }
+
 
 #### termynal directive #######################################################
 
 
+# a compact record of a termynal line held by a termynal box -- the length of
+# the line text and the line attributes as a tuple of `(key, value)` pairs
+TermynalLine = collections.namedtuple('TermynalLine', ['length', 'attributes'])
+
+
 class termynal_box(nodes.literal_block, nodes.Element):
-    """A `docutils` node holding termynal boxes."""
+    """
+    A `docutils` node holding termynal boxes.
 
+    The termynal lines are not stored as separate nodes (to keep the pickled
+    doctrees small) -- their text is joined with new lines into the text of
+    the box and their attributes are stored as a tuple of `TermynalLine`
+    records in the `lines` attribute of the box.
+    The lines are expanded into `termynal_line` nodes when the box is written.
+    """
 
-def visit_termynal_box_node(self, node):
-    """Builds an opening HTML tag for termynal boxes."""
+    def expand_lines(self):
+        """Expands the termynal line records into `termynal_line` nodes."""
+        text = self.astext()
+        start = 0
+        for length, attributes in self['lines']:
+            line_value = text[start:start + length]
+            start += length + 1
+            yield termynal_line(
+                line_value.strip(), line_value, **dict(attributes))
+
+
+def pack_termynal_lines(termynal_lines):
+    """
+    Packs an iterable of `(line_value, line_attributes)` tuples into the text
+    and a tuple of `TermynalLine` records of a termynal box.
+
+    The attribute keys (and string values) are interned, hence they are
+    pickled only once per doctree.
+    """
+    values, records = [], []
+    for line_value, line in termynal_lines:
+        values.append(line_value)
+        records.append(TermynalLine(len(line_value), tuple(
+            (sys.intern(key),
+             sys.intern(value) if isinstance(value, str) else value)
+            for key, value in line.items())))
+    return '\n'.join(values), tuple(records)
+
+
+def get_box_attributes(node):
+    """
+    Returns the `data-*` HTML attributes of a termynal box -- the settings
+    equal to their termynal defaults are omitted, and the ones left unset are
+    given their project-level defaults (see `get_box_setting`).
+    """
     attributes = {'data-termynal': ''}
 
-    for i in TERMYNAL_ATTRS:
-        attr = 'data-ty-{}'.format(i.lower())
-        attr_text = node.attributes.get(attr, None)
-        if attr_text is not None:
-            attributes[attr] = attr_text
+    for name, attr in TERMYNAL_ATTR_NAMES:
+        if name in TERMYNAL_DEFAULTS:
+            attr_text = get_box_setting(node, name)
+            if attr_text != TERMYNAL_DEFAULTS[name]:
+                attributes[attr] = attr_text
+        else:
+            attr_text = node.attributes.get(attr, None)
+            if attr_text is not None:
+                attributes[attr] = attr_text
+
+    return attributes
+
+
+def visit_termynal_box_node(self, node):
+    """
+    Builds an opening HTML tag for termynal boxes followed by their (expanded)
+    termynal lines.
+    """
+    attributes = get_box_attributes(node)
+
+    # the lines of boxes animated with CSS are always embedded in the page
+    if is_css_animated(self.builder.config, node.get('css', None)):
+        attributes['classes'] = ['sphinx-term-css']
+        self.body.append(self.starttag(node, 'div', **attributes))
+        line_defaults = get_line_defaults(node)
+        line_nodes = list(node.expand_lines())
+        for line_node, animation in zip(
+                line_nodes, schedule_termynal_lines(node, line_nodes)):
+            line_node['defaults'] = line_defaults
+            line_node['animation'] = animation
+            line_node.walkabout(self)
+        raise nodes.SkipChildren
+
+    if self.builder.config.sphinx_term_termynal_external:
+        attributes['data-ty-src'] = sphinx_term.assets.get_relative_uri(
+            self.builder, write_external_lines(self, node))
+        self.body.append(self.starttag(node, 'div', **attributes))
+        raise nodes.SkipChildren
 
     self.body.append(self.starttag(node, 'div', **attributes))
 
+    line_defaults = get_line_defaults(node)
+    for line_node in node.expand_lines():
+        line_node['defaults'] = line_defaults
+        line_node.walkabout(self)
+    # the text node of the box is already written by the expanded lines
+    raise nodes.SkipChildren
+
+
+def write_external_lines(self, node):
+    """
+    Saves the lines of a termynal box as a JSON list of termynal `lineData`
+    objects in the `_static` folder of the HTML build -- under a name derived
+    from its hash, therefore identical transcripts are saved (and downloaded)
+    only once.
+
+    The line objects hold the same (HTML-escaped) attributes and values as
+    the `<span data-ty>` tags of inline termynal lines.
+    Returns the (URI) path to the JSON file relative to the build root.
+    """
+    line_defaults = get_line_defaults(node)
+    lines = []
+    for line_node in node.expand_lines():
+        line = collections.OrderedDict()
+        for attr, attr_text in sorted(
+                get_line_attributes(line_node, line_defaults).items()):
+            key = 'type' if attr == 'data-ty' else attr[len('data-ty-'):]
+            line[key] = self.attval(str(attr_text))
+        line['value'] = get_line_markup(self, line_node)
+        lines.append(line)
+
+    data = json.dumps(lines, ensure_ascii=False, separators=(',', ':'))
+    return sphinx_term.assets.write_static_data(
+        self.builder, EXTERNAL_DATA_DIR, data)
+
 
 def depart_termynal_box_node(self, node):
     """Builds a closing HTML tag for termynal boxes."""
     self.body.append('\n</div>\n')
 
 
-def visit_termynal_box_node_(self, node):
-    """Builds a prefix for embedding termynal boxes in LaTeX and raw text."""
-    raise NotImplemented
+class termynal_line(nodes.literal_block, nodes.Element):
+    """
+    A `docutils` node holding termynal lines (only created when termynal
+    boxes are written -- see `termynal_box.expand_lines`).
+    """
 
 
-def depart_termynal_box_node_(self, node):
-    """Builds a postfix for embedding termynal boxes in LaTeX and raw text. """
-    raise NotImplemented
+def get_line_attributes(node, line_defaults):
+    """
+    Returns the `data-ty` HTML attributes of a termynal line -- only the
+    settings that differ from the values inherited from its box (see
+    `get_line_defaults`) are included.
+    """
+    line_type = node.attributes.get('type', '')
+    attributes = {'data-ty': line_type}
+
+    for key, attr, default, implicit in line_defaults.get(line_type, ()):
+        attr_text = node.attributes.get(key, None)
+        if attr_text is None:
+            attr_text = default
+        if attr_text is not None and attr_text != implicit:
+            attributes[attr] = attr_text
 
+    return attributes
 
-class termynal_line(nodes.literal_block, nodes.Element):
-    """A `docutils` node holding termynal lines."""
 
+def get_line_tag(self, attributes):
+    """
+    Returns the opening `<span>` HTML tag of a termynal line -- its (sorted)
+    attributes are written directly rather than with the generic `starttag`
+    method of the HTML translator, and empty attributes (e.g., the `data-ty`
+    attribute of output lines) are written without a value.
+    """
+    tag = ['<span']
+    for attr, attr_text in sorted(attributes.items()):
+        if attr_text == '':
+            tag.append(' {}'.format(attr))
+        else:
+            tag.append(' {}="{}"'.format(attr, self.attval(str(attr_text))))
+    tag.append('>')
+    return ''.join(tag)
 
-def visit_termynal_line_node(self, node):
-    """Builds an opening HTML tag for termynal lines."""
-    attributes = {'data-ty': node.attributes.get('type', '')}
 
-    for i in TERMYNAL_LINE_ATTRS:
-        i_low = i.lower()
-        attr = 'data-ty-{}'.format(i_low)
-        attr_text = node.attributes.get(i_low, None)
-        if attr_text is not None:
-            attributes[attr] = attr_text
+def is_highlighted(node):
+    """
+    Checks whether a termynal line is highlighted -- only input lines are
+    highlighted when enabled (see `sphinx_term.highlight`).
+    """
+    return (node.get('type', '') == 'input'
+            and sphinx_term.highlight.is_enabled())
+
 
-    self.body.append(self.starttag(node, 'span', suffix='', **attributes))
+def get_line_markup(self, node):
+    """Returns the HTML markup of the text of a termynal line."""
+    if is_highlighted(node):
+        return sphinx_term.highlight.highlight_command(node.astext())
+    return self.encode(node.astext())
+
+
+def visit_termynal_line_node(self, node):
+    """Builds an opening HTML tag for termynal lines."""
+    attributes = get_line_attributes(node, node['defaults'])
+    animation = node.get('animation', None)
+    if animation is not None:
+        # the termynal script displays its cursor after every input line
+        if node.get('type', '') == 'input':
+            attributes['data-ty-cursor'] = animation['cursor']
+        attributes['style'] = get_animation_style(
+            animation, 'data-ty-cursor' in attributes)
+    self.body.append(get_line_tag(self, attributes))
+    # the text of input and progress lines animated with CSS is wrapped in
+    # animated spans
+    if animation is not None and ('chars' in animation
+                                  or 'labels' in animation):
+        self.body.append(get_animated_line_markup(self, node))
+        raise nodes.SkipChildren
+    # the text of highlighted input lines is replaced by its markup
+    if is_highlighted(node):
+        self.body.append(get_line_markup(self, node))
+        raise nodes.SkipChildren
 
 
 def depart_termynal_line_node(self, node):
@@ -108,14 +573,133 @@ def depart_termynal_line_node(self, node):
     self.body.append('</span>\n')
 
 
-def visit_termynal_line_node_(self, node):
-    """Builds a prefix for embedding termynal lines in LaTeX and raw text."""
-    raise NotImplemented
+def get_animation_style(animation, cursor):
+    """
+    Returns the `style` HTML attribute of a termynal line animated with CSS
+    (see `schedule_termynal_lines`) -- its schedule is given by the `--ty-*`
+    custom properties used by the `sphinx-term/termynal-css.css` style sheet.
+    The end of the line is only given for lines with a `cursor`.
+    """
+    properties = [('start', animation['start'])]
+    if cursor:
+        properties.append(('end', animation['end']))
+    if 'chars' in animation:
+        properties += [('chars', animation['chars']),
+                       ('steps', max(animation['chars'], 1)),
+                       ('duration', animation['duration'])]
+    elif 'labels' in animation:
+        labels = len(animation['labels'])
+        properties += [('first', animation['first']),
+                       ('chars', labels),
+                       ('steps', max(labels - 1, 1)),
+                       ('duration', animation['duration']),
+                       ('labels', labels)]
+    return ';'.join(
+        '--ty-{}:{}{}'.format(
+            name, value, '' if name in ('chars', 'steps', 'labels') else 'ms')
+        for name, value in properties)
+
+
+def get_animated_line_markup(self, node):
+    """
+    Returns the HTML markup of the text of a termynal line animated with CSS
+    -- the typed text of input lines and the progress bar (followed by
+    a column of its percentage labels, one per text line) of progress lines
+    are wrapped in spans animated by the `sphinx-term/termynal-css.css`
+    style sheet.
+    """
+    animation = node['animation']
+    if 'chars' in animation:
+        return '<span class="sphinx-term-typed">{}</span>'.format(
+            get_line_markup(self, node))
+    labels = animation['labels']
+    return ('<span class="sphinx-term-progress">'
+            '<span class="sphinx-term-bar">{}</span> '
+            '<span class="sphinx-term-percent"><span>{}</span>'
+            '<span class="sphinx-term-labels">{}</span></span>'
+            '</span>'.format(
+                self.encode(animation['bar']), labels[-1],
+                '\n'.join(labels)))
+
+
+#### termynal CSS animation ##################################################
+
+
+def is_css_animated(config, css):
+    """
+    Checks whether a termynal box is animated with CSS -- `css` is the value
+    of its `css` option (`None` if unset), which overrides the
+    `sphinx_term_termynal_css` config value.
+    """
+    if css is None:
+        css = config.sphinx_term_termynal_css
+    return bool(css)
 
 
-def depart_termynal_line_node_(self, node):
-    """Builds a postfix for embedding termynal lines in LaTeX and raw text. """
-    raise NotImplemented
+def get_progress_labels(length, percent):
+    """
+    Returns the percentage labels displayed at each step of a progress bar
+    of `length` characters, which stops once it exceeds `percent`.
+    """
+    labels = []
+    for i in range(1, length + 1):
+        # round halves up like `Math.round` in JavaScript
+        label = int(math.floor(i / length * 100 + 0.5))
+        labels.append('{}%'.format(label))
+        if label > percent:
+            break
+    return labels
+
+
+def schedule_termynal_lines(node, line_nodes):
+    """
+    Computes the animation schedule of the (expanded) lines of a termynal box
+    -- all times are given in milliseconds from the page load.
+
+    The schedule mirrors the termynal script, which waits `startDelay` before
+    displaying the first line, types input lines one character every
+    `typeDelay`, fills progress bars one step every `typeDelay` (of the box)
+    until they exceed `progressPercent`, and waits `lineDelay` after every
+    line.
+    Returns a list of dictionaries -- one for each line -- holding the `start`
+    and `end` times of the line (the cursor is displayed in between); input
+    lines also hold their `cursor`, number of typed characters (`chars`) and
+    typing time (`duration`), and progress lines the time of their first
+    step (`first`), their `bar` text, their step `labels` and the time
+    between the first and the last step (`duration`).
+    """
+    type_delay = get_box_setting(node, 'typeDelay')
+    line_delay = get_box_setting(node, 'lineDelay')
+    progress_char = get_box_setting(node, 'progressChar')
+    progress_length = get_box_setting(node, 'progressLength')
+
+    schedule = []
+    time = get_box_setting(node, 'startDelay')
+    for line_node in line_nodes:
+        animation = {'start': time}
+        line_type = line_node.get('type', '')
+        if line_type == 'input':
+            chars = len(line_node.astext())
+            duration = chars * get_line_setting(
+                line_node, 'typeDelay', type_delay)
+            animation.update(cursor=get_box_setting(node, 'cursor'),
+                             chars=chars, duration=duration)
+            time += duration
+        elif line_type == 'progress':
+            bar = progress_length * get_line_setting(
+                line_node, 'progressChar', progress_char)
+            labels = get_progress_labels(
+                len(bar), get_line_setting(
+                    line_node, 'progressPercent',
+                    get_line_default(node, 'progressPercent')))
+            animation.update(first=time + type_delay, bar=bar[:len(labels)],
+                             labels=labels,
+                             duration=(len(labels) - 1) * type_delay)
+            time += len(labels) * type_delay
+        time += line_delay
+        animation['end'] = time
+        schedule.append(animation)
+    return schedule
 
 
 class Termynal(Directive):
@@ -127,9 +711,10 @@ class Termynal(Directive):
 
     If loaded from an external file, the box id needs to be a terminal
     transcript file name **with** the `termynal:` prefix and **without**
-    the `.yml` extension, located in a single directory.
-    The directory is given to Sphinx via the `sphinx_term_termynal_dir`
-    config setting.
+    the `.yml` extension, located in a search directory.
+    The directory -- or an ordered list of search directories, whose
+    subdirectories are searched as well (see `sphinx_term.TranscriptIndex`)
+    -- is given to Sphinx via the `sphinx_term_termynal_dir` config setting.
     If this parameter is not set, terminal box content must be provided
     explicitly.
 
@@ -158,6 +743,18 @@ class Termynal(Directive):
     lineData
       Dynamically load termynal lines at instantiation. `null` by default.
 
+    The unset parameters fall back to the project-level defaults given by the
+    `sphinx_term_termynal_defaults` config setting (if any).
+    The `prompt` and `progressPercent` parameters set the defaults of the
+    corresponding line settings for all the lines of the box.
+
+    Additionally, the `lazy` parameter (`true` or `false`) overrides the
+    `sphinx_term_termynal_lazy` config setting for this box; lazy boxes are
+    only initialised when they scroll into view.
+    Similarly, the `css` parameter (`true` or `false`) overrides the
+    `sphinx_term_termynal_css` config setting for this box; such boxes are
+    animated with CSS alone, according to a schedule computed at build time.
+
     The content of the directive is a **yml-formatted** terminal transcript
     given as a *list of dictionaries*, with each list entry describing a
     single termynal line.
@@ -173,6 +770,11 @@ class Termynal(Directive):
     For more information about customising termynal lines please refer to
     `termynal HTML line configuration`_.
 
+    When the `execute` parameter is set (to `true` or left empty), the content
+    of the directive is instead a list of shell commands (one per line),
+    which are run at build time (see `sphinx_term.execute`) -- each command
+    is displayed as an input line followed by its output lines.
+
     This Sphinx extension monitors the terminal transcript files for changes
     and regenerates the content pages that use them if a change is detected.
 
@@ -183,18 +785,20 @@ class Termynal(Directive):
     optional_arguments = 0
     final_argument_whitespace = False
     has_content = True
-    option_spec = {i: directives.unchanged for i in TERMYNAL_ATTRS}
+    option_spec = {i: directives.unchanged for i in TERMYNAL_OPTION_SCHEMA}
 
+    @sphinx_term.instrument_directive(
+        'termynal', lambda result: len(result[0]['lines']))
     def run(self):
         """Builds a termynal box."""
         env = self.state.document.settings.env
         options = self.options
         data_ty = 'data-ty-{}'
-        data_ty_error = 'The *{}* parameter should be a {}.'
 
         # retrieve the path to the directory holding the code files
         st_term_dir = env.config.sphinx_term_termynal_dir
-        assert isinstance(st_term_dir, str) or st_term_dir is None
+        assert (isinstance(st_term_dir, (str, list, tuple))
+                or st_term_dir is None)
 
         # get the terminal file name for this particular termynal box
         assert len(self.arguments) == 1, (
@@ -207,406 +811,477 @@ class Termynal(Directive):
         assert not term_filename_id.endswith('.yml'), (
             'The terminal box label ({}) must not end with the ".yml" '
             'extension prefix.'.format(term_filename_id))
-        # add the .yml extension as it is missing
-        term_filename = '{}.yml'.format(term_filename_id[9:])
 
-        # collect termynal attributes
+        # validate and collect termynal attributes
+        with sphinx_term.measure('option_validation'):
+            errors = validate_termynal_options(options)
+        if errors:
+            raise ValueError(errors[0])
         attributes = {}
-
-        # prefix
-        attr = 'prefix'
-        attr_text = options.get(attr, None)
-        if attr_text is not None:
-            # validate
-            if not isinstance(attr_text, str):
-                raise ValueError(data_ty_error.format(attr, 'string'))
-            # memorise
-            attributes[data_ty.format(attr)] = attr_text
-        # startDelay
-        attr = 'startDelay'
-        attr_text = options.get(attr, None)
-        if attr_text is not None:
-            # validate
-            if not isinstance(attr_text, str) or not attr_text.isdigit():
-                raise ValueError(data_ty_error.format(
-                    attr, 'non-negative integer'))
-            # memorise
-            attributes[data_ty.format(attr)] = attr_text
-        # typeDelay
-        attr = 'typeDelay'
-        attr_text = options.get(attr, None)
-        if attr_text is not None:
-            # validate
-            if not isinstance(attr_text, str) or not attr_text.isdigit():
-                raise ValueError(data_ty_error.format(
-                    attr, 'non-negative integer'))
-            # memorise
-            attributes[data_ty.format(attr)] = attr_text
-        # lineDelay
-        attr = 'lineDelay'
-        attr_text = options.get(attr, None)
-        if attr_text is not None:
-            # validate
-            if not isinstance(attr_text, str) or not attr_text.isdigit():
-                raise ValueError(data_ty_error.format(
-                    attr, 'non-negative integer'))
-            # memorise
-            attributes[data_ty.format(attr)] = attr_text
-        # progressLength
-        attr = 'progressLength'
-        attr_text = options.get(attr, None)
-        if attr_text is not None:
-            # validate
-            if (not isinstance(attr_text, str) or not attr_text.isdigit()
-                    or int(attr_text) < 1):
-                raise ValueError(data_ty_error.format(
-                    attr, 'positive integer'))
-            # memorise
-            attributes[data_ty.format(attr)] = attr_text
-        # progressChar
-        attr = 'progressChar'
-        attr_text = options.get(attr, None)
-        if attr_text is not None:
-            # validate
-            if not isinstance(attr_text, str):
-                raise ValueError(data_ty_error.format(attr, 'string'))
-            # memorise
-            attributes[data_ty.format(attr)] = attr_text
-        # cursor
-        attr = 'cursor'
-        attr_text = options.get(attr, None)
-        if attr_text is not None:
-            # validate
-            if not isinstance(attr_text, str):
-                raise ValueError(data_ty_error.format(attr, 'string'))
-            # memorise
-            attributes[data_ty.format(attr)] = attr_text
-        # noInit
-        attr = 'noInit'
-        attr_text = options.get(attr, None)
-        if attr_text is not None:
-            # validate
-            if (not isinstance(attr_text, str)
-                    or attr_text.lower() not in ['true', 'false', '']):
-                raise ValueError(data_ty_error.format(attr, 'boolean'))
-            # memorise
-            val = 'false' if attr_text.lower() == 'false' else 'true'
-            attributes[data_ty.format(attr)] = val
-        # lineData
-        attr = 'lineData'
-        attr_text = options.get(attr, None)
-        if attr_text is not None:
-            # validate
-            if not isinstance(attr_text, str):
-                raise ValueError(data_ty_error.format(
-                    attr, 'string (Object[])'))
-            # memorise
-            attributes[data_ty.format(attr)] = attr_text
-
-        # if the content is given explicitly, use it instead of loading a file
-        if self.content:
+        for attr, (_, _, convert) in TERMYNAL_OPTION_SCHEMA.items():
+            attr_text = options.get(attr, None)
+            if attr_text is not None and convert is not None:
+                attributes[data_ty.format(attr)] = convert(attr_text)
+
+        # lazy initialisation and CSS animation
+        lazy = options.get('lazy', None)
+        if lazy is not None:
+            lazy = sphinx_term.to_boolean(lazy) == 'true'
+        css = options.get('css', None)
+        if css is not None:
+            css = sphinx_term.to_boolean(css) == 'true'
+
+        # if the content is given explicitly, use it instead of loading a
+        # file -- executed boxes run the commands given as their content
+        if sphinx_term.execute.is_executed(options):
+            text, lines = pack_termynal_lines(get_executed_termynal_lines(
+                sphinx_term.execute.execute_transcript(
+                    env, sphinx_term.execute.get_commands(self.content),
+                    location=(env.docname, self.lineno))))
+        elif self.content:
             contents = '\n'.join(self.content)
+            text, lines = sphinx_term.parse_transcript(
+                env, 'termynal', contents, parse_termynal_lines)
         else:
-            localised_directory = sphinx_term.localise_term_directory(
-                env.srcdir,
-                st_term_dir,
-                ('sphinx_term_termynal_dir', 'termynal box content'))
-            # compose the full path to the code file and ensure it exists
-            path_localised = os.path.join(localised_directory, term_filename)
-            # path_original = os.path.join(st_term_dir, term_filename)
-            sphinx_term.file_exists(path_localised)
-
-            # memorise the association between the document (a content source
-            # file) and the terminal box -- this is used for watching for
-            # terminal file updates
-            env.note_dependency(path_localised)
-
-            # read in the terminal file
-            with open(path_localised, 'r') as f:
-                contents = f.read().strip('\n')
-
-        # read the yaml content
-        try:
-            contents_yaml = yaml.safe_load(contents)  # or {}
-        except (yaml.parser.ParserError, yaml.scanner.ScannerError) as e:
-            raise ValueError('Invalid termynal content YAML format: ', str(e))
-
-        # create a termynal node
-        box = termynal_box(label=term_filename_id, **attributes)
+            # find the code file in the transcript index
+            path_localised = get_transcript_path(
+                env, term_filename_id, location=(env.docname, self.lineno))
+
+            # read in (and parse) the terminal file, memorising the
+            # association between the document (a content source file) and
+            # the terminal box -- this is used for watching for terminal file
+            # updates
+            text, lines = sphinx_term.load_transcript(
+                env, 'termynal', path_localised, parse_termynal_lines)
+
+        # create a termynal node holding the packed termynal lines; its raw
+        # source is set to the label since Sphinx copies the text of literal
+        # blocks with an empty raw source into it (storing it twice)
+        box = termynal_box(term_filename_id, text, label=term_filename_id,
+                           lines=lines, **attributes)
+        if lazy is not None:
+            box['lazy'] = lazy
+        if css is not None:
+            box['css'] = css
         # assign label and id (`ids=[nodes.make_id(term_filename_id)]`)
-        self.options['name'] = term_filename_id
-        self.add_name(box)
-
-        # validate, process and embed each termynal line
-        for line in contents_yaml:
-            if line is None:
-                line = {}
-                line_value = ''
-            elif isinstance(line, str):
-                line_value = line
-                line = {}
-            elif isinstance(line, dict):
-                # validate
-                validate_termynal_line(line)
-
-                # process
-                if line.get('type', None) is None:
-                    line['type'] = ''
-
-                if 'value' in line:
-                    line_value = line.get('value', '')
-                    del line['value']
-                else:
-                    line_value = ''
-            else:
-                assert False, 'Unknown termynal line type.'
-
-            # embed
-            line_node = termynal_line(line_value.strip(), line_value, **line)
-            box += line_node
+        sphinx_term.add_box_name(self, box, term_filename_id)
 
         return [box]
 
 
-def validate_termynal_line(line):
-    """Validates a yaml termynal line (dictionary within the contents list)."""
-    bad = set(line.keys()).difference(TERMYNAL_LINE_ATTRS + ['type', 'value'])
-    if bad:
-        raise ValueError('The following termynal line keys are '
-                         'invalid: {}.'.format(bad))
-
-    # value
-    line_value = line.get('value', None)
-    if line_value is not None and not isinstance(line_value, str):
-        raise ValueError('Line value (*value* key for a line of termynal '
-                         'directive) must be a string or not specified.'
-                         '\n\n{}'.format(line_value))
-    # type
-    line_type = line.get('type', None)
-    if line_type not in (None, '', 'input', 'progress'):
-        raise ValueError('Line type (*type* key for a line of '
-                         'termynal directive) must be one of '
-                         '*input*, *progress* or not specified.'
-                         '\n\n{}'.format(line_type))
-    # prompt
-    line_prompt = line.get('prompt', None)
-    if line_prompt is not None:
-        if not isinstance(line_prompt, str):
-            raise ValueError('Prompt specifier (*prompt* key for a line '
-                             'of termynal directive) must be a string.'
-                             '\n\n{}'.format(line_prompt))
-    # progressPercent
-    line_progress = line.get('progressPercent', None)
-    if line_progress is not None:
-        if not isinstance(line_progress, int) or line_progress < 0:
-            raise ValueError(
-                'Prompt percentage (*progressPercent* key for a '
-                'line of termynal directive) '
-                'must be a non-negative integer.'
-                '\n\n{}'.format(line_progress))
-    # progressChar
-    line_progresschar = line.get('progressChar', None)
-    if line_progresschar is not None:
-        if not isinstance(line_progresschar, str):
-            raise ValueError('Progress cursor (*progressChar* key for a '
-                             'line of termynal directive) must be a string.'
-                             '\n\n{}'.format(line_progresschar))
-    # typeDelay
-    line_typedelay = line.get('typeDelay', None)
-    if line_typedelay is not None:
-        if (not isinstance(line_typedelay, int)
-                or line_typedelay < 0):
-            raise ValueError(
-                'Typing delay (*typeDelay* key for a line of '
-                'termynal directive) must be a non-negative integer.'
-                '\n\n{}'.format(line_typedelay))
-    # cursor
-    line_cursor = line.get('cursor', None)
-    if line_cursor is not None:
-        if not isinstance(line_cursor, str):
-            raise ValueError('Prompt cursor (*cursor* key for a line of '
-                             'termynal directive) must be a string.'
-                             '\n\n{}'.format(line_cursor))
-
-
-def validate_termynal_lines(app, doctree, docname):
-    """
-    Ensures that all termynal_line nodes are within a termynal_box node.
+def get_transcript_path(env, term_filename_id, location=None):
+    """
+    Returns the path to the transcript file of a termynal box -- the box id
+    without the `termynal:` prefix and with the `.yml` extension, found in
+    the `sphinx_term_termynal_dir` search directories (see
+    `sphinx_term.find_transcript`).
+    """
+    return sphinx_term.find_transcript(
+        env, 'termynal', '.yml', term_filename_id[9:], location=location)
 
-    This function is hooked up to the `doctree-resolved` Sphinx event.
+
+def get_transcript_parser(env, contents):
     """
-    # only go through non-empty documents
-    if doctree is None:
-        return
-    # get termynal lines
-    termynal_lines = doctree.traverse(termynal_line)
-    # skip pages without at least one termynal line
-    if not termynal_lines:
-        return
+    Returns the function parsing the content of a termynal transcript file
+    when its box is built (see `Termynal.run`).
+    """
+    return parse_termynal_lines
 
-    for line in termynal_lines:
-        if not isinstance(line.parent, termynal_box):
-            raise Exception('Each termynal line must be embedded '
-                            'within a termynal box.')
 
+def get_executed_termynal_lines(results):
+    """
+    Converts the `(command, output)` tuples of an executed termynal box into
+    `(line_value, line_attributes)` tuples -- an input line for each command
+    followed by its output lines -- yielded one at a time.
+    """
+    for command, output in results:
+        yield command, {'type': 'input'}
+        if output:
+            for line in output.split('\n'):
+                yield line, {}
 
-def inject_termynal_init(app, doctree, docname):
+
+def get_yaml_loader():
     """
-    Injects call to the termynal JavaScript library in documents that have
-    termynal boxes.
+    Returns the YAML loader used for parsing termynal transcripts -- the fast,
+    libyaml-based loader when available.
 
-    This function is hooked up to the `doctree-resolved` Sphinx event.
+    (The `yaml` module is imported on demand since it noticeably slows down
+    the start of Sphinx builds that do not parse any termynal transcripts.)
     """
-    # only go through non-empty documents
-    if doctree is None:
-        return
-    # get termynal boxes
-    termynal_boxes = doctree.traverse(termynal_box)
-    # skip pages without at least one termynal box
-    if not termynal_boxes:
-        return
+    import yaml
+    return getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
 
-    # get termynal box ids
-    termynal_ids = []
-    for box in termynal_boxes:
-        ids = box.attributes['ids']
-        ids = [i for i in ids if i.startswith('termynal-')]
-        assert len(ids) == 1, 'Only one id is expected'
-        termynal_ids.append('#{}'.format(ids[0]))
-    assert termynal_ids, 'With termynal boxes available, ids cannot be empty'
 
-    rel_root = os.path.relpath('.', os.path.dirname(docname))  # app.outdir
-    rel_termynal = os.path.join(rel_root, '_static', 'termynal.js')
+def parse_termynal_lines(contents):
+    """
+    Parses and validates a yml-formatted termynal transcript.
 
-    termynal_function = ('\n\n'
-                         '    <script src="{}" '
-                         'data-termynal-container="{}">'
-                         '</script>\n'.format(rel_termynal,
-                                              '|'.join(termynal_ids)))
-    # `format='html'` is crucial to avoid escaping html characters
-    script_node = nodes.raw(
-        termynal_function, termynal_function, format='html')
-    # add the call node to the document
-    doctree.append(script_node)
+    Returns the packed text and line records of a termynal box (see
+    `pack_termynal_lines`); the termynal lines are packed as they are parsed,
+    hence they are never held in memory all at once.
+    """
+    return pack_termynal_lines(iter_termynal_lines(contents))
 
 
-def assign_reference_title(app, document):
+def iter_termynal_lines(contents):
     """
-    Update the labels record of the standard environment to allow referencing
-    termynal boxes.
+    Parses and validates a yml-formatted termynal transcript one termynal
+    line at a time.
+
+    The transcript is processed as a stream of YAML parsing events (produced
+    by the libyaml-based parser when available), hence only the list element
+    that is currently being processed is composed in memory.
+    Yields a `(line_value, line_attributes)` tuple for each termynal line.
     """
-    # get the standard domain
-    domain = app.env.get_domain('std')
+    import yaml
+    events = yaml.parse(contents, Loader=get_yaml_loader())
+    constructor = yaml.constructor.SafeConstructor()
+    try:
+        for line_node in compose_yaml_list(events):
+            line = constructor.construct_document(line_node)
+            yield process_termynal_line(line)
+    except yaml.YAMLError as e:
+        raise ValueError('Invalid termynal content YAML format: ', str(e))
+
+
+def process_termynal_line(line):
+    """
+    Validates and processes a single yaml termynal line (element of the
+    contents list) into a `(line_value, line_attributes)` tuple.
+    """
+    if line is None:
+        line = {}
+        line_value = ''
+    elif isinstance(line, str):
+        line_value = line
+        line = {}
+    elif isinstance(line, dict):
+        # validate
+        with sphinx_term.measure('line_validation'):
+            validate_termynal_line(line)
+
+        # process
+        if line.get('type', None) is None:
+            line['type'] = ''
+
+        if 'value' in line:
+            line_value = line.get('value', '')
+            del line['value']
+        else:
+            line_value = ''
+    else:
+        assert False, 'Unknown termynal line type.'
 
-    # go through every termynal box
-    for node in document.traverse(termynal_box):
-        # every termynal box must have exactly one name starting with
-        # 'termynal:'
-        assert node['names']
-        assert len(node['names']) == 1
-        node_name = node['names'][0]
+    return line_value, line
 
-        assert node_name.startswith('termynal:'), (
-            'termynal box ids must start with termynal:')
-        refname = REFNAME
 
-        # every termynal box has a single id
-        assert len(node['ids']) == 1
-        node_id = node['ids'][0]
+def compose_yaml_list(events):
+    """
+    Composes the elements of a YAML document holding a single list from
+    a stream of YAML parsing events, yielding one element node at a time.
+    """
+    import yaml
+    resolver = yaml.resolver.Resolver()
+    anchors = {}
+
+    # skip the beginning of the stream and document
+    event = next(events)
+    assert isinstance(event, yaml.StreamStartEvent)
+    event = next(events)
+    if not isinstance(event, yaml.DocumentStartEvent):
+        raise ValueError('The termynal content must be a yml-formatted list.')
+    event = next(events)
+    if not isinstance(event, yaml.SequenceStartEvent):
+        raise ValueError('The termynal content must be a yml-formatted list.')
+
+    # compose each list element
+    event = next(events)
+    while not isinstance(event, yaml.SequenceEndEvent):
+        yield compose_yaml_node(event, events, resolver, anchors)
+        event = next(events)
+
+    # ensure that the stream holds a single document
+    event = next(events)
+    assert isinstance(event, yaml.DocumentEndEvent)
+    event = next(events)
+    if not isinstance(event, yaml.StreamEndEvent):
+        raise yaml.composer.ComposerError(
+            'expected a single document in the stream', None,
+            'but found another document', event.start_mark)
+
+
+def compose_yaml_node(event, events, resolver, anchors):
+    """
+    Composes a YAML node starting with the `event` from a stream of YAML
+    parsing events (mirroring the `yaml.composer.Composer` class).
+    """
+    import yaml
+    if isinstance(event, yaml.AliasEvent):
+        if event.anchor not in anchors:
+            raise yaml.composer.ComposerError(
+                None, None, 'found undefined alias {}'.format(event.anchor),
+                event.start_mark)
+        return anchors[event.anchor]
+
+    if isinstance(event, yaml.ScalarEvent):
+        tag = event.tag
+        if tag is None or tag == '!':
+            tag = resolver.resolve(
+                yaml.ScalarNode, event.value, event.implicit)
+        node = yaml.ScalarNode(tag, event.value, event.start_mark,
+                               event.end_mark, style=event.style)
+        if event.anchor is not None:
+            anchors[event.anchor] = node
+    elif isinstance(event, yaml.SequenceStartEvent):
+        tag = event.tag
+        if tag is None or tag == '!':
+            tag = resolver.resolve(yaml.SequenceNode, None, event.implicit)
+        node = yaml.SequenceNode(tag, [], event.start_mark, None,
+                                 flow_style=event.flow_style)
+        if event.anchor is not None:
+            anchors[event.anchor] = node
+        item_event = next(events)
+        while not isinstance(item_event, yaml.SequenceEndEvent):
+            node.value.append(
+                compose_yaml_node(item_event, events, resolver, anchors))
+            item_event = next(events)
+        node.end_mark = item_event.end_mark
+    elif isinstance(event, yaml.MappingStartEvent):
+        tag = event.tag
+        if tag is None or tag == '!':
+            tag = resolver.resolve(yaml.MappingNode, None, event.implicit)
+        node = yaml.MappingNode(tag, [], event.start_mark, None,
+                                flow_style=event.flow_style)
+        if event.anchor is not None:
+            anchors[event.anchor] = node
+        key_event = next(events)
+        while not isinstance(key_event, yaml.MappingEndEvent):
+            key = compose_yaml_node(key_event, events, resolver, anchors)
+            value = compose_yaml_node(
+                next(events), events, resolver, anchors)
+            node.value.append((key, value))
+            key_event = next(events)
+        node.end_mark = key_event.end_mark
+    else:
+        assert False, 'Unexpected YAML event: {}.'.format(event)
+
+    return node
+
+
+def validate_termynal_options(options):
+    """
+    Validates the options of a termynal directive against the termynal
+    option schema.
+
+    Returns a list of error messages (empty for valid options).
+    """
+    return sphinx_term.validate_options(
+        options, TERMYNAL_OPTION_SCHEMA, 'termynal')
+
 
-        # get the document name
-        docname = app.env.docname
+def get_termynal_line_errors(line):
+    """
+    Validates a yaml termynal line (element of the contents list) against
+    the termynal line schema.
 
-        # every termynal box should *already* be referenceable without a title
-        assert node_name in domain.anonlabels
-        assert domain.anonlabels[node_name] == (docname, node_id)
+    Returns a list of error messages (empty for a valid line).
+    """
+    if line is None or isinstance(line, str):
+        return []
+    if not isinstance(line, dict):
+        return ['Unknown termynal line type.']
 
-        # allow this termynal box to be referenced with the default
-        # 'terminal box' stub (REFNAME)
-        domain.labels[node_name] = (docname, node_id, refname)
+    errors = []
+    bad = set(line.keys()).difference(TERMYNAL_LINE_SCHEMA)
+    if bad:
+        errors.append('The following termynal line keys are '
+                      'invalid: {}.'.format(bad))
+    for key, (validator, message) in TERMYNAL_LINE_SCHEMA.items():
+        value = line.get(key, None)
+        if not validator(value):
+            errors.append('{}\n\n{}'.format(message, value))
+    return errors
 
 
-#### Extension setup ##########################################################
+def validate_termynal_line(line):
+    """Validates a yaml termynal line (dictionary within the contents list)."""
+    errors = get_termynal_line_errors(line)
+    if errors:
+        raise ValueError(errors[0])
 
 
-def include_static_files(app):
+def index_box(app, node):
     """
-    Copies the static files required by this extension.
-    (Attached to the `builder-inited` Sphinx event.)
+    Validates the label of a termynal box and records it in the environment
+    to allow referencing the box.
+    (Called by `sphinx_term.index_document` for every termynal box.)
+
+    The labels record of the standard domain is not modified directly since
+    it would not survive parallel builds; the labels are instead kept in the
+    environment and registered by `sphinx_term.register_term_labels`.
+    Returns a `(node_id, lazy, css)` tuple, where `lazy` and `css` are the
+    values of the `lazy` and `css` options of the termynal box (`None` if
+    unset).
     """
-    for file_name in STATIC_FILES:
-        file_path = sphinx_term.get_static_path(file_name)
-        if file_path not in app.config.html_static_path:
-            app.config.html_static_path.append(file_path)
+    # every termynal box must have exactly one name starting with
+    # 'termynal:'
+    assert node['names']
+    assert len(node['names']) == 1
+    node_name = node['names'][0]
+
+    assert node_name.startswith('termynal:'), (
+        'termynal box ids must start with termynal:')
+    refname = REFNAME
+
+    # every termynal box has a single id
+    assert len(node['ids']) == 1
+    node_id = node['ids'][0]
+    assert node_id.startswith('termynal-'), (
+        'termynal box html ids must start with termynal-')
+
+    # get the document name
+    docname = app.env.docname
+
+    # every termynal box should *already* be referenceable without a title
+    domain = app.env.get_domain('std')
+    assert node_name in domain.anonlabels
+    assert domain.anonlabels[node_name] == (docname, node_id)
 
+    # allow this termynal box to be referenced with the default
+    # 'terminal box' stub (REFNAME)
+    sphinx_term.add_term_label(
+        app.env, node_name, docname, node_id, refname)
 
-def load_static_files(app, pagename, templatename, context, doctree):
-    """Includes termynal static files only on pages that use the module."""
-    # only go through non-empty documents
-    if doctree is None:
-        return
+    return node_id, node.get('lazy', None), node.get('css', None)
 
-    # get termynal boxes
-    termynal_boxes = doctree.traverse(termynal_box)
+
+def inject_termynal_init(app, doctree, docname):
+    """
+    Injects call to the termynal JavaScript library in documents that have
+    termynal boxes.
+
+    This function is hooked up to the `doctree-resolved` Sphinx event.
+    """
     # skip pages without at least one termynal box
-    if not termynal_boxes:
+    termynal_boxes = sphinx_term.get_page_boxes(app, docname, 'termynal')
+    if not termynal_boxes or app.builder.format != 'html':
         return
 
-    # ensure that custom files were included
-    for css_file in STATIC_CSS_FILES:
-        _css_file = os.path.basename(css_file)
-        if not sphinx_term.is_css_registered(app, _css_file):
-            app.add_css_file(_css_file)
-    for js_file in STATIC_JS_FILES:
-        _js_file = os.path.basename(js_file)
-        # skip termynal*.js, it's handled by the inject_termynal_init function
-        if not (sphinx_term.is_js_registered(app, _js_file)
-                or _js_file.startswith('termynal')):
-            app.add_js_file(_js_file)
-
-    # add external dependencies
-    script_files = [os.path.basename(i) for i in context['script_files']]
-    for stub, path in DEPENDENCIES.items():
-        if sphinx_term.is_js_registered(app, path) or stub in script_files:
+    # get termynal box ids -- split into the boxes initialised on page load
+    # and the ones initialised lazily once they scroll into view; the boxes
+    # animated with CSS do not need the termynal script
+    termynal_ids, termynal_lazy_ids = [], []
+    for node_id, lazy, css in termynal_boxes:
+        if is_css_animated(app.config, css):
             continue
-        app.add_js_file(path)
-    for _, path in STYLES.items():
-        if sphinx_term.is_css_registered(app, path):
-            continue
-        app.add_css_file(path)
+        if lazy is None:
+            lazy = app.config.sphinx_term_termynal_lazy
+        if lazy:
+            termynal_lazy_ids.append('#{}'.format(node_id))
+        else:
+            termynal_ids.append('#{}'.format(node_id))
+    if not termynal_ids and not termynal_lazy_ids:
+        return
+
+    rel_root = os.path.relpath('.', os.path.dirname(docname))  # app.outdir
+    rel_termynal = os.path.join(
+        rel_root, '_static',
+        sphinx_term.assets.get_bundle(app, 'termynal', 'js'))
+
+    if app.config.sphinx_term_termynal_external:
+        # the lines of the boxes are loaded before they are initialised
+        termynal_function = ('\n\n'
+                             '    <script src="{}" defer>'
+                             '</script>\n'.format(rel_termynal))
+        termynal_function += TERMYNAL_EXTERNAL_INIT.format(
+            '|'.join(termynal_ids), '|'.join(termynal_lazy_ids))
+    elif termynal_lazy_ids:
+        # load termynal without blocking the page; the eagerly initialised
+        # boxes (if any) are still handled by the termynal script itself
+        container = ''
+        if termynal_ids:
+            container = ' data-termynal-container="{}"'.format(
+                '|'.join(termynal_ids))
+        termynal_function = ('\n\n'
+                             '    <script src="{}"{} defer>'
+                             '</script>\n'.format(rel_termynal, container))
+        termynal_function += TERMYNAL_LAZY_INIT.format(
+            '|'.join(termynal_lazy_ids))
+    else:
+        termynal_function = ('\n\n'
+                             '    <script src="{}" '
+                             'data-termynal-container="{}">'
+                             '</script>\n'.format(rel_termynal,
+                                                  '|'.join(termynal_ids)))
+    # `format='html'` is crucial to avoid escaping html characters
+    script_node = nodes.raw(
+        termynal_function, termynal_function, format='html')
+    # add the call node to the document
+    doctree.append(script_node)
+
+
+#### Extension setup ##########################################################
 
 
 def setup(app):
     """
     Sets up the Sphinx extension for the `termynal` directive.
     """
-    # register two Sphinx config values used for the extension
+    # register the Sphinx config values used for the extension
     app.add_config_value('sphinx_term_termynal_dir', None, 'env')
-
-    # register the custom docutils nodes with Sphinx
+    app.add_config_value('sphinx_term_termynal_lazy', False, 'html')
+    app.add_config_value('sphinx_term_termynal_external', False, 'html')
+    app.add_config_value('sphinx_term_termynal_css', False, 'html')
+    app.add_config_value('sphinx_term_termynal_defaults', {}, 'html')
+
+    # load the environment and event handlers shared with other sphinx_term
+    # extensions
+    app.setup_extension('sphinx_term.shared')
+
+    # register the custom docutils nodes with Sphinx -- only HTML builders
+    # write them since the boxes are replaced with their snapshots for the
+    # other builders (see `sphinx_term.snapshot`)
     app.add_node(
         termynal_box,
-        html=(visit_termynal_box_node, depart_termynal_box_node),
-        latex=(visit_termynal_box_node_, depart_termynal_box_node_),
-        text=(visit_termynal_box_node_, depart_termynal_box_node_)
+        html=(sphinx_term.instrument_visitor(
+                  'termynal', visit_termynal_box_node),
+              sphinx_term.instrument_visitor(
+                  'termynal', depart_termynal_box_node))
     )
+    # (termynal lines are only written within -- and timed with -- the
+    # visitor of their termynal box)
     app.add_node(
         termynal_line,
-        html=(visit_termynal_line_node, depart_termynal_line_node),
-        latex=(visit_termynal_line_node_, depart_termynal_line_node_),
-        text=(visit_termynal_line_node_, depart_termynal_line_node_)
+        html=(visit_termynal_line_node, depart_termynal_line_node)
     )
 
     # register the custom role and directives with Sphinx
     app.add_directive('termynal', Termynal)
 
+    # index termynal boxes (and their labels) when documents are read
+    sphinx_term.register_box_type('termynal', termynal_box, index_box)
+    # read (and parse) the transcript files of the documents ahead of the
+    # directives
+    sphinx_term.prefetch.register_transcripts(
+        'termynal', get_transcript_path, get_transcript_parser)
+    # bundle the static files and load them on the pages with termynal boxes
+    # -- the termynal script is loaded by the `inject_termynal_init` function
+    sphinx_term.assets.register_static_files(
+        'termynal', STATIC_CSS_FILES, STATIC_JS_FILES,
+        js_dependencies=DEPENDENCIES, css_dependencies=STYLES,
+        load_js=False)
+    # (the externalised termynal lines are saved in the `_static` folder)
+    sphinx_term.assets.register_static_data_dir(EXTERNAL_DATA_DIR)
+
     # connect custom hooks to the Sphinx build process
-    app.connect('doctree-read', assign_reference_title)
+    app.connect('builder-inited', init_termynal_defaults)
     app.connect('doctree-resolved', inject_termynal_init)
-    app.connect('doctree-resolved', validate_termynal_lines)
-    # ...ensure the required static files are **copied** into the build
-    app.connect('builder-inited', include_static_files)
-    # ...ensure that relevant html output pages **load** the static files
-    app.connect('html-page-context', load_static_files)
 
-    return {'version': sphinx_term.VERSION}
+    return {'version': sphinx_term.VERSION,
+            # the version of the doctree representation of termynal boxes
+            # (and of their cached transcripts) -- the environments pickled
+            # with a different version are re-read
+            'env_version': 3,
+            'parallel_read_safe': True,
+            'parallel_write_safe': True}
@@ -0,0 +1,64 @@
+# Copyright (C) 2021
+# Author: Kacper Sokol <ks1591@my.bristol.ac.uk>
+# License: new BSD
+"""
+Shared helpers of the `sphinx_term` tests -- writing Sphinx projects and
+building them in fresh processes.
+"""
+
+import os
+import subprocess
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# test the working copy of the extension rather than the installed one (if
+# any)
+sys.path.insert(0, ROOT)
+
+
+def write(path, contents):
+    """Writes a text file, creating its directory if necessary."""
+    directory = os.path.dirname(path)
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    with open(path, 'w') as f:
+        f.write(contents)
+
+
+def build(srcdir, outdir, jobs=1, builder='html', overrides=None):
+    """
+    Builds a Sphinx project in a fresh process (with the `overrides` config
+    values) and returns the build warnings.
+    """
+    env = dict(os.environ)
+    paths = [ROOT]
+    if env.get('PYTHONPATH'):
+        paths.append(env['PYTHONPATH'])
+    env['PYTHONPATH'] = os.pathsep.join(paths)
+    command = [sys.executable, '-m', 'sphinx', '-q', '-j', str(jobs),
+               '-b', builder, srcdir, outdir]
+    for name, value in sorted((overrides or {}).items()):
+        command[-2:-2] = ['-D', '{}={}'.format(name, value)]
+    process = subprocess.run(
+        command, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        universal_newlines=True, env=env)
+    assert process.returncode == 0, process.stderr
+    return process.stderr
+
+
+@pytest.fixture
+def project(tmp_path):
+    """
+    Returns a function writing a Sphinx project -- given as a `{path:
+    contents}` dictionary -- into a temporary source directory, which is
+    returned.
+    """
+    def write_project(files):
+        srcdir = str(tmp_path / 'src')
+        for path, contents in files.items():
+            write(os.path.join(srcdir, *path.split('/')), contents)
+        return srcdir
+    return write_project
@@ -0,0 +1,83 @@
+# Copyright (C) 2021
+# Author: Kacper Sokol <ks1591@my.bristol.ac.uk>
+# License: new BSD
+"""
+Tests the parser of ANSI escape sequences (see `sphinx_term.ansi`).
+"""
+
+import pytest
+
+from sphinx_term.ansi import parse_ansi, render_ansi_lines
+
+BOLD_RED = ('ansi-bold ansi-fg-1', '')
+
+
+@pytest.mark.parametrize('text', [
+    '\x1b[1;31mred\x1b[0m plain',
+    '\x1b[1;31mred\x1b[m plain',
+    '\x1b[1;31mred\x1b[22;39m plain'
+], ids=['reset', 'empty-reset', 'attribute-reset'])
+def test_reset(text):
+    """Tests that the SGR attributes are reset."""
+    assert parse_ansi(text) == ('red plain', [(3, BOLD_RED), (6, None)])
+
+
+def test_merged_runs():
+    """Tests that the adjacent fragments with the same style are merged."""
+    text, runs = parse_ansi('\x1b[31;1mab\x1b[1;31mcd\x1b[0m')
+    assert (text, runs) == ('abcd', [(4, BOLD_RED)])
+
+
+def test_palette_colours():
+    """Tests the colours of the 256-colour palette."""
+    text, runs = parse_ansi(
+        '\x1b[38;5;9ma\x1b[38;5;196mb\x1b[48;5;240mc\x1b[38;5;300md')
+    assert text == 'abcd'
+    assert runs == [(1, ('ansi-fg-9', '')),
+                    (1, ('', 'color:#ff0000')),
+                    (2, ('', 'color:#ff0000;background-color:#585858'))]
+
+
+def test_truecolor():
+    """Tests the RGB colours (invalid colours are ignored)."""
+    text, runs = parse_ansi(
+        '\x1b[38;2;1;2;3ma\x1b[38;2;300;0;0mb\x1b[48;2;255;255;255mc')
+    assert text == 'abc'
+    assert runs == [(2, ('', 'color:#010203')),
+                    (1, ('', 'color:#010203;background-color:#ffffff'))]
+
+
+def test_inverse():
+    """Tests that inverted default colours are styled explicitly."""
+    assert parse_ansi('\x1b[7mi\x1b[27mn') == (
+        'in', [(1, ('ansi-fg-inverse ansi-bg-inverse', '')), (1, None)])
+
+
+@pytest.mark.parametrize('text, plain', [
+    ('a\x1b', 'a'),
+    ('a\x1b[31', 'a31'),
+    ('a\x1b[38;5m', 'a'),
+    ('a\x1b[38;2;1mb', 'ab'),
+    ('a\x1b]0;title\nb', 'a\nb')
+], ids=['escape', 'csi', 'palette', 'rgb', 'osc'])
+def test_unterminated_escapes(text, plain):
+    """
+    Tests that incomplete escape sequences are removed without styling the
+    text.
+    """
+    assert parse_ansi(text) == (plain, [(len(plain), None)])
+
+
+def test_removed_escapes():
+    """Tests that the escape sequences other than SGR are removed."""
+    text = '\x1b[2K\x1b[1Ga\x1b]8;;https://example.com\x07b\x1b]8;;\x07\x1b(B'
+    assert parse_ansi(text) == ('ab', [(2, None)])
+
+
+def test_render_lines():
+    """Tests that the style spans are closed at the end of each line."""
+    text, runs = parse_ansi('\x1b[31ma\nb<\x1b[0mc')
+    lines = render_ansi_lines(
+        text, runs, lambda s: s.replace('<', '&lt;'))
+    assert lines == ['<span class="ansi-fg-1">a</span>',
+                     '<span class="ansi-fg-1">b&lt;</span>c']
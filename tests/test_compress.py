@@ -0,0 +1,56 @@
+# Copyright (C) 2021
+# Author: Kacper Sokol <ks1591@my.bristol.ac.uk>
+# License: new BSD
+"""
+Tests the precompression of the HTML build artifacts of terminal boxes.
+"""
+
+import glob
+import gzip
+import os
+
+from conftest import build
+
+CONF = """\
+extensions = ['sphinx_term']
+sphinx_term_cssterm_dir = 'cssterm'
+sphinx_term_termynal_dir = 'termynal'
+sphinx_term_cssterm_virtual_lines = 10
+sphinx_term_termynal_external = True
+sphinx_term_precompress = ['gz']
+"""
+
+INDEX = """\
+Index
+=====
+
+.. cssterm:: cssterm:large
+
+.. termynal:: termynal:large
+"""
+
+
+def test_precompress_static_data(project, tmp_path):
+    """
+    Tests that the line data of virtualised cssterm boxes and externalised
+    termynal boxes are precompressed.
+    """
+    srcdir = project({
+        'conf.py': CONF,
+        'index.rst': INDEX,
+        'cssterm/large.log': ''.join(
+            '$ echo {0}\n{0}\n'.format(i) for i in range(100)),
+        'termynal/large.yml': ''.join(
+            '- value: echo {0}\n  type: input\n- "{0}"\n'.format(i)
+            for i in range(100))
+    })
+    outdir = str(tmp_path / 'html')
+    build(srcdir, outdir)
+
+    for directory in ('sphinx_term/cssterm', 'transcripts'):
+        data = sorted(glob.glob(
+            os.path.join(outdir, '_static', directory, '*.json')))
+        assert data, directory
+        for path in data:
+            with open(path, 'rb') as f, gzip.open(path + '.gz', 'rb') as g:
+                assert f.read() == g.read()
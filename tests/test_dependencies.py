@@ -0,0 +1,83 @@
+# Copyright (C) 2021
+# Author: Kacper Sokol <ks1591@my.bristol.ac.uk>
+# License: new BSD
+"""
+Tests that the documents loading terminal transcripts are re-read when the
+content of their transcripts changes (see
+`sphinx_term.get_outdated_documents`).
+"""
+
+import os
+
+from conftest import build, write
+
+CONF = """\
+extensions = ['sphinx_term']
+sphinx_term_cssterm_dir = 'cssterm'
+sphinx_term_termynal_dir = 'termynal'
+"""
+
+INDEX = """\
+Index
+=====
+
+.. toctree::
+
+   cssterm
+   termynal
+"""
+
+
+def touch(path):
+    """Moves the modification time of a file forward."""
+    stat = os.stat(path)
+    os.utime(path, (stat.st_atime + 10, stat.st_mtime + 10))
+
+
+def get_read_times(outdir):
+    """Returns the modification times of the doctrees of the documents."""
+    return {name: os.stat(os.path.join(
+                outdir, '.doctrees', '{}.doctree'.format(name))).st_mtime_ns
+            for name in ('index', 'cssterm', 'termynal')}
+
+
+def test_content_dependencies(project, tmp_path):
+    """
+    Tests that only the documents whose transcripts changed content are
+    re-read.
+    """
+    srcdir = project({
+        'conf.py': CONF,
+        'index.rst': INDEX,
+        'cssterm.rst': 'Cssterm\n=======\n\n.. cssterm:: cssterm:box\n',
+        'termynal.rst': 'Termynal\n========\n\n.. termynal:: termynal:box\n',
+        'cssterm/box.log': '$ echo one\none\n',
+        'termynal/box.yml': '- value: echo one\n  type: input\n- one\n'
+    })
+    outdir = str(tmp_path / 'html')
+    build(srcdir, outdir)
+    read_times = get_read_times(outdir)
+
+    # a new modification time alone does not re-read the documents
+    touch(os.path.join(srcdir, 'cssterm', 'box.log'))
+    touch(os.path.join(srcdir, 'termynal', 'box.yml'))
+    build(srcdir, outdir)
+    assert get_read_times(outdir) == read_times
+
+    # a new content re-reads the documents loading the transcript
+    write(os.path.join(srcdir, 'termynal', 'box.yml'),
+          '- value: echo two\n  type: input\n- two\n')
+    build(srcdir, outdir)
+    new_read_times = get_read_times(outdir)
+    assert new_read_times['termynal'] != read_times['termynal']
+    assert new_read_times['cssterm'] == read_times['cssterm']
+    assert new_read_times['index'] == read_times['index']
+    with open(os.path.join(outdir, 'termynal.html')) as f:
+        assert 'echo two' in f.read()
+
+    # (the file size does not change)
+    write(os.path.join(srcdir, 'cssterm', 'box.log'), '$ echo two\ntwo\n')
+    build(srcdir, outdir)
+    assert get_read_times(outdir)['cssterm'] != read_times['cssterm']
+    with open(os.path.join(outdir, 'cssterm.html')) as f:
+        assert 'echo two' in f.read()
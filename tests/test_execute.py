@@ -0,0 +1,68 @@
+# Copyright (C) 2021
+# Author: Kacper Sokol <ks1591@my.bristol.ac.uk>
+# License: new BSD
+"""
+Tests the caching of executed terminal boxes (see `sphinx_term.execute`).
+"""
+
+import os
+
+from conftest import build, write
+
+CONF = """\
+extensions = ['sphinx_term']
+sphinx_term_execute = True
+sphinx_term_execute_cwd = '.'
+"""
+
+INDEX = """\
+Index
+=====
+
+.. toctree::
+
+   other
+
+.. cssterm:: cssterm:run
+   :execute:
+
+   ls | sed 's/^/file:/'
+   cat data.txt
+   date +%s%N
+"""
+
+
+def read_index(outdir):
+    """Reads the HTML page of the executed box."""
+    with open(os.path.join(outdir, 'index.html')) as f:
+        return f.read()
+
+
+def test_working_directory(project, tmp_path):
+    """
+    Tests that the executed commands neither see nor depend on the Sphinx
+    sources and build directories, but do depend on the remaining files of
+    their working directory.
+    """
+    srcdir = project({
+        'conf.py': CONF,
+        'index.rst': INDEX,
+        'other.rst': 'Other\n=====\n',
+        'data.txt': 'first\n'
+    })
+    outdir = os.path.join(srcdir, '_build', 'html')
+    build(srcdir, outdir)
+    html = read_index(outdir)
+    assert 'first' in html and 'file:data.txt' in html
+    assert 'file:index.rst' not in html and 'file:other.rst' not in html
+
+    # editing a document does not run the commands again
+    write(os.path.join(srcdir, 'other.rst'), 'Other\n=====\n\nChanged.\n')
+    build(srcdir, outdir)
+    assert read_index(outdir) == html
+
+    # editing a file of the working directory does
+    write(os.path.join(srcdir, 'data.txt'), 'second\n')
+    build(srcdir, outdir)
+    html = read_index(outdir)
+    assert 'second' in html and 'first' not in html
@@ -0,0 +1,144 @@
+# Copyright (C) 2021
+# Author: Kacper Sokol <ks1591@my.bristol.ac.uk>
+# License: new BSD
+"""
+Tests the standalone linter of terminal transcripts (see `sphinx_term.lint`).
+"""
+
+import os
+
+from conftest import write
+from sphinx_term import lint
+
+RST = """\
+Title
+=====
+
+.. termynal:: termynal:one
+   :Prompt: >
+   :noInit:
+
+   - value: ls
+     type: input
+   - out
+
+.. note::
+
+   .. cssterm:: cssterm:two
+      :tail: 3
+
+Paragraph.
+"""
+
+MYST = """\
+# Title
+
+```{termynal} termynal:one
+---
+prompt: '>'
+noInit: true
+lineDelay:
+---
+- ls
+```
+
+::::{cssterm} cssterm:two
+:tail: 3
+
+$ ls
+::::
+
+````{cssterm} cssterm:three
+```
+````
+"""
+
+
+def test_rst_directives():
+    """Tests the scanning of reST sources."""
+    one, two = lint.find_rst_directives(RST.splitlines())
+
+    assert (one.name, one.argument) == ('termynal', 'termynal:one')
+    # docutils lowercases the option names
+    assert list(one.options.items()) == [('prompt', '>'), ('noinit', '')]
+    assert one.content == ['- value: ls', '  type: input', '- out']
+    assert (one.lineno, one.content_lineno) == (4, 8)
+
+    # nested directives are found as well
+    assert (two.name, two.argument) == ('cssterm', 'cssterm:two')
+    assert list(two.options.items()) == [('tail', '3')]
+    assert two.content == []
+    assert two.lineno == 14
+
+
+def test_myst_directives():
+    """Tests the scanning of MyST sources."""
+    one, two, three = lint.find_myst_directives(MYST.splitlines())
+
+    # the options are given as a YAML block
+    assert (one.name, one.argument) == ('termynal', 'termynal:one')
+    assert list(one.options.items()) == [
+        ('prompt', '>'), ('noInit', 'true'), ('lineDelay', '')]
+    assert one.content == ['- ls']
+    assert (one.lineno, one.content_lineno) == (3, 9)
+
+    # the options are given as a field list of a colon fence
+    assert (two.name, two.argument) == ('cssterm', 'cssterm:two')
+    assert list(two.options.items()) == [('tail', '3')]
+    assert two.content == ['$ ls']
+    assert (two.lineno, two.content_lineno) == (12, 15)
+
+    # shorter fences are part of the content
+    assert three.argument == 'cssterm:three'
+    assert three.content == ['```']
+
+
+def test_source_directives(tmp_path):
+    """Tests that content source files are scanned by their extension."""
+    rst, md = str(tmp_path / 'index.rst'), str(tmp_path / 'index.md')
+    write(rst, RST)
+    write(md, MYST)
+    assert len(lint.find_source_directives(rst)) == 2
+    assert len(lint.find_source_directives(md)) == 3
+    assert lint.find_source_directives(str(tmp_path / 'missing.rst')) == []
+
+
+def test_lint_transcripts():
+    """Tests that transcript errors are reported with their line numbers."""
+    errors = lint.lint_termynal_transcript(
+        '- value: ls\n  type: input\n- value: x\n  type: bogus\n', lineno=5)
+    assert [line for line, _ in errors] == [7]
+    errors = lint.lint_termynal_transcript('- a\n- [', lineno=1)
+    assert [line for line, _ in errors] == [3]
+    assert 'YAML' in errors[0][1]
+
+    assert lint.lint_cssterm_transcript(b'ok\n') == []
+    errors = lint.lint_cssterm_transcript(b'ok\n\xff\n')
+    assert [line for line, _ in errors] == [2]
+
+
+def test_lint(tmp_path, capsys):
+    """Tests the linter command line tool."""
+    termynal_dir = str(tmp_path / 'termynal')
+    cssterm_dir = str(tmp_path / 'cssterm')
+    write(os.path.join(termynal_dir, 'one.yml'), '- value: ls\n  type: x\n')
+    write(os.path.join(cssterm_dir, 'two.log'), '$ ls\n')
+    source = str(tmp_path / 'index.rst')
+    write(source, RST.replace('type: input', 'type: bogus').replace(
+        ':tail: 3', ':tail: three'))
+    write(str(tmp_path / 'missing.rst'), '.. cssterm:: cssterm:missing\n')
+
+    arguments = ['-j', '1', '-t', termynal_dir, '-c', cssterm_dir,
+                 str(tmp_path)]
+    assert lint.main(arguments) == 1
+    errors = sorted(
+        line.split(':', 2)[:2] for line in
+        capsys.readouterr().out.splitlines())
+    # (docutils lowercases the `noInit` option name of reST sources)
+    assert errors == sorted([
+        [source, '4'], [source, '8'], [source, '14'],
+        [str(tmp_path / 'missing.rst'), '1'],
+        [os.path.join(termynal_dir, 'one.yml'), '1']])
+
+    write(os.path.join(termynal_dir, 'one.yml'), '- value: ls\n')
+    assert lint.main(['-t', termynal_dir, '-c', cssterm_dir]) == 0
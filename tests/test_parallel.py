@@ -0,0 +1,143 @@
+# Copyright (C) 2021
+# Author: Kacper Sokol <ks1591@my.bristol.ac.uk>
+# License: new BSD
+"""
+Tests that serial (`-j1`) and parallel (`-j8`) builds of multi-document
+projects produce the same HTML.
+"""
+
+import filecmp
+import os
+
+import pytest
+
+from conftest import build, write
+
+CONF = """\
+extensions = ['sphinx_term']
+sphinx_term_termynal_dir = 'termynal'
+sphinx_term_cssterm_dir = 'cssterm'
+"""
+
+PAGE = """\
+Page {page}
+=======
+
+.. termynal:: termynal:{termynal}
+
+.. cssterm:: cssterm:{cssterm}
+
+See :ref:`termynal:{termynal}`, :ref:`cssterm:{cssterm}` and
+:ref:`the shared box <termynal:shared>`.
+"""
+
+INDEX = """\
+Index
+=====
+
+.. toctree::
+
+{toctree}
+
+See :ref:`termynal:shared` and :ref:`cssterm:shared`.
+"""
+
+TERMYNAL = """\
+- value: echo {name}
+  type: input
+- {name}
+"""
+
+CSSTERM = """\
+$ echo {name}
+{name}
+"""
+
+PAGES = 12
+
+
+def make_project(srcdir, shared):
+    """
+    Creates a project of `PAGES` documents, each displaying a termynal and
+    a cssterm box; the first `shared` documents display the same transcripts
+    (and hence share the labels of their terminal boxes).
+    """
+    write(os.path.join(srcdir, 'conf.py'), CONF)
+    names = ['box{}'.format(page) for page in range(PAGES)]
+    names[:shared] = ['shared'] * shared
+    for page, name in enumerate(names):
+        write(os.path.join(srcdir, 'page{}.rst'.format(page)),
+              PAGE.format(page=page, termynal=name, cssterm=name))
+    for name in set(names):
+        write(os.path.join(srcdir, 'termynal', name + '.yml'),
+              TERMYNAL.format(name=name))
+        write(os.path.join(srcdir, 'cssterm', name + '.log'),
+              CSSTERM.format(name=name))
+    toctree = '\n'.join('   page{}'.format(page) for page in range(PAGES))
+    write(os.path.join(srcdir, 'index.rst'), INDEX.format(toctree=toctree))
+
+
+def touch(path):
+    """Moves the modification time of a file forward."""
+    stat = os.stat(path)
+    os.utime(path, (stat.st_atime + 10, stat.st_mtime + 10))
+
+
+def compare_builds(left, right):
+    """Returns the files that differ between two HTML build directories."""
+    differences = []
+    ignore = ['.doctrees', '.buildinfo']
+    stack = [filecmp.dircmp(left, right, ignore=ignore)]
+    while stack:
+        comparison = stack.pop()
+        differences.extend(
+            os.path.join(comparison.left, name) for name in
+            comparison.left_only + comparison.right_only +
+            comparison.diff_files + comparison.funny_files)
+        # `dircmp` compares the files shallowly (by their stat signatures)
+        _, mismatch, errors = filecmp.cmpfiles(
+            comparison.left, comparison.right, comparison.common_files,
+            shallow=False)
+        differences.extend(
+            os.path.join(comparison.left, name) for name in mismatch + errors)
+        stack.extend(comparison.subdirs.values())
+    return sorted(set(differences))
+
+
+@pytest.mark.parametrize('shared', [1, 6], ids=['unique', 'shared'])
+def test_parallel_build(tmp_path, shared):
+    """Tests that serial and parallel builds produce the same HTML."""
+    srcdir = str(tmp_path / 'src')
+    make_project(srcdir, shared)
+
+    serial = str(tmp_path / 'serial')
+    parallel = str(tmp_path / 'parallel')
+    assert 'WARNING' not in build(srcdir, serial, 1)
+    assert 'WARNING' not in build(srcdir, parallel, 8)
+    assert compare_builds(serial, parallel) == []
+
+    # the labels shared by many documents resolve to the first document
+    with open(os.path.join(serial, 'index.html')) as f:
+        index = f.read()
+    assert 'href="page0.html#termynal-shared"' in index
+    assert 'href="page0.html#cssterm-shared"' in index
+
+
+def test_incremental_build(tmp_path):
+    """
+    Tests that re-reading documents that share terminal box labels neither
+    raises duplicate label warnings nor changes the HTML.
+    """
+    srcdir = str(tmp_path / 'src')
+    make_project(srcdir, 6)
+
+    serial = str(tmp_path / 'serial')
+    parallel = str(tmp_path / 'parallel')
+    build(srcdir, serial, 1)
+    build(srcdir, parallel, 8)
+
+    for pages, jobs in (([3], 1), ([0, 5], 8)):
+        for page in pages:
+            touch(os.path.join(srcdir, 'page{}.rst'.format(page)))
+        assert 'WARNING' not in build(srcdir, serial, jobs)
+        assert compare_builds(serial, parallel) == []
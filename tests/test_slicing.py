@@ -0,0 +1,188 @@
+# Copyright (C) 2021
+# Author: Kacper Sokol <ks1591@my.bristol.ac.uk>
+# License: new BSD
+"""
+Tests the slicing of cssterm transcripts (see `sphinx_term.slicing`).
+"""
+
+import os
+import random
+
+import pytest
+
+from conftest import build
+from sphinx_term.slicing import (
+    LineIndex, decode_slice, slice_buffer, slice_transcript)
+
+CONF = """\
+extensions = ['sphinx_term']
+sphinx_term_cssterm_dir = 'cssterm'
+"""
+
+LOG = ''.join('line {}\n'.format(i) for i in range(1, 6))
+
+SECTION = 'a\n=== BEGIN ===\nb\nc\n=== END ===\nd\n'
+
+
+@pytest.mark.parametrize('block', [1, 2, 3, 7, 1024])
+def test_line_index(block):
+    """
+    Tests that the sparse line index agrees with the line offsets for any
+    block size.
+    """
+    rng = random.Random(block)
+    buffer = ''.join(rng.choice('ab\n') for _ in range(200)).encode('utf-8')
+    index = LineIndex(buffer, block=block)
+    starts = [0] + [i + 1 for i, byte in enumerate(buffer) if byte == 10]
+
+    assert index.newlines == buffer.count(b'\n')
+    for line, start in enumerate(starts):
+        assert index.line_start(buffer, line) == start
+    assert index.line_start(buffer, len(starts)) == len(buffer)
+    for offset in range(len(buffer) + 1):
+        assert index.line_at(buffer, offset) == (
+            buffer[:offset].count(b'\n'))
+
+
+def test_empty_line_index():
+    """Tests the line index of an empty transcript."""
+    index = LineIndex(b'')
+    assert index.newlines == 0
+    assert index.line_at(b'', 0) == 0
+    assert index.line_start(b'', 0) == 0
+    assert index.line_start(b'', 1) == 0
+
+
+@pytest.mark.parametrize('contents, options, expected', [
+    ('a\nb\nc\nd\n', {'lines': '2-3'}, 'b\nc'),
+    ('a\nb\nc\nd\n', {'lines': '1-1'}, 'a'),
+    ('a\nb\nc\nd\n', {'lines': '3-10'}, 'c\nd'),
+    ('a\nb\nc\nd', {'lines': '4-4'}, 'd'),
+    ('a\nb\nc\nd\n', {'tail': '1'}, 'd'),
+    ('a\nb\nc\nd', {'tail': '2'}, 'c\nd'),
+    ('a\nb\nc\nd\n', {'tail': '10'}, 'a\nb\nc\nd'),
+    ('a\r\nb\r\nc\r\n', {'lines': '2-2'}, 'b'),
+    ('a\r\nb\r\nc\r\n', {'tail': '2'}, 'b\nc'),
+    ('a\r\nb\r\nc', {'tail': '1'}, 'c'),
+    (SECTION, {'start-after': '=== BEGIN ==='}, 'b\nc\n=== END ===\nd'),
+    (SECTION, {'end-before': '=== END ==='}, 'a\n=== BEGIN ===\nb\nc'),
+    (SECTION, {'start-after': 'BEGIN', 'end-before': 'END',
+               'lines': '2-5'}, 'c'),
+    (SECTION, {'start-after': 'BEGIN', 'end-before': 'END',
+               'tail': '5'}, 'b\nc')
+], ids=['lines', 'first-line', 'lines-past-end', 'no-trailing-newline',
+        'tail', 'tail-no-trailing-newline', 'tail-past-start', 'crlf-lines',
+        'crlf-tail', 'crlf-no-trailing-newline', 'start-after',
+        'end-before', 'section-lines', 'section-tail'])
+def test_slice_transcript(contents, options, expected):
+    """
+    Tests the lines selected by the slicing options, which do not depend on
+    the blocks of the line index.
+    """
+    assert slice_transcript(contents, options) == expected
+
+    buffer = contents.encode('utf-8')
+    start, end = slice_buffer(
+        buffer, options, lambda: LineIndex(buffer, block=2))
+    assert decode_slice(buffer[start:end]) == expected
+
+
+@pytest.mark.parametrize('contents, options, message', [
+    ('a\nb\n', {'lines': '3-4'}, 'select no lines'),
+    ('a\n=== BEGIN ===', {'start-after': '=== BEGIN ==='},
+     'select no lines'),
+    (SECTION, {'start-after': 'END', 'end-before': 'BEGIN'},
+     'end-before'),
+    ('a\n', {'start-after': 'X'}, 'start-after')
+], ids=['lines-past-end', 'empty-section', 'marker-order', 'no-marker'])
+def test_invalid_slice(contents, options, message):
+    """Tests that the slices without any lines are reported."""
+    with pytest.raises(ValueError, match=message):
+        slice_transcript(contents, options)
+
+
+def test_slices_in_one_document(project, tmp_path):
+    """
+    Tests that many slices of one transcript can be displayed and referenced
+    in a single document.
+    """
+    srcdir = project({
+        'conf.py': CONF,
+        'index.rst': """\
+Index
+=====
+
+.. cssterm:: cssterm:log
+   :lines: 2-3
+
+.. cssterm:: cssterm:log
+   :tail: 1
+
+.. cssterm:: cssterm:log
+
+See :ref:`cssterm:log[lines=2-3]`, :ref:`cssterm:log[tail=1]` and
+:ref:`cssterm:log`.
+""",
+        'cssterm/log.log': LOG
+    })
+    outdir = str(tmp_path / 'html')
+    warnings = build(srcdir, outdir)
+    assert 'WARNING' not in warnings and 'ERROR' not in warnings, warnings
+
+    with open(os.path.join(outdir, 'index.html')) as f:
+        index = f.read()
+    for box_id in ('cssterm-log-lines-2-3', 'cssterm-log-tail-1',
+                   'cssterm-log'):
+        assert 'id="{}"'.format(box_id) in index
+        assert 'href="#{}"'.format(box_id) in index
+
+
+def test_duplicate_box(project, tmp_path):
+    """
+    Tests that displaying the same transcript slice twice in a document is
+    reported as an error.
+    """
+    srcdir = project({
+        'conf.py': CONF,
+        'index.rst': """\
+Index
+=====
+
+.. cssterm:: cssterm:log
+   :tail: 1
+
+.. cssterm:: cssterm:log
+   :tail: 1
+""",
+        'cssterm/log.log': LOG
+    })
+    warnings = build(srcdir, str(tmp_path / 'html'))
+    assert 'The cssterm:log[tail=1] terminal box is already displayed' in (
+        warnings)
+
+
+def test_sliced_file(project, tmp_path):
+    """
+    Tests that sliced boxes read the selected lines of their (memory-mapped)
+    transcript files.
+    """
+    srcdir = project({
+        'conf.py': CONF,
+        'index.rst': """\
+Index
+=====
+
+.. cssterm:: cssterm:log
+   :start-after: line 2
+   :lines: 2-3
+""",
+        'cssterm/log.log': LOG.replace('\n', '\r\n')
+    })
+    outdir = str(tmp_path / 'html')
+    warnings = build(srcdir, outdir)
+    assert 'WARNING' not in warnings, warnings
+
+    with open(os.path.join(outdir, 'index.html')) as f:
+        index = f.read()
+    assert 'line 4\nline 5' in index
+    assert 'line 3' not in index and '\r' not in index
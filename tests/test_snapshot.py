@@ -0,0 +1,91 @@
+# Copyright (C) 2021
+# Author: Kacper Sokol <ks1591@my.bristol.ac.uk>
+# License: new BSD
+"""
+Tests the snapshots of terminal boxes (see `sphinx_term.snapshot`).
+"""
+
+import glob
+import os
+
+import pytest
+
+from conftest import build
+
+CONF = """\
+extensions = ['sphinx_term']
+sphinx_term_cssterm_dir = 'cssterm'
+sphinx_term_termynal_dir = 'termynal'
+"""
+
+PAGE = """\
+Page {page}
+=======
+
+.. cssterm:: cssterm:box{page}
+
+.. termynal:: termynal:box{page}
+"""
+
+PAGES = 6
+
+
+@pytest.fixture
+def snapshot_project(project):
+    """Writes a project of `PAGES` documents with terminal boxes."""
+    files = {'conf.py': CONF,
+             'index.rst': 'Index\n=====\n\n.. toctree::\n   :glob:\n\n   *\n'}
+    for page in range(PAGES):
+        files['page{}.rst'.format(page)] = PAGE.format(page=page)
+        files['cssterm/box{}.log'.format(page)] = (
+            '$ echo cssterm{0}\ncssterm{0}\n'.format(page))
+        files['termynal/box{}.yml'.format(page)] = (
+            '- value: echo termynal{0}\n  type: input\n- termynal{0}\n'.format(
+                page))
+    return project(files)
+
+
+@pytest.mark.parametrize('jobs', [1, 4])
+def test_html_snapshots(snapshot_project, tmp_path, jobs):
+    """
+    Tests that the SVG snapshots of HTML builds are copied into the build
+    output by serial and parallel builds.
+    """
+    outdir = str(tmp_path / 'html')
+    warnings = build(snapshot_project, outdir, jobs=jobs,
+                     overrides={'sphinx_term_snapshot_html': 1})
+    assert 'WARNING' not in warnings, warnings
+
+    images = glob.glob(os.path.join(outdir, '_images', '*.svg'))
+    assert len(images) == 2 * PAGES
+    for page in range(PAGES):
+        with open(os.path.join(outdir, 'page{}.html'.format(page))) as f:
+            html = f.read()
+        sources = [os.path.join(outdir, '_images', os.path.basename(image))
+                   for image in images
+                   if '_images/{}'.format(os.path.basename(image)) in html]
+        assert len(sources) == 2
+        assert all(os.path.isfile(source) for source in sources)
+
+
+def test_text_snapshots(snapshot_project, tmp_path):
+    """Tests that text builds receive literal snapshots."""
+    outdir = str(tmp_path / 'text')
+    build(snapshot_project, outdir, builder='text')
+    with open(os.path.join(outdir, 'page0.txt')) as f:
+        text = f.read()
+    assert 'cssterm0' in text and 'termynal0' in text
+
+
+def test_enabled_snapshots(snapshot_project, tmp_path):
+    """
+    Tests that enabling HTML snapshots for an existing build registers the
+    snapshot images.
+    """
+    outdir = str(tmp_path / 'html')
+    build(snapshot_project, outdir)
+    assert not glob.glob(os.path.join(outdir, '_images', '*.svg'))
+    build(snapshot_project, outdir,
+          overrides={'sphinx_term_snapshot_html': 1})
+    assert len(glob.glob(os.path.join(outdir, '_images', '*.svg'))) == (
+        2 * PAGES)
@@ -0,0 +1,94 @@
+# Copyright (C) 2021
+# Author: Kacper Sokol <ks1591@my.bristol.ac.uk>
+# License: new BSD
+"""
+Tests the index of terminal transcript files held by search directories
+(see `sphinx_term.TranscriptIndex`).
+"""
+
+import os
+
+from conftest import build, write
+from sphinx_term import TranscriptIndex
+
+
+def make_directories(tmp_path, files):
+    """Creates empty transcript files given their paths."""
+    for path in files:
+        write(str(tmp_path.joinpath(*path.split('/'))), '$ ls\n')
+    return str(tmp_path / 'first'), str(tmp_path / 'second')
+
+
+def test_search_order(tmp_path):
+    """
+    Tests that earlier search directories shadow later ones and that ids
+    hold the paths relative to a search directory.
+    """
+    first, second = make_directories(tmp_path, [
+        'first/shared.log', 'first/nested/deep.log', 'second/shared.log',
+        'second/only.log', 'second/nested/deep.log', 'second/other.yml'])
+    index = TranscriptIndex([first, second], '.log')
+
+    assert len(index) == 3
+    assert index.find('shared') == (os.path.join(first, 'shared.log'), [])
+    assert index.find('only') == (os.path.join(second, 'only.log'), [])
+    assert index.find('nested/deep') == (
+        os.path.join(first, 'nested', 'deep.log'), [])
+    assert index.find('other') == (None, [])
+    assert index.find('missing') == (None, [])
+
+
+def test_subdirectory_names(tmp_path):
+    """
+    Tests that ids without `/` find the files of subdirectories, and that
+    ambiguous ids list all their candidates in the search order.
+    """
+    first, second = make_directories(tmp_path, [
+        'first/a/unique.log', 'first/b/twice.log', 'first/a/twice.log',
+        'second/c/twice.log'])
+    index = TranscriptIndex([first, second], '.log')
+
+    assert index.find('unique') == (
+        os.path.join(first, 'a', 'unique.log'), [])
+    candidates = [os.path.join(first, 'a', 'twice.log'),
+                  os.path.join(first, 'b', 'twice.log'),
+                  os.path.join(second, 'c', 'twice.log')]
+    assert index.find('twice') == (candidates[0], candidates)
+
+
+def test_skipped_directories(tmp_path):
+    """
+    Tests that hidden directories, symbolic links to directories and missing
+    search directories are skipped.
+    """
+    first, second = make_directories(tmp_path, [
+        'first/.hidden/hidden.log', 'outside/linked.log'])
+    os.symlink(str(tmp_path / 'outside'), os.path.join(first, 'link'))
+    index = TranscriptIndex([first, second], '.log')
+
+    assert len(index) == 0
+    assert index.find('hidden') == (None, [])
+    assert index.find('link/linked') == (None, [])
+
+
+def test_shadowing_rebuild(project, tmp_path):
+    """
+    Tests that adding a transcript to an earlier search directory re-reads
+    the documents whose boxes now resolve to it.
+    """
+    srcdir = project({
+        'conf.py': ("extensions = ['sphinx_term']\n"
+                    "sphinx_term_cssterm_dir = ['first', 'second']\n"),
+        'index.rst': 'Index\n=====\n\n.. cssterm:: cssterm:box\n',
+        'first/other.log': '$ ls\n',
+        'second/box.log': '$ echo second\n'
+    })
+    outdir = str(tmp_path / 'html')
+    build(srcdir, outdir)
+    with open(os.path.join(outdir, 'index.html')) as f:
+        assert 'echo second' in f.read()
+
+    write(os.path.join(srcdir, 'first', 'box.log'), '$ echo first\n')
+    build(srcdir, outdir)
+    with open(os.path.join(outdir, 'index.html')) as f:
+        assert 'echo first' in f.read()